@@ -0,0 +1,356 @@
+#!/usr/bin/python
+
+"""Benchmarks every plugin and some common plugin chains.
+
+Each case runs over synthetic input of several sizes and reports throughput,
+per-call latency percentiles and the peak memory one call allocates. Every
+case runs in its own process, started after its input has been generated, so
+that a case which crashes or runs out of memory does not stop the others.
+
+benchmark.py [-s <size> ...] [-k <filter>] [-o <results.json>]
+             [-c <baseline.json> [-t <threshold>]]
+ -s: Input sizes in bytes, default 100 10000 1000000 100000000.
+ -k: Only run cases whose name contains this string.
+ -o: Write the results as JSON for comparison with a later run.
+ -c: Compare the results against an earlier JSON file and exit with status 1
+     if any case lost more than the threshold fraction of its throughput.
+
+Examples:
+  ./benchmark.py -o before.json
+  ./benchmark.py -c before.json -o after.json
+  - Benchmarks every case before and after a change and flags regressions.
+
+  ./benchmark.py -s 1000000 -k Xor
+  - Benchmarks only the XOR plugins on 1 MB inputs.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import print_function
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import argparse
+import base64
+import binascii
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+
+try:
+  import queue
+except ImportError:
+  # Python 2
+  import Queue as queue
+
+try:
+  import tracemalloc
+except ImportError:
+  # Python 2
+  tracemalloc = None
+
+import plugin_handler
+from plugins import compat
+
+DEFAULT_SIZES = (100, 10 ** 4, 10 ** 6, 10 ** 8)
+# Each case is called repeatedly until it has run for this many seconds, or
+# for MAX_CALLS calls, but at least MIN_CALLS times.
+MIN_TIME = 0.5
+MIN_CALLS = 3
+MAX_CALLS = 10000
+DEFAULT_THRESHOLD = 0.1
+# A case is reported as failed if its process has not returned a result after
+# this many seconds. The process is checked for an early exit every
+# POLL_INTERVAL seconds.
+CASE_TIMEOUT = 3600
+POLL_INTERVAL = 1
+
+WORDS = (b'the', b'of', b'and', b'to', b'in', b'is', b'that', b'for', b'it',
+         b'as', b'was', b'with', b'be', b'by', b'on', b'not', b'he', b'this',
+         b'are', b'or', b'payload', b'http://example.com/', b'eval',
+         b'document.write', b'alert')
+
+
+def RandomText(size):
+  """Returns size characters of text made of random words."""
+  block = b' '.join(random.choice(WORDS) for _ in compat.xrange(8192))
+  return (block * (size // len(block) + 1))[:size]
+
+
+def RandomBytes(size):
+  return os.urandom(size)
+
+
+def Base64Text(size):
+  return base64.b64encode(RandomBytes(size * 3 // 4))
+
+
+def UrlSafeBase64Text(size):
+  return base64.urlsafe_b64encode(RandomBytes(size * 3 // 4))
+
+
+def HexText(size):
+  return binascii.hexlify(RandomBytes(size // 2))
+
+
+def UrlEncodedText(size):
+  return compat.UrlQuote(RandomText(size // 2))[:size]
+
+
+def CharCodeText(size):
+  return b','.join(b'%d' % c for c in bytearray(RandomText(size // 4)))
+
+
+def DomainText(size):
+  return b'.'.join([u'm\xfcnchen'.encode('utf-8')] * (size // 9))
+
+
+def PunycodeText(size):
+  return b'.'.join([b'xn--mnchen-3ya'] * (size // 15))
+
+
+def HexOfBase64Text(size):
+  return base64.b64encode(HexText(size * 3 // 4))
+
+
+def UrlEncodedBase64Text(size):
+  return compat.UrlQuote(Base64Text(size))
+
+
+# Input generator and options for each plugin. Plugins not listed get random
+# text and empty options.
+PLUGIN_INPUTS = {
+    'Base 64 decode': (Base64Text, []),
+    'URL-safe Base 64 decode': (UrlSafeBase64Text, []),
+    'Hex2Ascii': (HexText, []),
+    'Hex decode': (HexText, ['']),
+    'Url decode': (UrlEncodedText, []),
+    'fromCharCode': (CharCodeText, []),
+    'Punycode encode': (DomainText, []),
+    'Punycode decode': (PunycodeText, []),
+    'Replace': (RandomText, ['a', 'b']),
+    'Multi replace': (RandomText, ['the=THE,and=AND,a=b,an=n', '']),
+    'Xor': (RandomBytes, ['ba']),
+    'Incremental Xor': (RandomBytes, ['ba']),
+    'Brute force Xor': (RandomBytes, []),
+    'Brute force Incremental Xor': (RandomBytes, []),
+    'Repeating key Xor': (RandomBytes, ['deadbeef']),
+}
+
+# Realistic chains: (case name, input generator, plugins).
+CHAINS = (
+    ('Base 64 decode -> Hex2Ascii', HexOfBase64Text,
+     [{'name': 'Base 64 decode', 'options': []},
+      {'name': 'Hex2Ascii', 'options': []}]),
+    ('Url decode -> Base 64 decode -> Xor', UrlEncodedBase64Text,
+     [{'name': 'Url decode', 'options': []},
+      {'name': 'Base 64 decode', 'options': []},
+      {'name': 'Xor', 'options': ['ba']}]),
+)
+
+
+def Cases():
+  """Returns (name, input generator, plugins) for every benchmark case."""
+  cases = []
+  for plugin in plugin_handler.Plugins():
+    generate, options = PLUGIN_INPUTS.get(
+        plugin.name, (RandomText, ['' for _ in plugin.options]))
+    cases.append(
+        (plugin.name, generate, [{'name': plugin.name, 'options': options}]))
+  cases.extend(CHAINS)
+  return cases
+
+
+def Percentile(sorted_values, fraction):
+  index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+  return sorted_values[index]
+
+
+def PeakRss():
+  """Returns the peak resident set size of this process in bytes."""
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def PeakMemory(pipeline, data):
+  """Returns the peak bytes allocated by one call of the pipeline.
+
+  Python allocations are traced with tracemalloc, so the input and anything
+  allocated before the call are not counted. Without tracemalloc, on Python 2,
+  this is the rise in the peak resident set size, which starts from the
+  current size in a new process.
+  """
+  if tracemalloc is None:
+    rss_before = PeakRss()
+    pipeline.Process(data)
+    return max(0, PeakRss() - rss_before)
+  tracemalloc.start()
+  try:
+    pipeline.Process(data)
+    return tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+
+def RunCase(name, data, plugins, size):
+  """Benchmarks one case on one input in the current process.
+
+  Args:
+    name: Name of the case.
+    data: Synthetic input.
+    plugins: List of plugin description dictionaries.
+    size: Requested input size in bytes. Encoded inputs may differ slightly.
+
+  Returns:
+    Dict of results.
+  """
+  pipeline = plugin_handler.CompilePipeline(plugins)
+  peak_memory = PeakMemory(pipeline, data)
+  latencies = []
+  started = time.time()
+  while len(latencies) < MAX_CALLS and (
+      len(latencies) < MIN_CALLS or time.time() - started < MIN_TIME):
+    call_started = time.time()
+    pipeline.Process(data)
+    latencies.append(time.time() - call_started)
+  latencies.sort()
+  mean = sum(latencies) / len(latencies)
+  return {
+      'name': name,
+      'size': size,
+      'bytes': len(data),
+      'calls': len(latencies),
+      'mb_per_sec': len(data) / mean / 1e6 if mean else 0.0,
+      'p50_ms': Percentile(latencies, 0.5) * 1000,
+      'p90_ms': Percentile(latencies, 0.9) * 1000,
+      'p99_ms': Percentile(latencies, 0.99) * 1000,
+      'peak_memory_bytes': peak_memory}
+
+
+def _RunCaseInChild(results, *args):
+  try:
+    results.put(RunCase(*args))
+  except Exception as e:
+    results.put({'name': args[0], 'size': args[3], 'error': str(e)})
+
+
+def RunIsolated(name, generate, plugins, size):
+  """Runs a case in a child process on input generated beforehand.
+
+  Args:
+    name: Name of the case.
+    generate: Callable returning synthetic input of a given size.
+    plugins: List of plugin description dictionaries.
+    size: Requested input size in bytes.
+
+  Returns:
+    Dict of results, with an error if the child failed, exited without a
+    result or ran for longer than CASE_TIMEOUT.
+  """
+  data = generate(size)
+  results = multiprocessing.Queue()
+  child = multiprocessing.Process(
+      target=_RunCaseInChild, args=(results, name, data, plugins, size))
+  child.start()
+  deadline = time.time() + CASE_TIMEOUT
+  result = None
+  while result is None:
+    # A child which had exited before the wait began has already written any
+    # result it had.
+    exited = not child.is_alive()
+    try:
+      result = results.get(timeout=POLL_INTERVAL)
+    except queue.Empty:
+      if exited:
+        result = {'name': name, 'size': size,
+                  'error': 'exited with status %s' % child.exitcode}
+      elif time.time() > deadline:
+        child.terminate()
+        result = {'name': name, 'size': size,
+                  'error': 'timed out after %d seconds' % CASE_TIMEOUT}
+  child.join()
+  return result
+
+
+def Compare(results, baseline, threshold):
+  """Finds cases whose throughput dropped by more than threshold.
+
+  Args:
+    results: List of result dicts from this run.
+    baseline: List of result dicts from an earlier run.
+    threshold: Fraction of throughput a case may lose.
+
+  Returns:
+    List of (name, size, baseline MB/s, current MB/s) tuples.
+  """
+  before = dict(((result['name'], result['size']), result)
+                for result in baseline if 'error' not in result)
+  regressions = []
+  for result in results:
+    previous = before.get((result['name'], result['size']))
+    if previous is None or 'error' in result:
+      continue
+    if result['mb_per_sec'] < previous['mb_per_sec'] * (1 - threshold):
+      regressions.append((result['name'], result['size'],
+                          previous['mb_per_sec'], result['mb_per_sec']))
+  return regressions
+
+
+def main(args):
+  results = []
+  print('%-40s %11s %10s %10s %10s %10s %12s' % (
+      'case', 'bytes', 'MB/s', 'p50 ms', 'p90 ms', 'p99 ms', 'peak bytes'))
+  for name, generate, plugins in Cases():
+    if args.k and args.k.lower() not in name.lower():
+      continue
+    for size in args.s:
+      result = RunIsolated(name, generate, plugins, size)
+      results.append(result)
+      if 'error' in result:
+        print('%-40s %11d error: %s' % (name, size, result['error']))
+        continue
+      print('%-40s %11d %10.2f %10.3f %10.3f %10.3f %12d' % (
+          name, result['bytes'], result['mb_per_sec'], result['p50_ms'],
+          result['p90_ms'], result['p99_ms'], result['peak_memory_bytes']))
+      sys.stdout.flush()
+  if args.o:
+    with open(args.o, 'w') as f:
+      json.dump({'python': platform.python_version(),
+                 'platform': platform.platform(),
+                 'results': results}, f, indent=2, sort_keys=True)
+  if args.c:
+    with open(args.c) as f:
+      regressions = Compare(results, json.load(f)['results'], args.t)
+    for name, size, before, after in regressions:
+      print('Regression: %s on %d bytes, %.2f -> %.2f MB/s' % (
+          name, size, before, after), file=sys.stderr)
+    if regressions:
+      sys.exit(1)
+
+
+if __name__ == '__main__':
+  arg_parser = argparse.ArgumentParser()
+  arg_parser.add_argument('-s', type=int, nargs='+', default=DEFAULT_SIZES,
+                          help='Input sizes in bytes')
+  arg_parser.add_argument('-k', help='Only run cases containing this string')
+  arg_parser.add_argument('-o', help='Write results to this JSON file')
+  arg_parser.add_argument('-c', help='Compare against this JSON results file')
+  arg_parser.add_argument('-t', type=float, default=DEFAULT_THRESHOLD,
+                          help='Throughput loss fraction flagged by -c')
+  main(arg_parser.parse_args())
@@ -0,0 +1,697 @@
+"""Conversion requests shared by the App Engine app and the standalone server.
+
+Each Process function takes the decoded JSON of a request and returns the JSON
+text of its response, except ProcessBinary, which carries raw bytes both ways.
+The plugin chains themselves are run by an execute function, which main.py
+calls directly and server.py may hand to a worker process.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import json
+import os
+import threading
+import time
+
+import magic
+import metrics
+import plugin_handler
+from plugins import compat
+import result_cache
+import sessions
+
+# Bounds on a single /batchconvert request.
+MAX_BATCH_SIZE = 10000
+MAX_BATCH_RESPONSE_SIZE = 10 * 1024 * 1024
+
+# Upper bounds on the search parameters a /magic request may ask for.
+MAX_MAGIC_DEPTH = 6
+MAX_MAGIC_BEAM_WIDTH = 32
+MAX_MAGIC_TOP_K = 20
+
+# A /convert request with this content type carries the raw input bytes as its
+# body, with the plugin chain as JSON in PLUGINS_HEADER, and is answered with
+# the raw output bytes. A failure is answered with FAILURE_STATUS and the usual
+# JSON failure.
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+PLUGINS_HEADER = 'X-Babbage-Plugins'
+FAILURE_STATUS = 422
+
+# A /convertstream response is one JSON object per line: {"chunk": ...} for each
+# piece of output, then {"done": true, "total_length": ...}, {"failure": ...}
+# or {"cancelled": true}.
+STREAM_CONTENT_TYPE = 'application/x-ndjson'
+# Bytes of input fed to the plugins at a time by a /convertstream request.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Largest window of a result returned by one /convert request.
+MAX_WINDOW_LENGTH = 1024 * 1024
+
+# Memory for cached results and session stage outputs together, split evenly
+# between the two. The default leaves most of the 128 MB of a default App
+# Engine instance to the requests themselves; the CACHE_MEMORY_MB environment
+# variable raises it on larger instances or under server.py.
+CACHE_MEMORY_BYTES = int(os.environ.get('CACHE_MEMORY_MB') or 48) * 1024 * 1024
+
+# Bounds on the cache of recent conversion results.
+RESULT_CACHE_MAX_ENTRIES = 4096
+RESULT_CACHE_MAX_BYTES = CACHE_MEMORY_BYTES // 2
+RESULT_CACHE_MAX_ITEM_BYTES = min(16 * 1024 * 1024, RESULT_CACHE_MAX_BYTES)
+
+# Bounds on the stage outputs kept for /convert requests with a session.
+MAX_SESSIONS = 256
+MAX_SESSIONS_BYTES = CACHE_MEMORY_BYTES - RESULT_CACHE_MAX_BYTES
+MAX_SESSION_BYTES = min(16 * 1024 * 1024, MAX_SESSIONS_BYTES)
+
+RESULTS = result_cache.ResultCache(RESULT_CACHE_MAX_ENTRIES,
+                                   RESULT_CACHE_MAX_BYTES,
+                                   RESULT_CACHE_MAX_ITEM_BYTES)
+
+SESSIONS = sessions.SessionStore(MAX_SESSIONS, MAX_SESSIONS_BYTES,
+                                 MAX_SESSION_BYTES)
+
+STAGES = metrics.StageHistograms()
+
+
+def ExecutePipeline(plugins, data, allocations=False):
+  """Runs data through a plugin chain, timing each stage.
+
+  Args:
+    plugins: List of plugin description dictionaries.
+    data: Text to be processed.
+    allocations: Whether to trace the allocations of each stage.
+
+  Returns:
+    Tuple of the output and the list of per-stage trace dicts.
+
+  Raises:
+    plugin_handler.Error: The chain could not be compiled or run. The stages
+      which ran are attached as its 'trace' attribute.
+  """
+  trace = []
+  try:
+    pipeline = plugin_handler.GetPipeline(plugins)
+    return pipeline.Process(data, trace=trace, allocations=allocations), trace
+  except plugin_handler.Error as e:
+    e.trace = trace
+    raise
+
+
+def ExecuteBatch(jobs, max_bytes):
+  """Runs many inputs through their plugin chains.
+
+  Each distinct plugin chain is compiled once and shared by every job using
+  it.
+
+  Args:
+    jobs: List of {'data': ..., 'plugins': [...]} dicts.
+    max_bytes: Jobs stop being run once their outputs add up to this size.
+
+  Returns:
+    List of results for the jobs which ran, each {'success': output,
+    'stages': trace} or {'failure': message, 'stages': trace}.
+  """
+  pipelines = {}
+  results = []
+  output_size = 0
+  for job in jobs:
+    if output_size >= max_bytes:
+      break
+    key = plugin_handler.ChainKey(job['plugins'])
+    pipeline = pipelines.get(key)
+    if pipeline is None:
+      try:
+        pipeline = plugin_handler.CompilePipeline(job['plugins'])
+      except plugin_handler.Error as e:
+        pipeline = e
+      pipelines[key] = pipeline
+    if isinstance(pipeline, plugin_handler.Error):
+      results.append({'failure': str(pipeline), 'stages': []})
+      continue
+    trace = []
+    try:
+      output = pipeline.Process(job['data'], trace=trace)
+    except plugin_handler.Error as e:
+      results.append({'failure': str(e), 'stages': trace})
+      continue
+    output_size += len(output)
+    results.append({'success': output, 'stages': trace})
+  return results
+
+
+def ExecuteStages(plugins, data, allocations=False):
+  """Runs data through a plugin chain one plugin at a time.
+
+  The plugins are not fused with each other, so that the output of every
+  plugin is available to resume from.
+
+  Args:
+    plugins: List of plugin description dictionaries.
+    data: Text to be processed.
+    allocations: Whether to trace the allocations of each stage.
+
+  Returns:
+    Tuple of the list of outputs, one per plugin, and the list of per-stage
+    trace dicts.
+
+  Raises:
+    plugin_handler.Error: A plugin could not be compiled or run. The stages
+      which ran are attached as its 'trace' attribute.
+  """
+  outputs = []
+  trace = []
+  try:
+    for plugin in plugins:
+      data = plugin_handler.GetPipeline([plugin]).Process(
+          data, trace=trace, allocations=allocations)
+      outputs.append(data)
+  except plugin_handler.Error as e:
+    e.trace = trace
+    raise
+  return outputs, trace
+
+
+def ResponseText(output):
+  """Returns output bytes as text for a JSON response.
+
+  Invalid UTF-8 is replaced with U+FFFD rather than failing the response.
+  """
+  return output.decode('utf-8', 'replace')
+
+
+def _Failure(error, trace):
+  """Returns the JSON of a failed conversion, with its stages if traced."""
+  result = {'failure': str(error)}
+  if trace:
+    result['stages'] = getattr(error, 'trace', [])
+  return json.dumps(result, ensure_ascii=False)
+
+
+def RecordTrace(trace):
+  """Adds the stages of one pipeline run to the metrics and the log."""
+  STAGES.Record(trace)
+  metrics.LogTrace(trace)
+
+
+def _CharacterStart(data, offset):
+  """Moves an offset in UTF-8 data back to the start of its character.
+
+  An offset in a run of more continuation bytes than a character has, which
+  is not valid UTF-8, is left where it is.
+  """
+  for start in compat.xrange(offset, max(0, offset - 3) - 1, -1):
+    if (start in (0, len(data)) or
+        bytearray(data[start:start + 1])[0] & 0xC0 != 0x80):
+      return start
+  return offset
+
+
+def Window(response, window):
+  """Cuts one window out of a conversion result.
+
+  The window is widened at its start and narrowed at its end so as not to
+  split a UTF-8 character, but always holds at least one character unless
+  it starts at the end of the result.
+
+  Args:
+    response: The full result.
+    window: Dict with an optional 'offset' and 'length', in bytes of the UTF-8
+      result.
+
+  Returns:
+    Dict with the windowed result under 'success', its 'offset', the
+    'next_offset' to fetch from and the 'total_length' of the full result, all
+    in bytes.
+  """
+  offset = _CharacterStart(
+      response, min(len(response), max(0, int(window.get('offset') or 0))))
+  length = min(MAX_WINDOW_LENGTH,
+               max(0, int(window.get('length') or MAX_WINDOW_LENGTH)))
+  end = _CharacterStart(response, min(len(response), offset + length))
+  if end == offset and end < len(response):
+    # The window is shorter than the character it starts with.
+    end += 1
+    while (end < min(len(response), offset + 4) and
+           bytearray(response[end:end + 1])[0] & 0xC0 == 0x80):
+      end += 1
+  return {
+      'success': ResponseText(response[offset:end]),
+      'offset': offset,
+      'next_offset': end,
+      'total_length': len(response)}
+
+
+def Convert(data, plugins, use_cache=True, execute=ExecutePipeline,
+            allocations=False):
+  """Runs bytes through each selected plugin, reusing cached results.
+
+  Args:
+    data: String of bytes to be processed.
+    plugins: List of plugin description dictionaries.
+    use_cache: Whether to look for the result in the result cache first.
+    execute: Callable with the signature of ExecutePipeline which runs the
+      plugins.
+    allocations: Whether to trace the allocations of each stage.
+
+  Returns:
+    Tuple of the output and the list of per-stage trace dicts, or None for the
+    trace if the output came from the cache.
+
+  Raises:
+    plugin_handler.Error: The plugins could not be run.
+  """
+  key = result_cache.Key(data, plugins)
+  output = RESULTS.Get(key) if use_cache else None
+  if output is not None:
+    return output, None
+  try:
+    output, stages = execute(plugins, data, allocations)
+  except plugin_handler.Error as e:
+    RecordTrace(getattr(e, 'trace', []))
+    raise
+  RecordTrace(stages)
+  RESULTS.Put(key, output)
+  return output, stages
+
+
+def Process(input_text, plugins, trace=False, window=None,
+            execute=ExecutePipeline):
+  """Runs input text through each selected plugin.
+
+  Args:
+    input_text: Text to be processed.
+    plugins: Dict of plugins to process: {'name': 'Base 64 Encode'}
+    trace: Whether to bypass the result cache and return the timing, sizes and
+      allocations of each stage under 'stages', and how the stages were fused
+      or dropped under 'optimizations'. A failure then carries the stages
+      which ran, the failing one last.
+    window: Optional dict with the 'offset' and 'length', in bytes of the
+      UTF-8 result, of the part of the result to return. The full result is
+      cached, so later windows of the same conversion are served without
+      rerunning the plugins.
+    execute: Callable with the signature of ExecutePipeline which runs the
+      plugins.
+
+  Returns:
+    Dict of decoded data containing a success or failure.
+  """
+  try:
+    response, stages = Convert(input_text.encode('utf-8'), plugins,
+                               use_cache=not trace, execute=execute,
+                               allocations=trace)
+  except plugin_handler.Error as e:
+    return _Failure(e, trace)
+  if window is None:
+    result = {'success': ResponseText(response)}
+  else:
+    result = Window(response, window)
+  if trace:
+    result['stages'] = stages
+    result['optimizations'] = plugin_handler.GetPipeline(plugins).optimizations
+  return json.dumps(result, ensure_ascii=False)
+
+
+def SessionProcess(input_text, plugins, session_id, version=None, have=0,
+                   window=None, trace=False, execute=ExecuteStages):
+  """Runs input text through each selected plugin, resuming a session.
+
+  Only the plugins after the longest prefix of the chain already run over the
+  same input in the session are run. If the client still holds the output of
+  the session's last response, only the part of the new output from where
+  the two differ is returned.
+
+  Args:
+    input_text: Text to be processed.
+    plugins: Dict of plugins to process: {'name': 'Base 64 Encode'}
+    session_id: String identifying the client's session.
+    version: The 'version' of the last response the client holds, if any.
+    have: Length of the output of that response the client holds.
+    window: Optional dict with the 'offset' and 'length', in bytes, of the
+      part of the result to return. The offset is ignored when a delta is
+      returned.
+    trace: Whether to return the timing, sizes and allocations of each stage
+      run under 'stages'.
+    execute: Callable with the signature of ExecuteStages which runs the
+      plugins.
+
+  Returns:
+    Dict of decoded data containing a failure, or a window of the result as
+    from Process with the session's new 'version' and the number of
+    'resumed_stages' not rerun. The client keeps its output up to 'offset' and
+    appends 'success' to it.
+  """
+  data = input_text.encode('utf-8')
+  keys = sessions.PrefixKeys(data, plugins)
+  session = SESSIONS.Get(session_id)
+  with session.lock:
+    start, output = session.Resume(keys)
+    outputs, stages = [], []
+    if start < len(plugins):
+      try:
+        outputs, stages = execute(plugins[start:],
+                                  data if output is None else output, trace)
+      except plugin_handler.Error as e:
+        RecordTrace(getattr(e, 'trace', []))
+        return _Failure(e, trace)
+      RecordTrace(stages)
+    if outputs:
+      output = outputs[-1]
+    elif output is None:
+      output = data
+    window = dict(window or {})
+    if session.output is not None and version == session.version:
+      window['offset'] = min(int(have or 0), sessions.CommonPrefixLength(
+          session.output, output))
+    session.Store(keys, start, outputs, output, SESSIONS.max_session_bytes)
+    result = Window(output, window)
+    result['version'] = session.version
+  SESSIONS.Evict()
+  result['resumed_stages'] = start
+  if trace:
+    result['stages'] = stages
+  return json.dumps(result, ensure_ascii=False)
+
+
+class StreamRegistry(object):
+  """Cancellation events of the streams in flight in this process, by channel.
+
+  A stream can only be cancelled by a request handled in the same process,
+  as with server.py. main.py keeps its streams in memcache instead.
+  """
+
+  def __init__(self):
+    self._streams = {}
+    self._lock = threading.Lock()
+
+  def Start(self, channel):
+    """Registers a stream on a channel, cancelling the one already on it.
+
+    Args:
+      channel: String identifying the client.
+
+    Returns:
+      A threading.Event set when the stream is cancelled.
+    """
+    cancelled = threading.Event()
+    with self._lock:
+      previous = self._streams.get(channel)
+      if previous is not None:
+        previous.set()
+      self._streams[channel] = cancelled
+    return cancelled
+
+  def End(self, channel, cancelled):
+    """Unregisters a stream started by Start once it has finished."""
+    with self._lock:
+      if self._streams.get(channel) is cancelled:
+        del self._streams[channel]
+
+  def Cancel(self, channel):
+    """Cancels the stream in flight on a channel.
+
+    Returns:
+      Whether a stream was cancelled.
+    """
+    with self._lock:
+      cancelled = self._streams.pop(channel, None)
+    if cancelled is not None:
+      cancelled.set()
+    return cancelled is not None
+
+
+STREAMS = StreamRegistry()
+
+
+def StartStream(channel, streams=STREAMS):
+  """Registers a stream on a channel, cancelling the one already on it.
+
+  Args:
+    channel: String identifying the client, or None for a stream which can
+      not be cancelled.
+    streams: StreamRegistry, or an object with the same methods, holding the
+      streams in flight.
+
+  Returns:
+    An object whose is_set() method returns whether the stream is cancelled.
+  """
+  if not channel:
+    return threading.Event()
+  return streams.Start(channel)
+
+
+def EndStream(channel, cancelled, streams=STREAMS):
+  """Unregisters a stream started by StartStream once it has finished."""
+  if channel:
+    streams.End(channel, cancelled)
+
+
+def CancelStream(channel, streams=STREAMS):
+  """Cancels the stream in flight on a channel.
+
+  Returns:
+    JSON of whether a stream was cancelled.
+  """
+  return json.dumps(
+      {'cancelled': bool(channel) and streams.Cancel(channel)})
+
+
+def _StreamLine(result):
+  return json.dumps(result, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def _SplitUtf8(data):
+  """Splits off a UTF-8 character cut short at the end of data."""
+  tail = bytearray(data[-4:])
+  for back in compat.xrange(1, len(tail) + 1):
+    byte = tail[-back]
+    if byte & 0xC0 == 0xC0:
+      needed = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+      if back < needed:
+        return data[:-back], data[-back:]
+      break
+    if byte & 0x80 == 0:
+      break
+  return data, b''
+
+
+def StreamProcess(input_text, plugins, cancelled=None, deadline=None):
+  """Runs input text through each selected plugin, yielding output as it comes.
+
+  The input is fed to the plugins STREAM_CHUNK_SIZE bytes at a time, so
+  plugins which stream produce their first output long before the input has
+  all been processed. The stream stops between chunks once it is cancelled
+  or its deadline has passed.
+
+  Args:
+    input_text: Text to be processed.
+    plugins: Dict of plugins to process: {'name': 'Base 64 Encode'}
+    cancelled: Optional object from StartStream, such as a threading.Event,
+      whose is_set() method returns whether to stop the stream.
+    deadline: Optional time.time() after which the stream fails.
+
+  Yields:
+    Lines of JSON, each one STREAM_CONTENT_TYPE object.
+  """
+  data = input_text.encode('utf-8')
+  try:
+    pipeline = plugin_handler.GetPipeline(plugins)
+  except plugin_handler.Error as e:
+    yield _StreamLine({'failure': str(e)})
+    return
+
+  stopped = []
+
+  def Stopped():
+    if ((cancelled is not None and cancelled.is_set()) or
+        (deadline is not None and time.time() > deadline)):
+      stopped.append(True)
+    return bool(stopped)
+
+  def Chunks():
+    for offset in compat.xrange(0, len(data), STREAM_CHUNK_SIZE):
+      if Stopped():
+        return
+      yield data[offset:offset + STREAM_CHUNK_SIZE]
+
+  total_length = 0
+  pending = b''
+  try:
+    for output in pipeline.Stream(Chunks()):
+      if Stopped():
+        break
+      total_length += len(output)
+      text, pending = _SplitUtf8(pending + output)
+      if text:
+        yield _StreamLine({'chunk': ResponseText(text)})
+  except plugin_handler.Error as e:
+    yield _StreamLine({'failure': str(e)})
+    return
+  if stopped and cancelled is not None and cancelled.is_set():
+    yield _StreamLine({'cancelled': True})
+  elif stopped:
+    yield _StreamLine({'failure': 'Timed out.'})
+  else:
+    if pending:
+      yield _StreamLine({'chunk': ResponseText(pending)})
+    yield _StreamLine({'done': True, 'total_length': total_length})
+
+
+def ParsePluginsHeader(value):
+  """Parses the plugin chain of a binary request from its PLUGINS_HEADER.
+
+  Args:
+    value: The header value, a JSON list of plugin description dictionaries.
+
+  Returns:
+    List of plugin description dictionaries.
+
+  Raises:
+    ValueError: The header is missing or is not a JSON list.
+  """
+  plugins = json.loads(value or 'null')
+  if not isinstance(plugins, list):
+    raise ValueError('%s must be a JSON list of plugins.' % PLUGINS_HEADER)
+  return plugins
+
+
+def ProcessBinary(data, plugins_header, execute=ExecutePipeline):
+  """Runs the raw body of a binary /convert request through its plugins.
+
+  The output is returned as it is, without the UTF-8 decoding and escaping of
+  a JSON response.
+
+  Args:
+    data: String of bytes to be processed.
+    plugins_header: Value of the request's PLUGINS_HEADER.
+    execute: Callable with the signature of ExecutePipeline which runs the
+      plugins.
+
+  Returns:
+    Tuple of the HTTP status, the content type and the body of the response.
+  """
+  try:
+    output, _ = Convert(data, ParsePluginsHeader(plugins_header),
+                        execute=execute)
+  except (ValueError, plugin_handler.Error) as e:
+    return FAILURE_STATUS, 'application/json', json.dumps({'failure': str(e)})
+  return 200, BINARY_CONTENT_TYPE, output
+
+
+def _ValidJob(job):
+  """Returns whether a batch job has a text input and a list of plugins."""
+  if not isinstance(job, dict):
+    return False
+  plugins = job.get('plugins')
+  return (isinstance(job.get('input'), compat.text_type) and
+          isinstance(plugins, list) and
+          all(isinstance(plugin, dict) and
+              isinstance(plugin.get('name'), compat.text_type) and
+              isinstance(plugin.get('options') or [], list) and
+              not any(isinstance(option, (list, dict))
+                      for option in plugin.get('options') or [])
+              for plugin in plugins))
+
+
+def BatchProcess(jobs, execute=ExecuteBatch):
+  """Runs many inputs through their selected plugins.
+
+  Cached results are reused and the remaining jobs are run together. Jobs
+  without a text input and a list of plugins fail on their own. A result
+  which would take the combined size of the outputs past
+  MAX_BATCH_RESPONSE_SIZE is failed instead, and once the outputs reach it
+  the remaining jobs are not run.
+
+  Args:
+    jobs: List of dicts: [{'input': 'text', 'plugins': [{'name': 'Xor'}]}]
+    execute: Callable with the signature of ExecuteBatch which runs the jobs
+      missing from the cache.
+
+  Returns:
+    JSON list of results aligned with jobs, each containing a success or
+    failure.
+  """
+  if not isinstance(jobs, list):
+    return json.dumps({'failure': 'Expected a list of jobs.'})
+  if len(jobs) > MAX_BATCH_SIZE:
+    return json.dumps(
+        {'failure': 'Too many inputs, the limit is %d.' % MAX_BATCH_SIZE})
+  keys = []
+  results = []
+  missing = []
+  cached_size = 0
+  for job in jobs:
+    if not _ValidJob(job):
+      keys.append(None)
+      results.append({'failure': 'Invalid job.'})
+      continue
+    data = job['input'].encode('utf-8')
+    key = result_cache.Key(data, job['plugins'])
+    output = RESULTS.Get(key)
+    keys.append(key)
+    if output is None:
+      results.append(None)
+      missing.append({'data': data, 'plugins': job['plugins']})
+    else:
+      results.append({'success': output})
+      cached_size += len(output)
+  ran = []
+  if missing:
+    try:
+      ran = execute(missing, max(0, MAX_BATCH_RESPONSE_SIZE - cached_size))
+    except plugin_handler.Error as e:
+      ran = [{'failure': str(e), 'stages': []} for _ in missing]
+  ran = iter(ran)
+  response_size = 0
+  for index, result in enumerate(results):
+    if result is None:
+      result = next(ran, None)
+      if result is not None:
+        RecordTrace(result.pop('stages'))
+        if 'success' in result:
+          RESULTS.Put(keys[index], result['success'])
+    if result is not None and 'success' in result:
+      if response_size + len(result['success']) > MAX_BATCH_RESPONSE_SIZE:
+        result = None
+      else:
+        response_size += len(result['success'])
+        result = dict(result, success=ResponseText(result['success']))
+    if result is None:
+      result = {'failure': 'Response size limit reached.'}
+    results[index] = result
+  return json.dumps({'results': results}, ensure_ascii=False)
+
+
+def MagicProcess(input_text, max_depth, beam_width, top_k):
+  """Searches for the plugin chains which best decode input text.
+
+  Args:
+    input_text: Text to be decoded.
+    max_depth: Maximum number of plugins in a chain.
+    beam_width: Number of outputs expanded at each depth.
+    top_k: Number of chains to return.
+
+  Returns:
+    JSON list of {'plugins': [...], 'output': ..., 'score': ...} dicts, best
+    first.
+  """
+  candidates = magic.Search(input_text.encode('utf-8'),
+                            max_depth=min(max_depth, MAX_MAGIC_DEPTH),
+                            beam_width=min(beam_width, MAX_MAGIC_BEAM_WIDTH),
+                            top_k=min(top_k, MAX_MAGIC_TOP_K))
+  return json.dumps(
+      {'success': [candidate.AsDict() for candidate in candidates]},
+      ensure_ascii=False)
@@ -0,0 +1,229 @@
+#!/usr/bin/python
+
+"""Load tests the standalone server with more and more worker processes.
+
+For each worker count a server.py is started, then client processes send
+/convert requests over keep-alive connections for a fixed time. Requests per
+second and latency percentiles are reported for each worker count, so the
+throughput gained from each added core can be seen.
+
+loadtest.py [-w <workers> ...] [-n <clients>] [-d <seconds>] [-s <bytes>]
+            [-u <url>]
+ -w: Worker process counts to test, default 1, 2, 4, ... up to one per core.
+ -n: Client processes sending requests, default twice the largest worker
+     count.
+ -d: Seconds to send requests for at each worker count, default 10.
+ -s: Size of each request's input in bytes, default 1048576. Inputs above the
+     server's inline limit run in its worker processes.
+ -u: Load test an already running server at this URL instead of starting
+     one for each worker count.
+
+Examples:
+  ./loadtest.py
+  - Shows how /convert throughput scales from one worker to one per core.
+
+  ./loadtest.py -u http://localhost:8080 -n 16 -s 1000
+  - Sends small requests from 16 clients to a running server.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import print_function
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+try:
+  from http import client as httplib
+  from urllib import parse as urlparse
+except ImportError:
+  # Python 2
+  import httplib
+  import urlparse
+
+import benchmark
+from plugins import compat
+
+DEFAULT_DURATION = 10
+DEFAULT_SIZE = 1024 * 1024
+STARTUP_SECONDS = 30
+# The chain each request runs: decode base 64, then reverse the text.
+PLUGINS = [{'name': 'Base 64 decode', 'options': []},
+           {'name': 'String reverse', 'options': []}]
+
+
+def WorkerCounts():
+  """Returns 1, 2, 4, ... up to the number of cores."""
+  cores = multiprocessing.cpu_count()
+  counts = []
+  count = 1
+  while count < cores:
+    counts.append(count)
+    count *= 2
+  return counts + [cores]
+
+
+def _Client(args):
+  """Sends requests over one keep-alive connection until the deadline.
+
+  Every request has different input so that none is served from the result
+  cache.
+
+  Args:
+    args: Tuple of the server URL, the client number, the input size and the
+      deadline.
+
+  Returns:
+    Tuple of the list of request latencies and the number of failed requests.
+  """
+  url, client, size, deadline = args
+  host = urlparse.urlparse(url).netloc
+  text = base64.b64encode(benchmark.RandomText(size * 3 // 4))
+  latencies = []
+  failures = 0
+  connection = httplib.HTTPConnection(host)
+  sequence = 0
+  while time.time() < deadline:
+    sequence += 1
+    unique = base64.b64encode(b'%06d%06d' % (client, sequence))
+    body = json.dumps({'input': (unique + text).decode('ascii'),
+                       'plugins': PLUGINS})
+    started = time.time()
+    try:
+      connection.request('POST', '/convert', body,
+                         {'Content-Type': 'application/json'})
+      response = connection.getresponse()
+      response.read()
+    except (httplib.HTTPException, socket.error):
+      failures += 1
+      connection.close()
+      connection = httplib.HTTPConnection(host)
+      continue
+    if response.status != 200:
+      failures += 1
+      if response.getheader('connection', '').lower() == 'close':
+        connection.close()
+        connection = httplib.HTTPConnection(host)
+      continue
+    latencies.append(time.time() - started)
+  connection.close()
+  return latencies, failures
+
+
+def Run(url, clients, size, duration):
+  """Load tests a running server.
+
+  Returns:
+    Dict of results.
+  """
+  deadline = time.time() + duration
+  pool = multiprocessing.Pool(clients)
+  try:
+    outcomes = pool.map(
+        _Client, [(url, client, size, deadline)
+                  for client in compat.xrange(clients)])
+  finally:
+    pool.terminate()
+    pool.join()
+  latencies = sorted(sum((outcome[0] for outcome in outcomes), []))
+  failures = sum(outcome[1] for outcome in outcomes)
+  if not latencies:
+    return {'requests': 0, 'failures': failures, 'per_sec': 0.0,
+            'mb_per_sec': 0.0, 'p50_ms': 0.0, 'p99_ms': 0.0}
+  return {
+      'requests': len(latencies),
+      'failures': failures,
+      'per_sec': len(latencies) / float(duration),
+      'mb_per_sec': len(latencies) * size / float(duration) / 1e6,
+      'p50_ms': benchmark.Percentile(latencies, 0.5) * 1000,
+      'p99_ms': benchmark.Percentile(latencies, 0.99) * 1000}
+
+
+def StartServer(port, workers):
+  """Starts server.py and waits until it answers."""
+  server = subprocess.Popen(
+      [sys.executable, os.path.join(os.path.dirname(__file__) or '.',
+                                    'server.py'),
+       '-a', 'localhost', '-p', str(port), '-w', str(workers)])
+  deadline = time.time() + STARTUP_SECONDS
+  while time.time() < deadline:
+    try:
+      connection = httplib.HTTPConnection('localhost', port)
+      connection.request('GET', '/listplugins')
+      connection.getresponse().read()
+      connection.close()
+      return server
+    except socket.error:
+      time.sleep(0.1)
+  server.kill()
+  raise RuntimeError('The server did not start.')
+
+
+def FreePort():
+  probe = socket.socket()
+  probe.bind(('localhost', 0))
+  port = probe.getsockname()[1]
+  probe.close()
+  return port
+
+
+def main(args):
+  print('%-8s %10s %9s %10s %10s %10s %10s' % (
+      'workers', 'requests', 'failures', 'req/s', 'MB/s', 'p50 ms', 'p99 ms'))
+  if args.u:
+    runs = [('-', args.u)]
+    clients = args.n or 2 * multiprocessing.cpu_count()
+  else:
+    runs = [(workers, None) for workers in args.w]
+    clients = args.n or 2 * max(args.w)
+  for workers, url in runs:
+    server = None
+    if url is None:
+      port = FreePort()
+      server = StartServer(port, workers)
+      url = 'http://localhost:%d' % port
+    try:
+      result = Run(url, clients, args.s, args.d)
+    finally:
+      if server is not None:
+        server.send_signal(signal.SIGINT)
+        server.wait()
+    print('%-8s %10d %9d %10.2f %10.2f %10.1f %10.1f' % (
+        workers, result['requests'], result['failures'], result['per_sec'],
+        result['mb_per_sec'], result['p50_ms'], result['p99_ms']))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+  arg_parser = argparse.ArgumentParser()
+  arg_parser.add_argument('-w', type=int, nargs='+', default=WorkerCounts(),
+                          help='Worker process counts to test')
+  arg_parser.add_argument('-n', type=int, help='Client processes')
+  arg_parser.add_argument('-d', type=float, default=DEFAULT_DURATION,
+                          help='Seconds to send requests for')
+  arg_parser.add_argument('-s', type=int, default=DEFAULT_SIZE,
+                          help='Input size in bytes')
+  arg_parser.add_argument('-u', help='URL of an already running server')
+  main(arg_parser.parse_args())
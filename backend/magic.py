@@ -0,0 +1,156 @@
+"""Searches for plugin chains which decode data into readable text.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import hashlib
+import heapq
+import itertools
+import time
+
+import plugin_handler
+from plugins import compat
+from plugins import scoring
+
+# Plugins tried by the search. Encoders only make data less readable, and the
+# options of the remaining plugins cannot be guessed.
+DECODERS = (
+  'Base 64 decode',
+  'URL-safe Base 64 decode',
+  'Hex2Ascii',
+  'Url decode',
+  'fromCharCode',
+  'Punycode decode',
+  'ROT-13 decode',
+  'String reverse',
+)
+
+# Plugins which undo themselves when applied twice in a row.
+INVOLUTIONS = ('ROT-13 decode', 'String reverse')
+
+DEFAULT_MAX_DEPTH = 4
+DEFAULT_BEAM_WIDTH = 8
+DEFAULT_TOP_K = 5
+DEFAULT_TIME_BUDGET = 2.0
+
+
+class Candidate(object):
+  """A plugin chain and the output it produced."""
+
+  def __init__(self, chain, output, score):
+    self.chain = chain
+    self.output = output
+    self.score = score
+
+  def AsDict(self):
+    """Returns the candidate with its chain in the /convert plugin format."""
+    return {
+        'plugins': [{'name': name, 'options': []} for name in self.chain],
+        'output': self.output.decode('utf-8', 'replace'),
+        'score': self.score}
+
+
+def _Rank(candidate):
+  # Prefer shorter chains between equally readable outputs.
+  return candidate.score, -len(candidate.chain)
+
+
+def _PushBounded(heap, size, entry):
+  """Adds an entry to a min-heap of the size largest, dropping the smallest."""
+  if len(heap) < size:
+    heapq.heappush(heap, entry)
+  elif heap and entry > heap[0]:
+    heapq.heapreplace(heap, entry)
+
+
+def _Expand(item):
+  """Runs every decoder whose precondition holds over one search node.
+
+  Args:
+    item: Tuple of the chain so far and its output.
+
+  Returns:
+    List of (chain, output, score) tuples.
+  """
+  chain, data = item
+  expansions = []
+  for name in DECODERS:
+    if chain and chain[-1] == name and name in INVOLUTIONS:
+      continue
+    plugin = plugin_handler.GetPlugin(name)
+    if hasattr(plugin, 'Accepts') and not plugin.Accepts(data):
+      continue
+    try:
+      output = plugin.Process(data, [])
+    except Exception:
+      continue
+    if isinstance(output, compat.text_type):
+      output = output.encode('utf-8')
+    if output and output != data:
+      expansions.append((chain + (name,), output, scoring.Score(output)))
+  return expansions
+
+
+def Search(data, max_depth=DEFAULT_MAX_DEPTH, beam_width=DEFAULT_BEAM_WIDTH,
+           top_k=DEFAULT_TOP_K, time_budget=DEFAULT_TIME_BUDGET, pool=None):
+  """Finds the plugin chains whose output looks most like readable text.
+
+  This is a beam search: each level applies every applicable decoder to the
+  best beam_width outputs of the level before. Every intermediate output is
+  computed once, from its prefix's output, and outputs already reached by
+  another chain are pruned. Only the outputs of the beam and of the best
+  top_k candidates are kept; the rest are dropped as soon as they are scored.
+
+  Args:
+    data: String to decode.
+    max_depth: Maximum number of plugins in a chain.
+    beam_width: Number of outputs expanded at each depth.
+    top_k: Number of candidates to return.
+    time_budget: Seconds after which no further expansions are started.
+    pool: Optional multiprocessing pool used to expand a level in parallel.
+
+  Returns:
+    List of Candidates, best first.
+  """
+  deadline = time.time() + time_budget
+  seen = set([hashlib.sha1(data).digest()])
+  # Heap entries are (rank, -order, candidate), so that between equal ranks
+  # the candidate found first is kept.
+  order = itertools.count()
+  best = []
+  level = [((), data)]
+  for _ in compat.xrange(max_depth):
+    if not level or time.time() > deadline:
+      break
+    if pool:
+      expansions = pool.map(_Expand, level)
+    else:
+      expansions = (_Expand(item) for item in level
+                    if time.time() <= deadline)
+    beam = []
+    for chain, output, score in itertools.chain.from_iterable(expansions):
+      digest = hashlib.sha1(output).digest()
+      if digest in seen:
+        continue
+      seen.add(digest)
+      candidate = Candidate(chain, output, score)
+      entry = (_Rank(candidate), -next(order), candidate)
+      _PushBounded(beam, beam_width, entry)
+      _PushBounded(best, top_k, entry)
+    level = [(candidate.chain, candidate.output)
+             for _, _, candidate in sorted(beam, reverse=True)]
+  return [candidate for _, _, candidate in sorted(best, reverse=True)]
@@ -22,11 +22,16 @@ import logging
 import json
 import os
 import re
+import time
 import urllib
+import uuid
 
+from google.appengine.api import memcache
 import jinja2
 import webapp2
 
+import convert
+import magic
 import plugin_handler
 
 JINJA_ENVIRONMENT = jinja2.Environment(
@@ -42,24 +47,71 @@ HEADERS = [
   "Content-Type",
   "Access-Control-Request-Method",
   "Access-Control-Request-Headers",
+  convert.PLUGINS_HEADER,
 ]
 
+# Streams and their cancellations are kept in memcache, as a /cancel request
+# is handled by another request, and often another instance, than the stream
+# it cancels.
+STREAM_KEY_PREFIX = 'stream:'
+STREAM_CANCELLED = 'cancelled'
+# Memcache entries of streams expire after this long, well past the longest
+# request.
+STREAM_EXPIRY_SECONDS = 15 * 60
+# A stream checks memcache for its cancellation at most this often.
+STREAM_POLL_SECONDS = 0.25
 
-def Process(input_text, plugins):
-  """Runs input text through each selected plugin.
 
-  Args:
-    input_text: Text to be processed.
-    plugins: Dict of plugins to process: {'name': 'Base 64 Encode'}
+class _SharedCancellation(object):
+  """Whether a stream registered in memcache has been cancelled.
 
-  Returns:
-    Dict of decoded data containing a success or failure.
+  The stream is cancelled once its channel's entry holds anything other than
+  its token, because a /cancel request marked it or a newer stream took over
+  the channel. An evicted entry is not taken as a cancellation.
   """
-  try:
-    response = plugin_handler.ProcessPlugins(input_text.encode('utf-8'), plugins)
-  except plugin_handler.Error as e:
-    return json.dumps({'failure': str(e)})
-  return json.dumps({'success': response}, ensure_ascii=False)
+
+  def __init__(self, key, token):
+    self.key = key
+    self.token = token
+    self._cancelled = False
+    self._checked = 0
+
+  def is_set(self):
+    now = time.time()
+    if not self._cancelled and now - self._checked >= STREAM_POLL_SECONDS:
+      self._checked = now
+      value = memcache.get(self.key)
+      self._cancelled = value is not None and value != self.token
+    return self._cancelled
+
+
+class MemcacheStreams(object):
+  """The streams in flight on every instance, kept in memcache.
+
+  Has the methods of convert.StreamRegistry.
+  """
+
+  def Start(self, channel):
+    key = STREAM_KEY_PREFIX + channel
+    cancelled = _SharedCancellation(key, uuid.uuid4().hex)
+    memcache.set(key, cancelled.token, time=STREAM_EXPIRY_SECONDS)
+    return cancelled
+
+  def End(self, channel, cancelled):
+    client = memcache.Client()
+    if client.gets(cancelled.key) == cancelled.token:
+      client.cas(cancelled.key, STREAM_CANCELLED, time=STREAM_EXPIRY_SECONDS)
+
+  def Cancel(self, channel):
+    key = STREAM_KEY_PREFIX + channel
+    client = memcache.Client()
+    value = client.gets(key)
+    if value is None or value == STREAM_CANCELLED:
+      return False
+    return bool(client.cas(key, STREAM_CANCELLED, time=STREAM_EXPIRY_SECONDS))
+
+
+STREAMS = MemcacheStreams()
 
 
 class MainPoster(webapp2.RequestHandler):
@@ -70,14 +122,115 @@ class MainPoster(webapp2.RequestHandler):
     self.response.headers.add_header("Access-Control-Allow-Headers", ','.join(HEADERS));
     self.response.headers.add_header('Access-Control-Allow-Origin', '*')
 
+  def post(self):
+    if self.request.content_type == convert.BINARY_CONTENT_TYPE:
+      self.PostBinary()
+      return
+    response = json.loads(self.request.body)
+    if response.get('input') is None:
+      return
+    self.response.headers.add_header('Access-Control-Allow-Methods', 'POST,OPTIONS')
+    self.response.headers.add_header("Access-Control-Allow-Headers", ','.join(HEADERS));
+    self.response.headers.add_header('Access-Control-Allow-Origin', '*')
+    if response.get('session'):
+      self.response.out.write(convert.SessionProcess(
+          response['input'], response['plugins'], response['session'],
+          version=response.get('version'), have=response.get('have'),
+          window=response.get('window'), trace=bool(response.get('trace'))))
+      return
+    self.response.out.write(convert.Process(response['input'],
+                                            response['plugins'],
+                                            trace=bool(response.get('trace')),
+                                            window=response.get('window')))
+
+  def PostBinary(self):
+    """Converts a raw body, with the plugins in a header, to a raw response."""
+    status, content_type, body = convert.ProcessBinary(
+        self.request.body, self.request.headers.get(convert.PLUGINS_HEADER))
+    self.response.status = status
+    self.response.headers['Content-Type'] = content_type
+    self.response.headers.add_header('Access-Control-Allow-Methods', 'POST,OPTIONS')
+    self.response.headers.add_header("Access-Control-Allow-Headers", ','.join(HEADERS));
+    self.response.headers.add_header('Access-Control-Allow-Origin', '*')
+    self.response.out.write(body)
+
+
+class BatchPoster(MainPoster):
+  """Many inputs were posted at once. Pass each to its plugins.
+
+  The body holds either 'inputs', a list of texts which all share 'plugins',
+  or 'jobs', a list of {'input': ..., 'plugins': [...]} dicts.
+  """
+
+  def post(self):
+    response = json.loads(self.request.body)
+    if response.get('jobs') is not None:
+      jobs = response['jobs']
+    elif response.get('inputs') is not None:
+      jobs = [{'input': input_text, 'plugins': response.get('plugins')}
+              for input_text in response['inputs']]
+    else:
+      return
+    self.response.headers.add_header('Access-Control-Allow-Methods', 'POST,OPTIONS')
+    self.response.headers.add_header("Access-Control-Allow-Headers", ','.join(HEADERS));
+    self.response.headers.add_header('Access-Control-Allow-Origin', '*')
+    self.response.out.write(convert.BatchProcess(jobs))
+
+
+class MagicPoster(MainPoster):
+  """Data was posted to be decoded without a plugin chain. Search for one."""
+
+  def post(self):
+    response = json.loads(self.request.body)
+    if response.get('input') is None:
+      return
+    self.response.headers.add_header('Access-Control-Allow-Methods', 'POST,OPTIONS')
+    self.response.headers.add_header("Access-Control-Allow-Headers", ','.join(HEADERS));
+    self.response.headers.add_header('Access-Control-Allow-Origin', '*')
+    self.response.out.write(convert.MagicProcess(
+        response['input'],
+        int(response.get('depth', magic.DEFAULT_MAX_DEPTH)),
+        int(response.get('beam', magic.DEFAULT_BEAM_WIDTH)),
+        int(response.get('top', magic.DEFAULT_TOP_K))))
+
+
+class StreamPoster(MainPoster):
+  """Data was posted to be converted as a stream of output chunks.
+
+  App Engine sends a response only once it is complete, so the lines of the
+  stream arrive together here. server.py sends each as it is produced. The
+  stream on a channel is kept in memcache, so that a /cancel or a newer
+  stream handled on any instance stops it between chunks.
+  """
+
   def post(self):
     response = json.loads(self.request.body)
     if response.get('input') is None:
       return
+    self.response.headers['Content-Type'] = convert.STREAM_CONTENT_TYPE
     self.response.headers.add_header('Access-Control-Allow-Methods', 'POST,OPTIONS')
     self.response.headers.add_header("Access-Control-Allow-Headers", ','.join(HEADERS));
     self.response.headers.add_header('Access-Control-Allow-Origin', '*')
-    self.response.out.write(Process(response['input'], response['plugins']))
+    channel = response.get('channel')
+    cancelled = convert.StartStream(channel, STREAMS)
+    try:
+      for line in convert.StreamProcess(response['input'], response['plugins'],
+                                        cancelled):
+        self.response.out.write(line)
+    finally:
+      convert.EndStream(channel, cancelled, STREAMS)
+
+
+class CancelPoster(MainPoster):
+  """Cancels the stream in flight on a channel."""
+
+  def post(self):
+    response = json.loads(self.request.body)
+    self.response.headers.add_header('Access-Control-Allow-Methods', 'POST,OPTIONS')
+    self.response.headers.add_header("Access-Control-Allow-Headers", ','.join(HEADERS));
+    self.response.headers.add_header('Access-Control-Allow-Origin', '*')
+    self.response.out.write(
+        convert.CancelStream(response.get('channel'), STREAMS))
 
 
 class ListPlugins(webapp2.RequestHandler):
@@ -89,6 +242,27 @@ class ListPlugins(webapp2.RequestHandler):
     self.response.out.write(")]}',\n"+ json.dumps(plugin_handler.ListPlugins()))
 
 
+class CacheStats(webapp2.RequestHandler):
+  """Result cache counters via JSON."""
+
+  def get(self):
+    """Responds to GET requests."""
+    self.response.headers.add_header('Access-Control-Allow-Origin', '*')
+    self.response.out.write(")]}',\n"+ json.dumps(convert.RESULTS.Stats()))
+
+
+class Metrics(webapp2.RequestHandler):
+  """Per-plugin latency histograms, cache and session counters via JSON."""
+
+  def get(self):
+    """Responds to GET requests."""
+    self.response.headers.add_header('Access-Control-Allow-Origin', '*')
+    self.response.out.write(")]}',\n"+ json.dumps(
+        {'stages': convert.STAGES.Snapshot(),
+         'cache': convert.RESULTS.Stats(),
+         'sessions': convert.SESSIONS.Stats()}))
+
+
 class SendBlob(webapp2.RequestHandler):
   """External data sent via POST."""
 
@@ -113,5 +287,11 @@ class SendBlob(webapp2.RequestHandler):
 
 app = webapp2.WSGIApplication([
     ('/convert', MainPoster),
+    ('/convertstream', StreamPoster),
+    ('/cancel', CancelPoster),
+    ('/batchconvert', BatchPoster),
+    ('/magic', MagicPoster),
     ('/listplugins', ListPlugins),
+    ('/cachestats', CacheStats),
+    ('/metrics', Metrics),
     ], debug=False)
@@ -0,0 +1,73 @@
+"""Aggregates per-plugin stage timings into latency histograms.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import bisect
+import json
+import logging
+import threading
+
+# Upper bounds of the latency buckets in milliseconds. Slower stages are
+# counted in a final overflow bucket.
+LATENCY_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class StageHistograms(object):
+  """Per-plugin counts of stage latencies and bytes processed."""
+
+  def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+    self.buckets_ms = buckets_ms
+    self._plugins = {}
+    self._lock = threading.Lock()
+
+  def Record(self, trace):
+    """Adds the stages of one pipeline run.
+
+    Args:
+      trace: List of stage dicts filled in by plugin_handler.Pipeline.Process.
+    """
+    with self._lock:
+      for stage in trace:
+        plugin = self._plugins.get(stage['plugin'])
+        if plugin is None:
+          plugin = self._plugins[stage['plugin']] = {
+              'count': 0,
+              'seconds': 0.0,
+              'input_bytes': 0,
+              'output_bytes': 0,
+              'buckets': [0] * (len(self.buckets_ms) + 1)}
+        plugin['count'] += 1
+        plugin['seconds'] += stage['seconds']
+        plugin['input_bytes'] += stage['input_size']
+        plugin['output_bytes'] += stage['output_size']
+        plugin['buckets'][bisect.bisect_left(
+            self.buckets_ms, stage['seconds'] * 1000)] += 1
+
+  def Snapshot(self):
+    """Returns the histograms as a dict keyed by plugin name."""
+    with self._lock:
+      return {
+          'buckets_ms': list(self.buckets_ms),
+          'plugins': dict((name, dict(plugin, buckets=list(plugin['buckets'])))
+                          for name, plugin in self._plugins.items())}
+
+
+def LogTrace(trace):
+  """Emits one structured JSON log line per stage."""
+  for index, stage in enumerate(trace):
+    logging.info(json.dumps(dict(stage, event='stage', index=index)))
@@ -17,60 +17,604 @@ limitations under the License.
 
 __author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
 
+import collections
+import importlib
 import logging
+import threading
+import time
 
-from plugins import base_64
-from plugins import fromcharcode
-from plugins import hex2ascii
-from plugins import punycode
-from plugins import replace
-from plugins import rot13
-from plugins import strrev
-from plugins import url
-from plugins import xor
-from plugins import punycode
-
-AVAILABLE_PLUGINS = (
-  base_64.Base64Decode(),
-  base_64.Base64Encode(),
-  base_64.UrlSafeBase64Decode(),
-  base_64.UrlSafeBase64Encode(),
-  hex2ascii.Hex2Ascii(),
-  url.UrlEncode(),
-  url.UrlDecode(),
-  fromcharcode.FromCharCode(),
-  punycode.PunycodeEncode(),
-  punycode.PunycodeDecode(),
-  replace.Replace(),
-  rot13.Rot13Decode(),
-  rot13.Rot13Encode(),
-  strrev.StrRev(),
-  xor.Xor(),
-  xor.IncrementalXor()
-)
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+from plugins import compat
+from plugins import streaming
+import values
+
+# Other packages add plugins by declaring entry points in this group. Each
+# entry point names either a plugin class or a PluginInfo describing one; the
+# latter lets a package list its plugins without importing them.
+ENTRY_POINT_GROUP = 'babbage.plugins'
+
+IDENTITY_TABLE = compat.ByteString(compat.xrange(256))
 
 
 class Error(Exception):
   """Base exception class for plugin errors."""
 
 
-def ListPlugins():
+class PluginInfo(object):
+  """What is known of a plugin before its module is imported.
+
+  The module is imported, and the plugin created, the first time it is used.
+  The name, description and options registered here are the plugin's own:
+  they are set on the plugin when it is created, so plugin classes do not
+  repeat them.
+  """
+
+  def __init__(self, module, class_name, name, description, options=(),
+               plugin=None):
+    """Initializer.
+
+    Args:
+      module: Name of the module defining the plugin class.
+      class_name: Name of the plugin class.
+      name: Name of the plugin.
+      description: Description of the plugin.
+      options: Descriptions of the plugin's options.
+      plugin: The plugin, if it has already been created.
+    """
+    self.module = module
+    self.class_name = class_name
+    self.name = name
+    self.description = description
+    self.options = list(options)
+    self._plugin = plugin
+
+  def Load(self):
+    """Returns the plugin, importing its module on first use."""
+    if self._plugin is None:
+      plugin = getattr(importlib.import_module(self.module), self.class_name)()
+      plugin.name = self.name
+      plugin.description = self.description
+      plugin.options = list(self.options)
+      self._plugin = plugin
+    return self._plugin
+
+
+BUILTIN_PLUGINS = (
+  PluginInfo('plugins.base_64', 'Base64Decode', 'Base 64 decode',
+             'Returns a base 64 decoded string.'),
+  PluginInfo('plugins.base_64', 'Base64Encode', 'Base 64 encode',
+             'Returns a base 64 encoded string.'),
+  PluginInfo('plugins.base_64', 'UrlSafeBase64Decode',
+             'URL-safe Base 64 decode',
+             'Returns a url-safe base 64 decoded string.'),
+  PluginInfo('plugins.base_64', 'UrlSafeBase64Encode',
+             'URL-safe Base 64 encode',
+             'Returns a URL-safe base 64 encoded string.'),
+  PluginInfo('plugins.hex2ascii', 'Hex2Ascii', 'Hex2Ascii',
+             'Displays ascii from hexdecimal.'),
+  PluginInfo('plugins.hex2ascii', 'HexDecode', 'Hex decode',
+             'Decodes hexadecimal, ignoring other characters, as escaped '
+             'text, a hexdump or raw bytes.',
+             ['Output style: escape (default), hexdump or raw']),
+  PluginInfo('plugins.hexdump', 'Hexdump', 'Hexdump',
+             'Shows data as offsets, hex bytes and ASCII, optionally only for '
+             'a range of bytes.',
+             ['Start offset in bytes (default 0)',
+              'Length in bytes (default all)']),
+  PluginInfo('plugins.url', 'UrlEncode', 'Url encode',
+             'Returns a url encoded string. Ex: \'tom is cool\''
+             '\'tom%20is%20cool\'.'),
+  PluginInfo('plugins.url', 'UrlDecode', 'Url decode',
+             'Returns a url decoded string. Ex: \'tom%is%cool\''
+             '\'tom is cool\'.'),
+  PluginInfo('plugins.fromcharcode', 'FromCharCode', 'fromCharCode',
+             'Takes decimal, hex or octal character codes, or JavaScript and '
+             'HTML escapes, and returns the characters.'),
+  PluginInfo('plugins.extract', 'ExtractEncoded', 'Extract encoded strings',
+             'Finds and decodes base 64, hex, url encoded and charcode '
+             'strings anywhere in the data, and the strings encoded within '
+             'those.',
+             ['Maximum depth, default 3',
+              'Minimum length of hex and base 64, default 16']),
+  PluginInfo('plugins.multireplace', 'MultiReplace', 'Multi replace',
+             'Replaces many strings in one pass, the longest match first: '
+             '"he=1,hello=2", "hello help" == "2 1lp"',
+             ['Pairs: search=replace,search=replace (url encoded)',
+              'Mode: text (default) or regex']),
+  PluginInfo('plugins.punycode', 'PunycodeEncode', 'Punycode encode',
+             'Returns a punycode encoded string.'),
+  PluginInfo('plugins.punycode', 'PunycodeDecode', 'Punycode decode',
+             'Returns a punycode decoded string.'),
+  PluginInfo('plugins.replace', 'Replace', 'Replace',
+             'Simple replace, "o", "i", "tommy" == "timmy"',
+             ['What to look for', 'What to replace it with']),
+  PluginInfo('plugins.rot13', 'Rot13Decode', 'ROT-13 decode',
+             'Returns a ROT-13 decoded string.'),
+  PluginInfo('plugins.rot13', 'Rot13Encode', 'ROT-13 encode',
+             'Returns a ROT-13 encoded string.'),
+  PluginInfo('plugins.strrev', 'StrRev', 'String reverse',
+             'Returns a reversed string. Ex: \'J3byJXZ"(edoced_46esab(lave"\''
+             '\'eval(base64_decode("ZXJyb3J\''),
+  PluginInfo('plugins.xor', 'Xor', 'Xor',
+             'Expecting an two letter hex value to XOR, for example: BA or '
+             'FE.',
+             ['XOR byte Ex: BA or FE']),
+  PluginInfo('plugins.xor', 'IncrementalXor', 'Incremental Xor',
+             'Does a incremental XOR with provided key. For example: BE or '
+             'FF',
+             ['XOR byte Ex: BA or FE']),
+  PluginInfo('plugins.xor', 'BruteForceXor', 'Brute force Xor',
+             'Tries every single byte XOR key and lists the keys giving the '
+             'most readable output.'),
+  PluginInfo('plugins.xor', 'BruteForceIncrementalXor',
+             'Brute force Incremental Xor',
+             'Tries every starting key for an incremental XOR and lists the '
+             'keys giving the most readable output.'),
+  PluginInfo('plugins.xor', 'RepeatingKeyXor', 'Repeating key Xor',
+             'XORs with a multi-byte key repeated over the input, for '
+             'example: DEADBEEF.',
+             ['XOR key in hex Ex: DEADBEEF']),
+  PluginInfo('plugins.xor', 'SolveRepeatingKeyXor', 'Solve repeating key Xor',
+             'Guesses the key of a repeating key XOR and returns the key and '
+             'decoded data.',
+             ['Maximum key length, default 64']),
+)
+
+_BUILTIN_BY_NAME = dict((info.name, info) for info in BUILTIN_PLUGINS)
+
+# Every plugin by name, including those found through entry points. Filled in
+# on first use, since looking up entry points is slow.
+_registry = None
+
+
+def _EntryPoints():
+  """Returns the entry points in ENTRY_POINT_GROUP."""
+  try:
+    from importlib import metadata
+  except ImportError:
+    metadata = None
+  if metadata is not None:
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+      return list(entry_points.select(group=ENTRY_POINT_GROUP))
+    return list(entry_points.get(ENTRY_POINT_GROUP, ()))
+  try:
+    import pkg_resources
+  except ImportError:
+    return []
+  return list(pkg_resources.iter_entry_points(ENTRY_POINT_GROUP))
+
+
+def _DiscoverPlugins():
+  """Returns a PluginInfo for each plugin declared in ENTRY_POINT_GROUP."""
+  infos = []
+  for entry_point in _EntryPoints():
+    try:
+      loaded = entry_point.load()
+      if not isinstance(loaded, PluginInfo):
+        plugin = loaded()
+        loaded = PluginInfo(loaded.__module__, loaded.__name__, plugin.name,
+                            plugin.description, plugin.options, plugin)
+    except Exception as e:
+      logging.error('Plugin entry point %s failed to load: %s' % (
+          entry_point, str(e)))
+      continue
+    infos.append(loaded)
+  return infos
+
+
+def _Registry():
+  global _registry
+  if _registry is None:
+    registry = collections.OrderedDict(
+        (info.name, info) for info in BUILTIN_PLUGINS)
+    for info in _DiscoverPlugins():
+      if info.name in registry:
+        logging.error('Plugin %s is already registered.' % info.name)
+        continue
+      registry[info.name] = info
+    _registry = registry
+  return _registry
+
+
+def Plugins():
+  """Returns the PluginInfo of every plugin, built in plugins first."""
+  return list(_Registry().values())
+
+
+def GetPlugin(name):
+  """Returns the named plugin, importing it on first use.
+
+  Built in plugins are found without looking up entry points.
+
+  Args:
+    name: Name of the plugin.
+
+  Returns:
+    The plugin, or None if there is no plugin of that name.
+
+  Raises:
+    Error: The plugin failed to load.
+  """
+  info = _BUILTIN_BY_NAME.get(name) or _Registry().get(name)
+  if info is None:
+    return None
+  try:
+    return info.Load()
+  except Exception as e:
+    logging.error('Plugin %s failed to load: %s' % (name, str(e)))
+    raise Error(e)
+
+
+# Compiled pipelines are reused across requests; the cache is simply dropped
+# once it grows past this many distinct plugin chains.
+MAX_CACHED_PIPELINES = 256
+
+_pipeline_cache = {}
+
+
+class Stage(object):
+  """A plugin bound to its options and ready to run.
+
+  Plugins may define Compile(options), which parses and validates the options
+  once and returns a callable taking only the data. Plugins without it are
+  wrapped so that Process is called with the stored options.
+
+  Plugins which map each byte to another byte may define ByteTable(options),
+  returning their 256 byte translation table or None, so that neighbouring
+  stages can be fused. Plugins whose output is restored exactly by another
+  plugin name it in their 'inverse' attribute.
+
+  Plugins are given bytes, or text if their 'text' attribute is true. Either
+  kind may be returned.
+  """
+
+  def __init__(self, plugin, options):
+    self.plugin = plugin
+    self.name = plugin.name
+    self.options = options
+    if hasattr(plugin, 'Compile'):
+      self.process = plugin.Compile(options)
+    else:
+      self.process = lambda data: plugin.Process(data, options)
+    self.streaming = getattr(plugin, 'streaming', streaming.WHOLE_INPUT)
+    self.text = bool(getattr(plugin, 'text', False))
+    self.table = None
+    if hasattr(plugin, 'ByteTable'):
+      self.table = plugin.ByteTable(options)
+    self.inverse = None if options else getattr(plugin, 'inverse', None)
+
+  def Stream(self, chunks):
+    """Runs the stage over an iterable of chunks.
+
+    Stateless stages process each chunk as it arrives, stateful stages carry
+    state between chunks and whole input stages buffer everything first.
+
+    Args:
+      chunks: Iterable of text for text stages, otherwise of bytes.
+
+    Yields:
+      Non-empty output bytes or text.
+    """
+    if self.streaming == streaming.STATELESS:
+      outputs = (self.process(chunk) for chunk in chunks)
+    elif self.streaming == streaming.STATEFUL:
+      outputs = self._StreamIncremental(chunks)
+    else:
+      outputs = iter([self.process((u'' if self.text else b'').join(chunks))])
+    for output in outputs:
+      if output:
+        yield output
+
+  def _StreamIncremental(self, chunks):
+    incremental = self.plugin.Incremental(self.options)
+    for chunk in chunks:
+      yield incremental.Process(chunk)
+    yield incremental.Flush()
+
+
+class _FusedTables(object):
+  """Runs consecutive byte to byte stages as a single translation."""
+
+  def __init__(self, stages, table):
+    self.name = ' + '.join(stage.name for stage in stages)
+    self.description = 'Fused ' + ', '.join(stage.name for stage in stages)
+    self.options = []
+    self.streaming = streaming.STATELESS
+    self._table = table
+
+  def Compile(self, unused_options):
+    return lambda data: data.translate(self._table)
+
+  def ByteTable(self, unused_options):
+    return self._table
+
+
+def Optimize(stages):
+  """Fuses and drops stages without changing what a pipeline outputs.
+
+  Consecutive stages with byte tables are composed into one table, so they
+  make a single pass over the data. Tables which change nothing are dropped,
+  as are stages directly followed by their inverse.
+
+  Args:
+    stages: List of Stages.
+
+  Returns:
+    Tuple of the list of optimized Stages and a list of descriptions of what
+    was changed.
+  """
+  # Each entry is a Stage and the original stages it stands for.
+  optimized = []
+  changes = []
+  for stage in stages:
+    previous, merged = optimized[-1] if optimized else (None, [])
+    if stage.table is not None and previous and previous.table is not None:
+      optimized.pop()
+      merged = merged + [stage]
+      table = previous.table.translate(stage.table)
+      if table == IDENTITY_TABLE:
+        changes.append('Dropped %s, which together change nothing.' %
+                       ', '.join(s.name for s in merged))
+        continue
+      optimized.append((Stage(_FusedTables(merged, table), []), merged))
+    elif stage.table == IDENTITY_TABLE:
+      changes.append('Dropped %s, which changes nothing.' % stage.name)
+    elif previous and previous.inverse == stage.name:
+      optimized.pop()
+      changes.append('Dropped %s followed by %s.' % (previous.name, stage.name))
+    else:
+      optimized.append((stage, [stage]))
+  for stage, merged in optimized:
+    if len(merged) > 1:
+      changes.append('Fused %s into one translation.' %
+                     ', '.join(s.name for s in merged))
+  return [stage for stage, _ in optimized], changes
+
+
+def _AllocatedBytes():
+  """Returns traced allocated bytes, or None when tracemalloc is not tracing."""
+  if tracemalloc is None or not tracemalloc.is_tracing():
+    return None
+  return tracemalloc.get_traced_memory()[0]
+
+
+# Runs tracing their allocations, and whether tracing was started for them
+# rather than already on. Tracing slows every allocation, so it is stopped
+# again once no run needs it.
+_tracing_lock = threading.Lock()
+_tracing_runs = 0
+_tracing_started = False
+
+
+def _StartTracing():
+  global _tracing_runs, _tracing_started
+  if tracemalloc is None:
+    return
+  with _tracing_lock:
+    if not _tracing_runs and not tracemalloc.is_tracing():
+      tracemalloc.start()
+      _tracing_started = True
+    _tracing_runs += 1
+
+
+def _StopTracing():
+  global _tracing_runs, _tracing_started
+  if tracemalloc is None:
+    return
+  with _tracing_lock:
+    _tracing_runs -= 1
+    if not _tracing_runs and _tracing_started:
+      tracemalloc.stop()
+      _tracing_started = False
+
+
+class Pipeline(object):
+  """A compiled list of stages which can be run against many inputs."""
+
+  def __init__(self, stages, optimizations=()):
+    """Initializer.
+
+    Args:
+      stages: List of Stages to run in turn.
+      optimizations: Descriptions of how the stages were optimized.
+    """
+    self.stages = stages
+    self.optimizations = list(optimizations)
+
+  def Process(self, data, trace=None, encoding=None, allocations=False):
+    """Passes data through each stage in turn.
+
+    Args:
+      data: Bytes to be processed.
+      trace: Optional list. If given, a dict is appended for each stage run
+        with its 'plugin' name, wall time in 'seconds', 'input_size',
+        'output_size' and 'allocated_bytes', the change in memory traced by
+        tracemalloc or None when it is not tracing. Sizes are in bytes, or in
+        characters for text. A stage which fails is appended too, with an
+        'output_size' of 0 and its 'failure'.
+      encoding: Name of the encoding text stages decode the data with, UTF-8
+        by default.
+      allocations: Whether to trace allocations with tracemalloc while the
+        stages run, so that 'allocated_bytes' is filled in. Allocations of
+        other threads are counted too. Python 2 has no tracemalloc, so there
+        'allocated_bytes' is always None.
+
+    Returns:
+      The bytes output by the last stage.
+
+    Raises:
+      Error: A stage failed to process the data.
+    """
+    if allocations and trace is not None:
+      _StartTracing()
+    try:
+      return self._Process(data, trace, encoding)
+    finally:
+      if allocations and trace is not None:
+        _StopTracing()
+
+  def _Process(self, data, trace, encoding):
+    value = values.Value(data, encoding)
+    for stage in self.stages:
+      data = value.Get(stage.text)
+      if trace is not None:
+        input_size = len(data)
+        allocated_before = _AllocatedBytes()
+        started = time.time()
+      try:
+        data = stage.process(data)
+        value = values.Value(data, value.encoding)
+      except Exception as e:
+        logging.error('ProcessPlugins exception: %s' % str(e))
+        if trace is not None:
+          trace.append(self._TraceStage(
+              stage, started, input_size, 0, allocated_before, str(e)))
+        raise Error(e)
+      if trace is not None:
+        trace.append(self._TraceStage(
+            stage, started, input_size, len(data), allocated_before))
+    try:
+      return value.Bytes()
+    except Exception as e:
+      logging.error('ProcessPlugins exception: %s' % str(e))
+      raise Error(e)
+
+  def _TraceStage(self, stage, started, input_size, output_size,
+                  allocated_before, failure=None):
+    """Returns the trace dict of a stage which has just run."""
+    allocated_after = _AllocatedBytes()
+    traced = {
+        'plugin': stage.name,
+        'seconds': time.time() - started,
+        'input_size': input_size,
+        'output_size': output_size,
+        'allocated_bytes': (None if None in (allocated_before, allocated_after)
+                            else allocated_after - allocated_before)}
+    if failure is not None:
+      traced['failure'] = failure
+    return traced
+
+  def Stream(self, chunks, encoding=None):
+    """Passes an iterable of chunks through the stages as chained generators.
+
+    Only stages which need their whole input buffer it, so memory use stays
+    bounded by the chunk size for streaming-capable chains.
+
+    Args:
+      chunks: Iterable of bytes.
+      encoding: Name of the encoding text stages decode the data with, UTF-8
+        by default.
+
+    Yields:
+      Output bytes.
+
+    Raises:
+      Error: A stage failed to process the data.
+    """
+    for stage in self.stages:
+      if stage.text:
+        chunks = values.Decoded(chunks, encoding)
+      else:
+        chunks = values.Encoded(chunks, encoding)
+      chunks = stage.Stream(chunks)
+    chunks = values.Encoded(chunks, encoding)
+    try:
+      for chunk in chunks:
+        if chunk:
+          yield chunk
+    except Exception as e:
+      logging.error('ProcessPlugins exception: %s' % str(e))
+      raise Error(e)
+
+
+def ListPlugins(discover=True):
   """List plugins via dict to frontend.
 
+  No plugin module is imported to build the list.
+
+  Args:
+    discover: Whether to include plugins declared through entry points.
+      Without them the slow entry point lookup is skipped.
+
   Returns:
     A list of dictionaries containing the plugin 'name', 'options', and
     'description'.
   """
   available_plugins = []
-  for current_plugin in AVAILABLE_PLUGINS:
+  for current_plugin in Plugins() if discover else BUILTIN_PLUGINS:
     available_plugins.append({
         'name': current_plugin.name,
         'optionsDesc': current_plugin.options,
-        'options': ['' for x in xrange(len(current_plugin.options))],
+        'options': ['' for _ in current_plugin.options],
         'description': current_plugin.description})
   return available_plugins
 
 
+def ChainKey(plugins):
+  """Returns a hashable key identifying a plugin chain and its options.
+
+  Args:
+    plugins: List of dicts with plugins to process: [{'name': 'Base 64 Encode'}]
+
+  Returns:
+    Tuple of (name, options) tuples.
+  """
+  return tuple((plugin['name'], tuple(plugin.get('options') or ()))
+               for plugin in plugins)
+
+
+def CompilePipeline(plugins):
+  """Resolves plugin names, parses their options once and optimizes the stages.
+
+  Args:
+    plugins: List of dicts with plugins to process: [{'name': 'Base 64 Encode'}]
+
+  Returns:
+    A Pipeline ready to process data.
+
+  Raises:
+    Error: A plugin was not found or its options were invalid.
+  """
+  stages = []
+  for plugin in plugins:
+    current_plugin = GetPlugin(plugin['name'])
+    if current_plugin is None:
+      raise Error('Plugin not found: %s' % plugin['name'])
+    try:
+      stages.append(Stage(current_plugin, plugin.get('options') or []))
+    except Exception as e:
+      logging.error('CompilePipeline exception: %s' % str(e))
+      raise Error(e)
+  stages, optimizations = Optimize(stages)
+  for optimization in optimizations:
+    logging.info('CompilePipeline: %s' % optimization)
+  return Pipeline(stages, optimizations)
+
+
+def GetPipeline(plugins):
+  """Returns a compiled pipeline for the plugins, reusing an earlier one.
+
+  Args:
+    plugins: List of dicts with plugins to process: [{'name': 'Base 64 Encode'}]
+
+  Returns:
+    A Pipeline ready to process data.
+  """
+  key = ChainKey(plugins)
+  pipeline = _pipeline_cache.get(key)
+  if pipeline is None:
+    pipeline = CompilePipeline(plugins)
+    if len(_pipeline_cache) >= MAX_CACHED_PIPELINES:
+      _pipeline_cache.clear()
+    _pipeline_cache[key] = pipeline
+  return pipeline
+
+
 def ProcessPlugins(data, plugins):
   """Passes data to plugins, sends back response.
 
@@ -81,12 +625,4 @@ def ProcessPlugins(data, plugins):
   Returns:
     Dict of decoded data containing a success or failure.
   """
-  for plugin in plugins:
-    for current_plugin in AVAILABLE_PLUGINS:
-      if plugin['name'] == current_plugin.name:
-        try:
-          data = current_plugin.Process(data, plugin['options'])
-        except Exception as e:
-          logging.error('ProcessPlugins exception: %s' % str(e))
-          raise Error(e)
-  return data
+  return GetPipeline(plugins).Process(data)
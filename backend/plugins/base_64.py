@@ -18,14 +18,23 @@ limitations under the License.
 __author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
 
 import base64
+import string
+
+from plugins import streaming
+
+BASE64_CHARS = (string.ascii_letters + string.digits + '+/=').encode('ascii')
+URLSAFE_BASE64_CHARS = BASE64_CHARS + b'-_'
+WHITESPACE_CHARS = string.whitespace.encode('ascii')
 
 
 class Base64Encode(object):
 
   def __init__(self):
-    self.name = 'Base 64 encode'
-    self.description = 'Returns a base 64 encoded string.'
-    self.options = []
+    self.streaming = streaming.STATEFUL
+    self.inverse = 'Base 64 decode'
+
+  def Incremental(self, unused_options):
+    return streaming.BlockAligned(base64.b64encode, 3)
 
   def Process(self, incoming_data, unused_options):
     """Simple base64 encoding.
@@ -43,9 +52,17 @@ class Base64Encode(object):
 class Base64Decode(object):
 
   def __init__(self):
-    self.name = 'Base 64 decode'
-    self.description = 'Returns a base 64 decoded string.'
-    self.options = []
+    self.streaming = streaming.STATEFUL
+
+  def Incremental(self, options):
+    return streaming.BlockAligned(
+        lambda data: self.Process(data, options), 4,
+        streaming.CharsNotIn(BASE64_CHARS))
+
+  def Accepts(self, incoming_data):
+    """Returns whether the data only uses the base64 alphabet."""
+    return (len(incoming_data.strip()) >= 4 and
+            not incoming_data.translate(None, BASE64_CHARS + WHITESPACE_CHARS))
 
   def Process(self, incoming_data, unused_options):
     """Simple base64 decode, accepting strings with omitted padding.
@@ -58,14 +75,16 @@ class Base64Decode(object):
       Base64 decoded string.
     """
     missing_padding = 4 - len(incoming_data) % 4
-    return base64.b64decode(incoming_data + '=' * missing_padding)
+    return base64.b64decode(incoming_data + b'=' * missing_padding)
 
 class UrlSafeBase64Encode(object):
 
   def __init__(self):
-    self.name = 'URL-safe Base 64 encode'
-    self.description = 'Returns a URL-safe base 64 encoded string.'
-    self.options = []
+    self.streaming = streaming.STATEFUL
+    self.inverse = 'URL-safe Base 64 decode'
+
+  def Incremental(self, unused_options):
+    return streaming.BlockAligned(base64.urlsafe_b64encode, 3)
 
   def Process(self, incoming_data, unused_options):
     """URL-safe base64 encoding.
@@ -84,9 +103,18 @@ class UrlSafeBase64Encode(object):
 class UrlSafeBase64Decode(object):
 
   def __init__(self):
-    self.name = 'URL-safe Base 64 decode'
-    self.description = 'Returns a url-safe base 64 decoded string.'
-    self.options = []
+    self.streaming = streaming.STATEFUL
+
+  def Incremental(self, options):
+    return streaming.BlockAligned(
+        lambda data: self.Process(data, options), 4,
+        streaming.CharsNotIn(URLSAFE_BASE64_CHARS))
+
+  def Accepts(self, incoming_data):
+    """Returns whether the data only uses the URL-safe base64 alphabet."""
+    return (len(incoming_data.strip()) >= 4 and
+            not incoming_data.translate(
+                None, URLSAFE_BASE64_CHARS + WHITESPACE_CHARS))
 
   def Process(self, incoming_data, unused_options):
     """URL-safe base64 decode, accepting strings with omitted padding.
@@ -100,4 +128,4 @@ class UrlSafeBase64Decode(object):
       URL-safe Base64 decoded string.
     """
     missing_padding = 4 - len(incoming_data) % 4
-    return base64.urlsafe_b64decode(incoming_data + '=' * missing_padding)
+    return base64.urlsafe_b64decode(incoming_data + b'=' * missing_padding)
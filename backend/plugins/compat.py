@@ -0,0 +1,74 @@
+"""Python 2 and 3 compatibility for Babbage.
+
+Data passed between plugins is bytes, which is str under Python 2. These
+helpers take and return bytes under both.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import sys
+
+PY3 = sys.version_info[0] >= 3
+
+if PY3:
+  import urllib.parse
+
+  text_type = str
+  unichr = chr
+  xrange = range
+  maketrans = bytes.maketrans
+
+  def UrlQuote(data, safe=b'/'):
+    return urllib.parse.quote_from_bytes(data, safe).encode('ascii')
+
+  def UrlUnquote(data):
+    return urllib.parse.unquote_to_bytes(data)
+
+else:
+  import string
+  import urllib
+
+  text_type = unicode
+  unichr = unichr
+  xrange = xrange
+  maketrans = string.maketrans
+
+  def UrlQuote(data, safe='/'):
+    return urllib.quote(data, safe)
+
+  def UrlUnquote(data):
+    return urllib.unquote(data)
+
+
+def ToBytes(data, encoding='utf-8'):
+  """Returns text encoded as bytes, or bytes unchanged.
+
+  Plugin options arrive as text, so options compared with or inserted into
+  the data are converted with this.
+  """
+  if isinstance(data, text_type):
+    return data.encode(encoding)
+  return data
+
+
+def ByteString(values):
+  """Returns bytes from an iterable of byte values."""
+  return bytes(bytearray(values))
+
+
+# BYTE_CHARS[i] is the single byte of value i.
+BYTE_CHARS = [ByteString([i]) for i in xrange(256)]
@@ -0,0 +1,272 @@
+"""Finds encoded strings embedded in data and decodes them.
+
+Base 64, hex, url encoded and charcode runs are found anywhere in the data.
+Each run is decoded and the decoded data is scanned in turn, up to a maximum
+depth. For example:
+
+  GET /?q=%61%6c%65%72%74 aGVsbG8gd29ybGQgZnJvbSBiYWJiYWdl
+
+is reported as:
+
+  0x00000008-0x00000017 url: alert
+  0x00000018-0x00000038 base64: hello world from babbage
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import binascii
+import re
+
+from plugins import compat
+from plugins import hex2ascii
+from plugins import scoring
+from plugins import streaming
+
+DEFAULT_MAX_DEPTH = 3
+DEFAULT_MIN_LENGTH = 16
+# Long words and identifiers also look like hex or base 64, so those runs are
+# only reported if this fraction of their decoded data is printable.
+MIN_PRINTABILITY = 0.9
+
+# One compiled regex per encoding, each starting with a literal or a character
+# class so that the regex engine can skip quickly to where a run may start. A
+# single regex of alternatives would be tried at every position, which is
+# several times slower. Hex runs are found by the base 64 pattern and told
+# apart afterwards.
+URL_RE = re.compile(br'%[0-9A-Fa-f]{2}[A-Za-z0-9._~+-]*'
+                    br'(?:%[0-9A-Fa-f]{2}[A-Za-z0-9._~+-]*){2,}')
+ESCAPED_HEX_RE = re.compile(br'\\x[0-9A-Fa-f]{2}(?:\\x[0-9A-Fa-f]{2}){3,}')
+CHARCODE_RE = re.compile(br'[0-9][0-9]{1,2}(?:[ \t]*,[ \t]*[0-9]{2,3}){3,}')
+BASE64_PATTERN = r'[A-Za-z0-9+/][A-Za-z0-9+/]{%d,}={0,2}'
+CHARCODE_SEPARATOR_RE = re.compile(br'[ \t]*,[ \t]*')
+
+HEXADECIMAL_CHARS = b'0123456789abcdefABCDEF'
+# Unescaped characters which may lead up to the first escape of a url encoded
+# run, as in 'select%20'.
+URL_CHARS = (b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+             b'0123456789._~+-')
+
+# Compiled base 64 patterns by minimum run length.
+_BASE64_PATTERNS = {}
+
+
+def _DecodeCharcode(text):
+  codes = [int(code) for code in CHARCODE_SEPARATOR_RE.split(text)]
+  if max(codes) < 256:
+    return compat.ByteString(codes)
+  return u''.join(map(compat.unichr, codes)).encode('utf-8')
+
+
+def _DecodeEscapedHex(text):
+  return binascii.unhexlify(text.replace(b'\\x', b''))
+
+
+def _DecodeBase64(text):
+  text = text.rstrip(b'=')
+  text = text[:len(text) - (len(text) % 4 == 1)]
+  return binascii.a2b_base64(text + b'=' * (-len(text) % 4))
+
+
+# Decoder for each kind of run, and whether its output must be
+# mostly printable to be reported.
+DECODERS = {
+    'charcode': (_DecodeCharcode, False),
+    'url': (compat.UrlUnquote, False),
+    'escaped_hex': (_DecodeEscapedHex, False),
+    'hex': (binascii.unhexlify, True),
+    'base64': (_DecodeBase64, True),
+}
+
+
+def CompiledPatterns(min_length):
+  """Returns the (kind, regex) pairs to scan with, most specific first."""
+  base64_re = _BASE64_PATTERNS.get(min_length)
+  if base64_re is None:
+    base64_re = _BASE64_PATTERNS[min_length] = re.compile(
+        (BASE64_PATTERN % (min_length - 1)).encode('ascii'))
+  return (('url', URL_RE), ('escaped_hex', ESCAPED_HEX_RE),
+          ('charcode', CHARCODE_RE), ('base64', base64_re))
+
+
+def FindRuns(data, min_length=DEFAULT_MIN_LENGTH):
+  """Finds the encoded runs in data.
+
+  Where runs overlap, the one starting first is kept, or the more specific
+  one if they start together.
+
+  Args:
+    data: String to scan.
+    min_length: Shortest hex or base 64 run found.
+
+  Returns:
+    List of (start, end, kind) tuples in the order they occur.
+  """
+  matches = []
+  for precedence, (kind, regex) in enumerate(CompiledPatterns(min_length)):
+    for match in regex.finditer(data):
+      matches.append((match.start(), precedence, match.end(), kind))
+  matches.sort()
+  runs = []
+  last_end = 0
+  for start, _, end, kind in matches:
+    if start < last_end:
+      continue
+    if kind == 'charcode' and (data[start - 1:start].isdigit() or
+                               data[end:end + 1].isdigit()):
+      continue
+    if kind == 'url':
+      while start > last_end and data[start - 1] in URL_CHARS:
+        start -= 1
+    elif kind == 'base64':
+      run = data[start:end]
+      if len(run) % 2 == 0 and not run.translate(None, HEXADECIMAL_CHARS):
+        kind = 'hex'
+    runs.append((start, end, kind))
+    last_end = end
+  return runs
+
+
+class Finding(object):
+  """An encoded run found in data, with what it decoded to."""
+
+  def __init__(self, path, end, kind, decoded, children, first_path=None):
+    """Initializer.
+
+    Args:
+      path: Tuple of the offsets of the runs enclosing this one, outermost
+        first, each in the data decoded from the one before, followed by the
+        offset of this run in the data scanned.
+      end: Offset just after the run.
+      kind: Name of the encoding, a key of DECODERS.
+      decoded: The decoded run.
+      children: List of Findings in the decoded run.
+      first_path: Path of the first identical run, if this is a repeat.
+    """
+    self.path = path
+    self.start = path[-1]
+    self.end = end
+    self.kind = kind
+    self.decoded = decoded
+    self.children = children
+    self.first_path = first_path
+
+
+def Scan(data, max_depth=DEFAULT_MAX_DEPTH, min_length=DEFAULT_MIN_LENGTH,
+         seen=None, path=()):
+  """Finds and decodes the encoded runs in data, recursing into each.
+
+  Args:
+    data: String to scan.
+    max_depth: Levels of decoded data to scan, 1 for only data itself.
+    min_length: Shortest hex or base 64 run reported.
+    seen: Dict shared by the whole scan, mapping each (kind, run) already
+      decoded to its Finding, so repeated runs are decoded once.
+    path: Offsets of the runs data was decoded from, outermost first.
+
+  Returns:
+    List of Findings in the order they occur.
+  """
+  if seen is None:
+    seen = {}
+  findings = []
+  for start, end, kind in FindRuns(data, min_length):
+    run = data[start:end]
+    first = seen.get((kind, run))
+    if first is not None:
+      if first.decoded is not None:
+        findings.append(Finding(path + (start,), end, kind, first.decoded,
+                                first.children, first.path))
+      continue
+    decode, printable_only = DECODERS[kind]
+    try:
+      decoded = decode(run)
+    except (binascii.Error, TypeError, ValueError):
+      decoded = None
+    if not decoded or (printable_only and scoring.Printability(
+        decoded[:scoring.SAMPLE_SIZE]) < MIN_PRINTABILITY):
+      seen[(kind, run)] = Finding(path + (start,), end, kind, None, [])
+      continue
+    children = []
+    if max_depth > 1:
+      children = Scan(decoded, max_depth - 1, min_length, seen,
+                      path + (start,))
+    finding = Finding(path + (start,), end, kind, decoded, children)
+    seen[(kind, run)] = finding
+    findings.append(finding)
+  return findings
+
+
+def Format(findings, indent=b''):
+  """Formats findings as one line each, nested findings indented below.
+
+  A repeated run is shown once in full and afterwards by the path to its
+  first occurrence: the offset of each enclosing run, outermost first, and
+  of the run itself, joined by '/'.
+  """
+  lines = []
+  for finding in findings:
+    span = b'%s0x%08x-0x%08x %s: ' % (indent, finding.start, finding.end,
+                                      finding.kind.encode('ascii'))
+    if finding.first_path is not None:
+      lines.append(span + b'same as ' + b'/'.join(
+          b'0x%08x' % offset for offset in finding.first_path))
+      continue
+    lines.append(span + hex2ascii.Escape(finding.decoded))
+    lines.extend(Format(finding.children, indent + b'  '))
+  return lines
+
+
+def ParseOptions(options):
+  """Returns the maximum depth and minimum run length from the options."""
+  options = list(options) + ['', '']
+  max_depth = int(options[0]) if options[0].strip() else DEFAULT_MAX_DEPTH
+  min_length = int(options[1]) if options[1].strip() else DEFAULT_MIN_LENGTH
+  if max_depth < 1 or min_length < 2:
+    raise ValueError('The depth must be at least 1 and the length at least 2.')
+  return max_depth, min_length
+
+
+class ExtractEncoded(object):
+
+  def __init__(self):
+    self.streaming = streaming.WHOLE_INPUT
+
+  def Compile(self, options):
+    """Parses the options and compiles the scanning regexes once.
+
+    Args:
+      options: Optional maximum depth and minimum run length.
+
+    Returns:
+      Callable taking the string of data to process.
+    """
+    max_depth, min_length = ParseOptions(options)
+    CompiledPatterns(min_length)
+    return lambda incoming_data: b'\n'.join(
+        Format(Scan(incoming_data, max_depth, min_length)))
+
+  def Process(self, incoming_data, options):
+    """Lists the encoded strings in the data with their offsets and decodings.
+
+    Args:
+      incoming_data: String of data to process.
+      options: Optional maximum depth and minimum run length.
+
+    Returns:
+      One line per encoded string found.
+    """
+    return self.Compile(options)(incoming_data)
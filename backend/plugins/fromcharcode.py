@@ -1,7 +1,23 @@
 """Detects all strings likely to contain fromCharCode data and decodes them.
 
+Character codes may be listed in decimal, hexadecimal (0x74) or octal (0o164),
+or be given as JavaScript (\\x74, \\u0074, \\u{74}) or HTML (&#116;, &#x74;)
+escapes. A leading zero does not make a number octal, so zero padded codes
+such as 072 are read as decimal. Every run of codes in the data is decoded and
+the runs are returned one per line.
+
 For example:
   116,111,109,109,121 will be decoded to 'tommy'.
+  0x74,0o157,109,109,121 will be decoded to 'tommy'.
+  \\x74\\u006f&#109;&#x6d;&#x79; will be decoded to 'tommy'.
+
+Every form is found by one scan for runs of the characters codes are written
+with, a single character class which the regex engine matches without
+backtracking. Each run is then split on its commas, or into its escapes, and
+only a run which does not split cleanly, such as a number followed by a word,
+is scanned again with the exact pattern. Minified JavaScript repeats the same
+few codes many times, so each distinct code, as written, is converted to its
+character once and then looked up.
 
 Copyright 2014 Google Inc. All rights reserved.
 
@@ -22,14 +38,156 @@ __author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
 
 import re
 
+from plugins import compat
+from plugins import streaming
+
+NUMBER_PATTERN = br'(?:0[xX][0-9A-Fa-f]+|0[oO][0-7]+|[0-9]+)'
+ESCAPE_PATTERN = (br'(?:\\x[0-9A-Fa-f]{2}|\\u[0-9A-Fa-f]{4}|\\u\{[0-9A-Fa-f]+\}'
+                  br'|&#[xX][0-9A-Fa-f]+;?|&#[0-9]+;?)')
+
+# Runs of the characters numbers, escapes and their separators are made of.
+RUN_RE = re.compile(br'[0-9\\&][0-9A-Fa-fxXoOuU{}#&;\\,\s]*')
+SEPARATOR_CHARS = b', \t\r\n\x0b\x0c'
+# Characters which may follow a list of numbers in a run but not end one, as
+# in '1};'.
+LIST_TRAILING_CHARS = SEPARATOR_CHARS + b';}'
+# A comma separated list of numbers, or a run of escapes.
+CHARCODE_RE = re.compile(
+    br'(?P<list>%s(?:\s*,\s*%s)*)|(?P<escapes>%s+)' % (
+        NUMBER_PATTERN, NUMBER_PATTERN, ESCAPE_PATTERN))
+ESCAPE_RE = re.compile(ESCAPE_PATTERN)
+TOKEN_RE = re.compile(br'(?:%s|%s)\Z' % (NUMBER_PATTERN, ESCAPE_PATTERN))
+CHARCODE_LIST_RE = re.compile(
+    br'%s(?:\s*,\s*%s)+|%s' % (NUMBER_PATTERN, NUMBER_PATTERN, ESCAPE_PATTERN))
+
+# A high surrogate followed by a low one, or a surrogate on its own.
+SURROGATE_RE = re.compile(u'([\ud800-\udbff])([\udc00-\udfff])|[\ud800-\udfff]')
+
+MAX_CODE = 0x10FFFF
+REPLACEMENT_CHARACTER = u'\ufffd'
+
+# The characters of the codes seen are simply dropped once there are this
+# many distinct ones.
+MAX_CACHED_CODES = 4096
+
+
+def ParseCode(token):
+  """Returns the character code of a number or an escape.
+
+  Args:
+    token: Bytes of a single number or escape, such as b'116', b'0x74',
+      b'0o164', b'\\u0074' or b'&#116;'.
+
+  Returns:
+    The code as an integer.
+
+  Raises:
+    ValueError: The token is not a single number or escape.
+  """
+  token = token.strip()
+  if not TOKEN_RE.match(token):
+    raise ValueError('Not a character code: %r' % token)
+  token = token.lower()
+  if token.startswith((b'\\', b'&#x')):
+    return int(token.lstrip(b'\\&#xu{').rstrip(b';}'), 16)
+  if token.startswith(b'&#'):
+    return int(token[2:].rstrip(b';'))
+  if token.startswith(b'0x'):
+    return int(token[2:], 16)
+  if token.startswith(b'0o'):
+    return int(token[2:], 8)
+  return int(token)
+
+
+class _CharacterCache(dict):
+  """Maps numbers and escapes, as written, to their characters.
+
+  Tokens which are not a single number or escape map to None, so that joining
+  them fails fast on every later occurrence too.
+  """
+
+  def __missing__(self, token):
+    if len(self) >= MAX_CACHED_CODES:
+      self.clear()
+    try:
+      code = ParseCode(token)
+    except ValueError:
+      char = None
+    else:
+      char = compat.unichr(code) if code <= MAX_CODE else REPLACEMENT_CHARACTER
+    self[token] = char
+    return char
+
+
+_characters = _CharacterCache()
+
+
+def _JoinSurrogates(match):
+  if match.group(1) is None:
+    return REPLACEMENT_CHARACTER
+  high, low = ord(match.group(1)), ord(match.group(2))
+  return compat.unichr(0x10000 + ((high - 0xD800) << 10) + (low - 0xDC00))
+
+
+def _DecodeExactly(data, lookup):
+  """Returns the decoded text of each list or run of escapes in data."""
+  decoded = []
+  for match in CHARCODE_RE.finditer(data):
+    if match.lastgroup == 'list':
+      tokens = match.group().split(b',')
+    else:
+      tokens = ESCAPE_RE.findall(match.group())
+    decoded.append(u''.join(map(lookup, tokens)))
+  return decoded
+
+
+def Decode(data):
+  """Decodes every run of character codes in data.
+
+  Args:
+    data: Bytes to search for character codes.
+
+  Returns:
+    Text of the decoded runs, one per line. UTF-16 surrogate pairs, as
+    JavaScript writes characters outside the Basic Multilingual Plane, are
+    joined, and lone surrogates are replaced with U+FFFD.
+  """
+  lookup = _characters.__getitem__
+  runs = []
+  for run in RUN_RE.findall(data):
+    if run[:1].isdigit():
+      if b'\\' in run or b'&' in run:
+        # Numbers followed by escapes.
+        tokens = None
+      else:
+        tokens = run.rstrip(LIST_TRAILING_CHARS).split(b',')
+    else:
+      escapes = run.rstrip(SEPARATOR_CHARS)
+      tokens = ESCAPE_RE.findall(escapes)
+      if sum(map(len, tokens)) != len(escapes):
+        tokens = None
+    if tokens is not None:
+      try:
+        runs.append(u''.join(map(lookup, tokens)))
+        continue
+      except TypeError:
+        # A token is not a single number, as in '2014 be'.
+        pass
+    runs.extend(_DecodeExactly(run, lookup))
+  text = u'\n'.join(runs)
+  if SURROGATE_RE.search(text):
+    text = SURROGATE_RE.sub(_JoinSurrogates, text)
+  return text
+
 
 class FromCharCode(object):
 
   def __init__(self):
-    self.name = 'fromCharCode'
-    self.description = ('Takes decimal and returns the ASCII letters '
-                        'equivalent.')
-    self.options = []
+    self.streaming = streaming.WHOLE_INPUT
+
+  def Accepts(self, incoming_data):
+    """Returns whether the data contains a list of numbers or an escape."""
+    return CHARCODE_LIST_RE.search(incoming_data) is not None
 
   def Process(self, incoming_data, unused_options):
     """Returns the results up JavaScripts fromCharCode method.
@@ -39,9 +197,6 @@ class FromCharCode(object):
       unused_options: Not used.
 
     Returns:
-      fromCharCode string.
+      fromCharCode text.
     """
-    resp = []
-    for b in re.finditer(r'[0-9]+(?:\,[0-9]{2,3})*', incoming_data):
-      resp.append(''.join(map(unichr, map(int, b.group(0).split(',')))))
-    return '\n'.join(resp)
+    return Decode(incoming_data)
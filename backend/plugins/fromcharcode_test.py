@@ -0,0 +1,65 @@
+"""Tests for the fromCharCode plugin.
+
+Run the plugin tests from the backend directory with:
+  python -m unittest discover -p '*_test.py'
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import unittest
+
+from plugins import fromcharcode
+
+
+class DecodeTest(unittest.TestCase):
+
+  def testDecimal(self):
+    self.assertEqual(u'tommy', fromcharcode.Decode(b'116,111,109,109,121'))
+
+  def testZeroPaddedDecimal(self):
+    # A leading zero is padding, not an octal prefix.
+    self.assertEqual(u'Hello', fromcharcode.Decode(b'072,101,108,108,111'))
+    self.assertEqual(u'Hi', fromcharcode.Decode(b'072,0105'))
+    self.assertEqual(u'\x08\t', fromcharcode.Decode(b'08,09'))
+
+  def testRunsOnSeparateLines(self):
+    self.assertEqual(u'Hi\nyo',
+                     fromcharcode.Decode(b'a = [72,105]; b = [121,111];'))
+
+  def testPrefixedNumbers(self):
+    self.assertEqual(u'tommy', fromcharcode.Decode(b'0x74,0o157,109,109,121'))
+
+  def testEscapes(self):
+    self.assertEqual(u'tommy', fromcharcode.Decode(
+        b'\\x74\\u006f&#109;&#x6d;&#x79;'))
+
+
+class ParseCodeTest(unittest.TestCase):
+
+  def testLeadingZeroIsDecimal(self):
+    self.assertEqual(72, fromcharcode.ParseCode(b'072'))
+    self.assertEqual(164, fromcharcode.ParseCode(b'0164'))
+
+  def testOctalNeedsPrefix(self):
+    self.assertEqual(116, fromcharcode.ParseCode(b'0o164'))
+
+  def testRejectsWords(self):
+    self.assertRaises(ValueError, fromcharcode.ParseCode, b'72 be')
+
+
+if __name__ == '__main__':
+  unittest.main()
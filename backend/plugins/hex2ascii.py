@@ -4,6 +4,9 @@ Non-printable characters are converted to escape codes of the form \xDD.
 Non-hexadecimal characters will be thrown out during processing. New lines
 will be preserved.
 
+The Hex decode plugin can instead return the decoded bytes as a hexdump or
+unescaped.
+
 Copyright 2014 Google Inc. All rights reserved.
 
 Licensed under the Apache License, Version 2.0 (the "License");
@@ -19,35 +22,122 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import binascii
+
+from plugins import compat
+from plugins import streaming
+
 friendly_name = 'Hex2Ascii'
 description = 'Return the hex converted to ascii.'
 
-PRINTABLE_CHARS = ('0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVW'
-                   'XYZ!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~ ')
-HEXADECIMAL_CHARS = '0123456789abcdefABCDEF'
-NEWLINE_CHARS = '\r\n'
+PRINTABLE_CHARS = (b'0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRST'
+                   b'UVWXYZ!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~ ')
+HEXADECIMAL_CHARS = b'0123456789abcdefABCDEF'
+NEWLINE_CHARS = b'\r\n'
+WHITESPACE_CHARS = b' \t\r\n'
+NON_HEXADECIMAL_CHARS = streaming.CharsNotIn(HEXADECIMAL_CHARS)
+NON_HEXADECIMAL_OR_NEWLINE_CHARS = streaming.CharsNotIn(
+    HEXADECIMAL_CHARS + NEWLINE_CHARS)
+
+# ESCAPES[i] is how byte value i is displayed: itself if printable, otherwise
+# an escape code.
+ESCAPES = [compat.ByteString([i]) if i in bytearray(PRINTABLE_CHARS) else
+           b'\\x%02x' % i
+           for i in compat.xrange(256)]
+# Maps unprintable bytes to '.' for the ASCII gutter of a hexdump.
+GUTTER_TABLE = compat.ByteString(
+    i if i in bytearray(PRINTABLE_CHARS) else ord('.')
+    for i in compat.xrange(256))
+HEXDUMP_WIDTH = 16
+# Bytes escaped per join, so that Escape builds the list of escape codes for a
+# bounded piece at a time rather than one list entry per byte of the input.
+ESCAPE_CHUNK_SIZE = 64 * 1024
+
+ESCAPE_STYLE = 'escape'
+HEXDUMP_STYLE = 'hexdump'
+RAW_STYLE = 'raw'
+OUTPUT_STYLES = (ESCAPE_STYLE, HEXDUMP_STYLE, RAW_STYLE)
+
+
+def Escape(data):
+  """Replaces unprintable characters with escape codes of the form \\xDD."""
+  if not data.translate(None, PRINTABLE_CHARS):
+    return data
+  escaped = bytearray()
+  for start in compat.xrange(0, len(data), ESCAPE_CHUNK_SIZE):
+    chunk = bytearray(data[start:start + ESCAPE_CHUNK_SIZE])
+    escaped += b''.join(map(ESCAPES.__getitem__, chunk))
+  return bytes(escaped)
+
+
+def DecodeRaw(incoming_data):
+  """Decodes the hex characters of data to bytes, ignoring everything else.
+
+  A trailing unpaired hex character is dropped.
+  """
+  hex_chars = incoming_data.translate(None, NON_HEXADECIMAL_CHARS)
+  return binascii.unhexlify(hex_chars[:len(hex_chars) // 2 * 2])
+
+
+def DecodeEscaped(incoming_data):
+  """Decodes hex to printable text, preserving new lines.
+
+  Each '\\r' or '\\n' becomes a new line at its position, even between the two
+  characters of a hex pair.
 
+  Args:
+    incoming_data: String of data to process.
 
-def GetHex(it):
-  x1 = None
-  for x in it:
-    if x in NEWLINE_CHARS:
-      yield x
-    if x not in HEXADECIMAL_CHARS:
-      continue
-    if x1 is None:
-      x1 = x
-    else:
-      yield x1 + x
-      x1 = None
+  Returns:
+    Ascii string.
+  """
+  lines = incoming_data.translate(
+      None, NON_HEXADECIMAL_OR_NEWLINE_CHARS).replace(b'\r', b'\n').split(b'\n')
+  out_l = []
+  pending = b''
+  for line in lines:
+    line = pending + line
+    pending = line[len(line) // 2 * 2:]
+    out_l.append(Escape(binascii.unhexlify(line[:len(line) - len(pending)])))
+  return b'\n'.join(out_l)
+
+
+def FormatHexdump(data, start_offset=0):
+  """Formats bytes as hexdump lines of an offset, hex columns and ASCII gutter.
+
+  Args:
+    data: String of bytes to format.
+    start_offset: Offset of the first byte, shown in the first column.
+
+  Returns:
+    String of lines, each ending in a new line.
+  """
+  hex_chars = binascii.hexlify(data)
+  spaced_hex = bytearray(b' ' * (len(data) * 3))
+  spaced_hex[0::3] = hex_chars[0::2]
+  spaced_hex[1::3] = hex_chars[1::2]
+  spaced_hex = bytes(spaced_hex)
+  gutter = data.translate(GUTTER_TABLE)
+  hex_width = HEXDUMP_WIDTH * 3
+  return b''.join(
+      b'%08x  %-*s |%s|\n' % (start_offset + i, hex_width,
+                              spaced_hex[i * 3:i * 3 + hex_width],
+                              gutter[i:i + HEXDUMP_WIDTH])
+      for i in compat.xrange(0, len(data), HEXDUMP_WIDTH))
 
 
 class Hex2Ascii(object):
 
   def __init__(self):
-    self.name = 'Hex2Ascii'
-    self.description = 'Displays ascii from hexdecimal.'
-    self.options = []
+    self.streaming = streaming.STATEFUL
+
+  def Incremental(self, unused_options):
+    return _IncrementalHexPairs(DecodeEscaped)
+
+  def Accepts(self, incoming_data):
+    """Returns whether the data is hex pairs, optionally with whitespace."""
+    return (len(incoming_data.strip()) >= 2 and not incoming_data.translate(
+        None, HEXADECIMAL_CHARS + WHITESPACE_CHARS))
 
   def Process(self, incoming_data, _):
     """Displays ascii from hexdecimal.
@@ -58,15 +148,101 @@ class Hex2Ascii(object):
     Returns:
       Ascii string.
     """
-    out_l = []
-    for xs in GetHex(incoming_data):
-      if xs in NEWLINE_CHARS:
-        out_l.append('\n')
-        continue
-      i = int(xs, 16)
-      ch = chr(i)
-      if ch in PRINTABLE_CHARS:
-        out_l.append(ch)
-      else:
-        out_l.append('\\x{0:02x}'.format(i))
-    return ''.join(out_l)
+    return DecodeEscaped(incoming_data)
+
+
+class HexDecode(object):
+
+  def __init__(self):
+    self.streaming = streaming.STATEFUL
+
+  def _Style(self, options):
+    style = (options[0] if options else '').strip().lower() or ESCAPE_STYLE
+    if style not in OUTPUT_STYLES:
+      raise ValueError('Unknown output style: %s' % style)
+    return style
+
+  def Compile(self, options):
+    """Validates the output style once.
+
+    Args:
+      options: Optional output style.
+
+    Returns:
+      Callable taking the string of data to process.
+    """
+    style = self._Style(options)
+    if style == HEXDUMP_STYLE:
+      return lambda incoming_data: FormatHexdump(DecodeRaw(incoming_data))
+    if style == RAW_STYLE:
+      return DecodeRaw
+    return DecodeEscaped
+
+  def Incremental(self, options):
+    style = self._Style(options)
+    if style == HEXDUMP_STYLE:
+      return IncrementalHexdump(_IncrementalHexPairs(DecodeRaw))
+    return _IncrementalHexPairs(self.Compile(options))
+
+  def Process(self, incoming_data, options):
+    """Decodes hexadecimal in the chosen output style.
+
+    Args:
+      incoming_data: String of data to process.
+      options: Optional output style, 'escape', 'hexdump' or 'raw'.
+
+    Returns:
+      Decoded string.
+    """
+    return self.Compile(options)(incoming_data)
+
+
+class _IncrementalHexPairs(object):
+  """Decodes hex over a stream, carrying half of a hex pair between chunks."""
+
+  def __init__(self, decode):
+    self._decode = decode
+    self._pending = b''
+
+  def Process(self, chunk):
+    data = self._pending + chunk
+    self._pending = b''
+    if len(data.translate(None, NON_HEXADECIMAL_CHARS)) % 2:
+      index = max(data.rfind(HEXADECIMAL_CHARS[i:i + 1])
+                  for i in compat.xrange(len(HEXADECIMAL_CHARS)))
+      self._pending = data[index:index + 1]
+      data = data[:index] + data[index + 1:]
+    return self._decode(data)
+
+  def Flush(self):
+    # A trailing half pair is dropped, as it is when processing whole input.
+    self._pending = b''
+    return b''
+
+
+class IncrementalHexdump(object):
+  """Formats a stream of decoded bytes as hexdump lines."""
+
+  def __init__(self, decoder, start_offset=0):
+    """Initializer.
+
+    Args:
+      decoder: Incremental processor returning the bytes to format.
+      start_offset: Offset of the first byte, shown in the first column.
+    """
+    self._decoder = decoder
+    self._buffer = b''
+    self._offset = start_offset
+
+  def Process(self, chunk):
+    self._buffer += self._decoder.Process(chunk)
+    whole_lines = len(self._buffer) // HEXDUMP_WIDTH * HEXDUMP_WIDTH
+    out = FormatHexdump(self._buffer[:whole_lines], self._offset)
+    self._buffer = self._buffer[whole_lines:]
+    self._offset += whole_lines
+    return out
+
+  def Flush(self):
+    out = FormatHexdump(self._buffer, self._offset)
+    self._buffer = b''
+    return out
@@ -0,0 +1,96 @@
+"""Hexdump plugin for Babbage.
+
+Shows binary data as lines of an offset, hex columns and an ASCII gutter. A
+byte range can be given so that only one page of a large blob is formatted.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+from plugins import hex2ascii
+from plugins import streaming
+
+
+def ParseRange(options):
+  """Parses the optional start offset and length options.
+
+  Offsets may be decimal or prefixed with 0x for hexadecimal.
+
+  Args:
+    options: List of up to two option strings.
+
+  Returns:
+    Tuple of the start offset and the length, or None for the rest of the data.
+  """
+  options = list(options) + ['', '']
+  start = int(options[0], 0) if options[0].strip() else 0
+  length = int(options[1], 0) if options[1].strip() else None
+  if start < 0 or (length is not None and length < 0):
+    raise ValueError('Offsets must not be negative.')
+  return start, length
+
+
+class Hexdump(object):
+
+  def __init__(self):
+    self.streaming = streaming.STATEFUL
+
+  def Compile(self, options):
+    """Parses the byte range once.
+
+    Args:
+      options: Optional start offset and length.
+
+    Returns:
+      Callable taking the string of data to process.
+    """
+    start, length = ParseRange(options)
+    end = None if length is None else start + length
+    return lambda incoming_data: hex2ascii.FormatHexdump(
+        incoming_data[start:end], start)
+
+  def Incremental(self, options):
+    start, length = ParseRange(options)
+    return hex2ascii.IncrementalHexdump(_Window(start, length), start)
+
+  def Process(self, incoming_data, options):
+    """Formats data as a hexdump.
+
+    Args:
+      incoming_data: String of data to process.
+      options: Optional start offset and length of the range to show.
+
+    Returns:
+      Hexdump string.
+    """
+    return self.Compile(options)(incoming_data)
+
+
+class _Window(object):
+  """Passes on only the bytes of a stream which fall within a range."""
+
+  def __init__(self, start, length):
+    self._start = start
+    self._end = None if length is None else start + length
+    self._position = 0
+
+  def Process(self, chunk):
+    chunk_start = self._position
+    self._position += len(chunk)
+    start = max(0, self._start - chunk_start)
+    if self._end is None:
+      return chunk[start:]
+    return chunk[start:max(0, self._end - chunk_start)]
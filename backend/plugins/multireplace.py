@@ -0,0 +1,240 @@
+"""Replaces many strings at once in a single pass over the data.
+
+The search strings are built into a trie, which is compiled into one regex
+with a branch per distinct next character and greedy optional suffixes. At
+each position the regex engine therefore follows a single path and finds the
+longest search string starting there, giving leftmost-longest matches without
+trying each search string in turn.
+
+For example, with the pairs 'he=1,hello=2,ll=3':
+  'hello help' will be replaced to '2 1lp'.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import re
+
+from plugins import compat
+from plugins import streaming
+
+TEXT_MODE = 'text'
+REGEX_MODE = 'regex'
+MODES = (TEXT_MODE, REGEX_MODE)
+
+# Compiled replacers are reused by every chain with the same pairs; the cache
+# is simply dropped once it grows past this many distinct pair sets.
+MAX_CACHED_REPLACERS = 64
+
+_replacers = {}
+
+
+def ParsePairs(pairs):
+  """Parses 'search=replace' pairs separated by commas.
+
+  Both sides are url decoded, so a literal ',', '=' or '%' is given as %2C,
+  %3D or %25.
+
+  Args:
+    pairs: String of pairs.
+
+  Returns:
+    List of (search, replace) tuples of bytes.
+
+  Raises:
+    ValueError: A pair has no '=' or an empty search string.
+  """
+  parsed = []
+  for pair in pairs.split(','):
+    if not pair.strip():
+      continue
+    if '=' not in pair:
+      raise ValueError('Expected search=replace, got: %s' % pair)
+    search_for, replace_with = pair.split('=', 1)
+    search_for = compat.UrlUnquote(compat.ToBytes(search_for))
+    if not search_for:
+      raise ValueError('Search strings must not be empty.')
+    replace_with = compat.UrlUnquote(compat.ToBytes(replace_with))
+    parsed.append((search_for, replace_with))
+  return parsed
+
+
+def _TriePattern(node):
+  """Returns a regex matching the longest path from a trie node to an end."""
+  alternatives = []
+  for char in sorted(key for key in node if key):
+    child = node[char]
+    literal = [char]
+    # Follow chains of single children without ends as one literal.
+    while len(child) == 1 and b'' not in child:
+      char, child = next(iter(child.items()))
+      literal.append(char)
+    alternatives.append(re.escape(b''.join(literal)) + _TriePattern(child))
+  if not alternatives:
+    return b''
+  if len(alternatives) == 1:
+    pattern = alternatives[0]
+  else:
+    pattern = b'(?:%s)' % b'|'.join(alternatives)
+  if b'' in node:
+    # The path may also end here, but a longer match is tried first.
+    return b'(?:%s)?' % pattern
+  return pattern
+
+
+def TextPattern(search_strings):
+  """Compiles search strings into a regex with leftmost-longest matching."""
+  trie = {}
+  for search_for in search_strings:
+    node = trie
+    for index in compat.xrange(len(search_for)):
+      node = node.setdefault(search_for[index:index + 1], {})
+    node[b''] = {}
+  return re.compile(_TriePattern(trie))
+
+
+class Replacer(object):
+  """Replaces every search string of a set of pairs in one scan."""
+
+  def __init__(self, pairs, mode=TEXT_MODE):
+    """Initializer.
+
+    Args:
+      pairs: List of (search, replace) tuples.
+      mode: TEXT_MODE to search for the strings, with the longest match at a
+        position winning, or REGEX_MODE to search for regexes, with the first
+        listed regex matching at a position winning. Replacements are literal
+        in both modes.
+    """
+    self.mode = mode
+    if mode == TEXT_MODE:
+      self._replacements = dict(pairs)
+      self.pattern = TextPattern(self._replacements)
+      self.max_length = max(
+          len(search_for) for search_for in self._replacements)
+      self._replace = lambda match: self._replacements[match.group()]
+    else:
+      self._replacements = dict(
+          ('_%d' % index, replace_with)
+          for index, (_, replace_with) in enumerate(pairs))
+      self.pattern = re.compile(b'|'.join(
+          b'(?P<_%d>%s)' % (index, search_for)
+          for index, (search_for, _) in enumerate(pairs)))
+      self.max_length = None
+      self._replace = lambda match: self._replacements[match.lastgroup]
+
+  def Replace(self, data):
+    return self.pattern.sub(self._replace, data)
+
+
+def GetReplacer(pairs, mode):
+  """Returns a Replacer for the pairs, reusing an earlier one.
+
+  Args:
+    pairs: String of comma separated 'search=replace' pairs.
+    mode: TEXT_MODE or REGEX_MODE.
+
+  Returns:
+    A Replacer.
+
+  Raises:
+    ValueError: The pairs or the mode are invalid.
+  """
+  key = (pairs, mode)
+  replacer = _replacers.get(key)
+  if replacer is None:
+    if mode not in MODES:
+      raise ValueError('Unknown mode: %s' % mode)
+    parsed = ParsePairs(pairs)
+    if not parsed:
+      raise ValueError('At least one search=replace pair is required.')
+    replacer = Replacer(parsed, mode)
+    if len(_replacers) >= MAX_CACHED_REPLACERS:
+      _replacers.clear()
+    _replacers[key] = replacer
+  return replacer
+
+
+class MultiReplace(object):
+
+  def __init__(self):
+    self.streaming = streaming.STATEFUL
+
+  def _Replacer(self, options):
+    mode = (options[1] if len(options) > 1 else '').strip().lower()
+    return GetReplacer(options[0] if options else '', mode or TEXT_MODE)
+
+  def Compile(self, options):
+    """Parses the pairs and compiles them once.
+
+    Args:
+      options: The pairs and an optional mode.
+
+    Returns:
+      Callable taking the string of data to process.
+    """
+    return self._Replacer(options).Replace
+
+  def Incremental(self, options):
+    return _IncrementalMultiReplace(self._Replacer(options))
+
+  def Process(self, incoming_data, options):
+    """Replaces every search string or regex in one pass.
+
+    Args:
+      incoming_data: String of data to process.
+      options: The pairs and an optional mode.
+
+    Returns:
+      String after every replacement has been made.
+    """
+    return self.Compile(options)(incoming_data)
+
+
+class _IncrementalMultiReplace(object):
+  """Replaces over a stream, holding back text a match could start in.
+
+  A match may be as long as the longest search string, so a match starting
+  earlier than that from the end of the data is known to be the longest one.
+  Regexes can match any length, so in regex mode the whole input is buffered.
+  """
+
+  def __init__(self, replacer):
+    self._replacer = replacer
+    self._carry = b''
+
+  def Process(self, chunk):
+    data = self._carry + chunk
+    if self._replacer.max_length is None:
+      self._carry = data
+      return b''
+    cut = len(data) - self._replacer.max_length + 1
+    out = []
+    start = 0
+    for match in self._replacer.pattern.finditer(data):
+      if match.start() >= cut:
+        break
+      out.append(data[start:match.start()])
+      out.append(self._replacer.Replace(match.group()))
+      start = match.end()
+    keep = max(start, cut)
+    out.append(data[start:keep])
+    self._carry = data[keep:]
+    return b''.join(out)
+
+  def Flush(self):
+    carry, self._carry = self._carry, b''
+    return self._replacer.Replace(carry)
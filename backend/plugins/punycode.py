@@ -15,31 +15,34 @@ __author__ = 'fryy@google.com (Simon Freiberg)'
 
 import codecs
 
+from plugins import streaming
+
 
 class PunycodeEncode(object):
 
   def __init__(self):
-    self.name = 'Punycode encode'
-    self.description = 'Returns a punycode encoded string.'
-    self.options = []
+    self.streaming = streaming.WHOLE_INPUT
+    self.text = True
 
   def Process(self, incoming_data, unused_options):
     """Simple punycode encoding.
     Args:
-      incoming_data: String of data to process.
+      incoming_data: Text to process.
       unused_options: Not used.
     Returns:
       Punycode encoded string.
     """
-    return codecs.encode(incoming_data.decode('utf-8'), 'idna')
+    return codecs.encode(incoming_data, 'idna')
 
 
 class PunycodeDecode(object):
 
   def __init__(self):
-    self.name = 'Punycode decode'
-    self.description = 'Returns a punycode decoded string.'
-    self.options = []
+    self.streaming = streaming.WHOLE_INPUT
+
+  def Accepts(self, incoming_data):
+    """Returns whether the data contains a punycode label."""
+    return b'xn--' in incoming_data.lower()
 
   def Process(self, incoming_data, unused_options):
     """Simple punycode decode, removing any leading 'xn--'
@@ -47,6 +50,6 @@ class PunycodeDecode(object):
       incoming_data: String of data to process
       unused_options: Not used.
     Returns:
-      Punycode decoded string.
+      Punycode decoded text.
     """
     return codecs.decode(incoming_data, 'idna')
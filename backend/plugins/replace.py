@@ -17,15 +17,47 @@ limitations under the License.
 
 __author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
 
-import urllib
+from plugins import compat
+from plugins import streaming
+
+
+def _Unquote(option):
+  return compat.UrlUnquote(compat.ToBytes(option))
 
 
 class Replace(object):
 
   def __init__(self):
-    self.name = 'Replace'
-    self.description = ('Simple replace, "o", "i", "tommy" == "timmy"')
-    self.options = ['What to look for', 'What to replace it with']
+    self.streaming = streaming.STATEFUL
+
+  def Compile(self, options):
+    """Unquotes the search and replace strings once.
+
+    Args:
+      options: List of options, what to replace with and what to search for.
+
+    Returns:
+      Callable taking the string of data to process.
+    """
+    search_for, replace_with = _Unquote(options[0]), _Unquote(options[1])
+    return lambda incoming_data: incoming_data.replace(search_for, replace_with)
+
+  def ByteTable(self, options):
+    """Returns a translation table if one byte is replaced by another.
+
+    Args:
+      options: List of options, what to replace with and what to search for.
+
+    Returns:
+      The table, or None if the replacement is not byte for byte.
+    """
+    search_for, replace_with = _Unquote(options[0]), _Unquote(options[1])
+    if len(search_for) != 1 or len(replace_with) != 1:
+      return None
+    return compat.maketrans(search_for, replace_with)
+
+  def Incremental(self, options):
+    return _IncrementalReplace(_Unquote(options[0]), _Unquote(options[1]))
 
   def Process(self, incoming_data, options):
     """Simple search and replace.
@@ -37,6 +69,43 @@ class Replace(object):
     Returns:
       String after search and replace has been completed.
     """
-    search_for, replace_with = (urllib.unquote(options[0]),
-                                urllib.unquote(options[1]))
-    return incoming_data.replace(search_for, replace_with)
+    return self.Compile(options)(incoming_data)
+
+
+class _IncrementalReplace(object):
+  """Search and replace over a stream.
+
+  Text which could be the start of a match split across chunks is held back.
+  Matches are found left to right without overlapping, as str.replace does.
+  """
+
+  def __init__(self, search_for, replace_with):
+    self._search_for = search_for
+    self._replace_with = replace_with
+    self._carry = b''
+
+  def Process(self, chunk):
+    data = self._carry + chunk
+    if not self._search_for:
+      # An empty search string matches between every character, so the whole
+      # input is needed.
+      self._carry = data
+      return b''
+    # Any match starting before cut lies entirely within data.
+    cut = len(data) - len(self._search_for) + 1
+    out = []
+    start = 0
+    index = data.find(self._search_for)
+    while index != -1 and index < cut:
+      out.append(data[start:index])
+      out.append(self._replace_with)
+      start = index + len(self._search_for)
+      index = data.find(self._search_for, start)
+    keep = max(start, cut)
+    out.append(data[start:keep])
+    self._carry = data[keep:]
+    return b''.join(out)
+
+  def Flush(self):
+    carry, self._carry = self._carry, b''
+    return carry.replace(self._search_for, self._replace_with)
@@ -17,15 +17,24 @@ limitations under the License.
 
 __author__ = 'joscha@feth.com (Joscha Feth)'
 
-import codecs
+import string
+
+from plugins import compat
+from plugins import streaming
+
+ROT13_TABLE = compat.maketrans(
+    (string.ascii_lowercase + string.ascii_uppercase).encode('ascii'),
+    (string.ascii_lowercase[13:] + string.ascii_lowercase[:13] +
+     string.ascii_uppercase[13:] + string.ascii_uppercase[:13]).encode('ascii'))
 
 
 class Rot13Encode(object):
 
   def __init__(self):
-    self.name = 'ROT-13 encode'
-    self.description = 'Returns a ROT-13 encoded string.'
-    self.options = []
+    self.streaming = streaming.STATELESS
+
+  def ByteTable(self, unused_options):
+    return ROT13_TABLE
 
   def Process(self, incoming_data, unused_options):
     """Simple ROT-13 encoding.
@@ -37,15 +46,16 @@ class Rot13Encode(object):
     Returns:
       ROT-13 encoded string.
     """
-    return codecs.decode(incoming_data, 'rot_13')
+    return incoming_data.translate(ROT13_TABLE)
 
 
 class Rot13Decode(object):
 
   def __init__(self):
-    self.name = 'ROT-13 decode'
-    self.description = 'Returns a ROT-13 decoded string.'
-    self.options = []
+    self.streaming = streaming.STATELESS
+
+  def ByteTable(self, unused_options):
+    return ROT13_TABLE
 
   def Process(self, incoming_data, unused_options):
     """Simple ROT-13 decode.
@@ -57,4 +67,4 @@ class Rot13Decode(object):
     Returns:
       ROT-13 decoded string.
     """
-    return codecs.decode(incoming_data, 'rot_13')
+    return incoming_data.translate(ROT13_TABLE)
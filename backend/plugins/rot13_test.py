@@ -0,0 +1,59 @@
+"""Tests for the ROT-13 plugins.
+
+Run the plugin tests from the backend directory with:
+  python -m unittest discover -p '*_test.py'
+
+Copyright 2014 Joscha Feth All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'joscha@feth.com (Joscha Feth)'
+
+import codecs
+import random
+import unittest
+
+from plugins import compat
+from plugins import rot13
+
+
+def _CodecRot13(incoming_data):
+  """The original ROT-13, by the rot_13 codec, for ASCII data."""
+  return codecs.decode(incoming_data.decode('ascii'), 'rot_13').encode('ascii')
+
+
+class Rot13Test(unittest.TestCase):
+
+  def testMatchesCodecOnRandomAscii(self):
+    rng = random.Random(13)
+    for size in (0, 1, 26, 1000, 4096):
+      data = compat.ByteString(rng.randrange(128) for _ in compat.xrange(size))
+      expected = _CodecRot13(data)
+      self.assertEqual(expected, rot13.Rot13Encode().Process(data, []))
+      self.assertEqual(expected, rot13.Rot13Decode().Process(data, []))
+
+  def testRoundTrip(self):
+    data = compat.ByteString(compat.xrange(256))
+    encoded = rot13.Rot13Encode().Process(data, [])
+    self.assertEqual(data, rot13.Rot13Decode().Process(encoded, []))
+
+  def testPreservesNonAsciiBytes(self):
+    # The codec produced text, so bytes above 0x7f did not come back as bytes.
+    data = b'Gur \xe9\xff\x80 png'
+    self.assertEqual(b'The \xe9\xff\x80 cat',
+                     rot13.Rot13Encode().Process(data, []))
+
+
+if __name__ == '__main__':
+  unittest.main()
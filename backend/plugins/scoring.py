@@ -0,0 +1,149 @@
+"""Scores how much decoded data looks like readable text.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import math
+import string
+
+from plugins import compat
+
+# Only this much of the data is looked at when scoring.
+SAMPLE_SIZE = 4096
+
+PRINTABLE_CHARS = string.printable.encode('ascii')
+TEXT_CHARS = (string.ascii_letters + ' ').encode('ascii')
+
+# Relative frequency of letters in English text.
+ENGLISH_FREQUENCIES = {
+    b'a': 0.0817, b'b': 0.0149, b'c': 0.0278, b'd': 0.0425, b'e': 0.1270,
+    b'f': 0.0223, b'g': 0.0202, b'h': 0.0609, b'i': 0.0697, b'j': 0.0015,
+    b'k': 0.0077, b'l': 0.0403, b'm': 0.0241, b'n': 0.0675, b'o': 0.0751,
+    b'p': 0.0193, b'q': 0.0010, b'r': 0.0599, b's': 0.0633, b't': 0.0906,
+    b'u': 0.0276, b'v': 0.0098, b'w': 0.0236, b'x': 0.0015, b'y': 0.0197,
+    b'z': 0.0007}
+_ENGLISH_NORM = math.sqrt(sum(f * f for f in ENGLISH_FREQUENCIES.values()))
+
+# The most common letter pairs in English, about a quarter of all pairs.
+COMMON_BIGRAMS = (b'th', b'he', b'in', b'er', b'an', b're', b'on', b'at', b'en',
+                  b'nd', b'ti', b'es', b'or', b'te', b'of', b'ed', b'is', b'it',
+                  b'al', b'ar')
+COMMON_BIGRAM_SHARE = 0.25
+
+# Weights for a cheap per-byte score: spaces and common English letters count
+# most, unprintable bytes count against.
+COMMON_CHARS = ' etaoinshrETAOINSHR'
+BYTE_WEIGHTS = [
+    3 if chr(i) in COMMON_CHARS else
+    2 if chr(i) in string.ascii_letters else
+    1 if chr(i) in string.printable else
+    -3 for i in compat.xrange(256)]
+_CLASS_TABLE = compat.ByteString(BYTE_WEIGHTS[i] + 3
+                                 for i in compat.xrange(256))
+_CLASS_WEIGHTS = dict((compat.BYTE_CHARS[weight + 3], weight)
+                      for weight in set(BYTE_WEIGHTS))
+
+
+def Printability(data):
+  """Returns the fraction of characters which are printable."""
+  if not data:
+    return 0.0
+  return 1.0 - len(data.translate(None, PRINTABLE_CHARS)) / float(len(data))
+
+
+def Entropy(data):
+  """Returns the Shannon entropy of data in bits per byte."""
+  if not data:
+    return 0.0
+  length = float(len(data))
+  entropy = 0.0
+  for i in compat.xrange(256):
+    count = data.count(compat.BYTE_CHARS[i])
+    if count:
+      p = count / length
+      entropy -= p * math.log(p, 2)
+  return entropy
+
+
+def QuickScore(data):
+  """Returns the mean BYTE_WEIGHTS of data, computed with a few C passes."""
+  if not data:
+    return 0.0
+  classes = data.translate(_CLASS_TABLE)
+  return sum(weight * classes.count(c)
+             for c, weight in _CLASS_WEIGHTS.items()) / float(len(data))
+
+
+def HistogramScore(histogram, key):
+  """Returns the QuickScore of data after XORing it with a single byte key.
+
+  XOR with one key permutes byte values, so every key can be scored from the
+  byte histogram of the data without decoding it.
+
+  Args:
+    histogram: List of (byte value, count) tuples.
+    key: The XOR key.
+
+  Returns:
+    Float score, not normalized by length.
+  """
+  return sum(count * BYTE_WEIGHTS[i ^ key] for i, count in histogram)
+
+
+def English(data):
+  """Scores how closely data matches English letter and pair frequencies.
+
+  Args:
+    data: String to score.
+
+  Returns:
+    Float between 0 and 1.
+  """
+  lowered = data.lower()
+  counts = dict((c, lowered.count(c)) for c in ENGLISH_FREQUENCIES)
+  letters = sum(counts.values())
+  if not letters:
+    return 0.0
+  dot = sum(counts[c] * f for c, f in ENGLISH_FREQUENCIES.items())
+  norm = math.sqrt(sum(count * count for count in counts.values()))
+  similarity = dot / (norm * _ENGLISH_NORM)
+  bigrams = sum(lowered.count(bigram) for bigram in COMMON_BIGRAMS)
+  share = min(1.0, bigrams / (letters * COMMON_BIGRAM_SHARE))
+  return (similarity + share) / 2.0
+
+
+def Score(data):
+  """Scores data between 0 and 1, higher meaning more like readable text.
+
+  Printable data made mostly of letters and spaces, with the low entropy and
+  letter frequencies of English, scores highest. Text is scored on its UTF-8
+  encoding.
+
+  Args:
+    data: String to score.
+
+  Returns:
+    Float score.
+  """
+  if isinstance(data, compat.text_type):
+    data = data.encode('utf-8')
+  sample = data[:SAMPLE_SIZE]
+  if not sample:
+    return 0.0
+  text = 1.0 - len(sample.translate(None, TEXT_CHARS)) / float(len(sample))
+  return Printability(sample) * (
+      text + 1.0 - Entropy(sample) / 8.0 + English(sample)) / 3.0
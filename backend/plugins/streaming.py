@@ -0,0 +1,83 @@
+"""Streaming support for Babbage plugins.
+
+Plugins declare how they can be run over a stream of chunks through their
+'streaming' attribute:
+  STATELESS: Each chunk can be processed on its own by Process.
+  STATEFUL: The plugin provides Incremental(options), returning an object
+    whose Process(chunk) and Flush() methods carry state between chunks.
+  WHOLE_INPUT: The plugin needs all of its input at once.
+Plugins without the attribute are treated as WHOLE_INPUT.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+from plugins import compat
+
+STATELESS = 'stateless'
+STATEFUL = 'stateful'
+WHOLE_INPUT = 'whole input'
+
+
+def CharsNotIn(keep_chars):
+  """Returns every byte value not in keep_chars, for use with bytes.translate.
+
+  Args:
+    keep_chars: Bytes to keep.
+
+  Returns:
+    Bytes to delete.
+  """
+  keep = bytearray(keep_chars)
+  return compat.ByteString(i for i in compat.xrange(256) if i not in keep)
+
+
+class BlockAligned(object):
+  """Incremental processor for codecs which work on fixed size blocks.
+
+  The trailing partial block of each chunk is held back until more data
+  arrives, or until Flush is called at the end of the stream.
+  """
+
+  def __init__(self, process, block_size, delete_chars=None):
+    """Initializer.
+
+    Args:
+      process: Callable processing a string of whole blocks.
+      block_size: Number of characters in a block.
+      delete_chars: Optional bytes the codec ignores, which are dropped before
+        counting blocks.
+    """
+    self._process = process
+    self._block_size = block_size
+    self._delete_chars = delete_chars
+    self._carry = b''
+
+  def Process(self, chunk):
+    if self._delete_chars:
+      chunk = chunk.translate(None, self._delete_chars)
+    data = self._carry + chunk
+    cut = len(data) - len(data) % self._block_size
+    self._carry = data[cut:]
+    if not cut:
+      return b''
+    return self._process(data[:cut])
+
+  def Flush(self):
+    if not self._carry:
+      return b''
+    carry, self._carry = self._carry, b''
+    return self._process(carry)
@@ -2,15 +2,13 @@
 
 __author__ = 'niu@google.com (Yuan Niu)'
 
+from plugins import streaming
+
 
 class StrRev(object):
 
   def __init__(self):
-    self.name = 'String reverse'
-    self.description = ('Returns a reversed string. Ex: '
-                        '\'J3byJXZ"(edoced_46esab(lave"\''
-                        '\'eval(base64_decode("ZXJyb3J\'')
-    self.options = []
+    self.streaming = streaming.WHOLE_INPUT
 
   def Process(self, incoming_data, _):
     """Simple string reverse.
@@ -22,5 +20,5 @@ class StrRev(object):
     Returns:
       String with chars in reverse order.
     """
-    return ''.join(reversed(incoming_data))
+    return incoming_data[::-1]
     
\ No newline at end of file
@@ -17,16 +17,19 @@ limitations under the License.
 
 __author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
 
-import urllib
+import re
+
+from plugins import compat
+from plugins import streaming
+
+ESCAPE_RE = re.compile(br'%[0-9a-fA-F]{2}')
 
 
 class UrlEncode(object):
 
   def __init__(self):
-    self.name = 'Url encode'
-    self.description = ('Returns a url encoded string. Ex: \'tom is cool\''
-                        '\'tom%20is%20cool\'.')
-    self.options = []
+    self.streaming = streaming.STATELESS
+    self.inverse = 'Url decode'
 
   def Process(self, incoming_data, _):
     """Simple url encoding.
@@ -37,16 +40,20 @@ class UrlEncode(object):
     Returns:
       Url encoded string.
     """
-    return urllib.quote(incoming_data)
+    return compat.UrlQuote(incoming_data)
 
 
 class UrlDecode(object):
 
   def __init__(self):
-    self.name = 'Url decode'
-    self.description = ('Returns a url decoded string. Ex: \'tom%is%cool\''
-                        '\'tom is cool\'.')
-    self.options = []
+    self.streaming = streaming.STATEFUL
+
+  def Incremental(self, unused_options):
+    return _IncrementalUrlDecode()
+
+  def Accepts(self, incoming_data):
+    """Returns whether the data contains any %XX escapes."""
+    return ESCAPE_RE.search(incoming_data) is not None
 
   def Process(self, incoming_data, _):
     """Simple url decoding.
@@ -57,4 +64,24 @@ class UrlDecode(object):
     Returns:
       Url decoded string.
     """
-    return urllib.unquote(incoming_data)
+    return compat.UrlUnquote(incoming_data)
+
+
+class _IncrementalUrlDecode(object):
+  """Url decodes a stream, holding back an escape split across chunks."""
+
+  def __init__(self):
+    self._carry = b''
+
+  def Process(self, chunk):
+    data = self._carry + chunk
+    split_escape = data.find(b'%', len(data) - 2)
+    if split_escape == -1:
+      self._carry = b''
+    else:
+      data, self._carry = data[:split_escape], data[split_escape:]
+    return compat.UrlUnquote(data)
+
+  def Flush(self):
+    carry, self._carry = self._carry, b''
+    return compat.UrlUnquote(carry)
@@ -18,15 +18,128 @@ limitations under the License.
 __author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
 
 import binascii
+import collections
+import heapq
+
+from plugins import compat
+from plugins import scoring
+from plugins import streaming
+
+# Brute force keys are shortlisted on a QuickScore of a small sample, ranked
+# on a fuller score of a larger sample, and only the winners fully decoded.
+BRUTE_FORCE_QUICK_SAMPLE_SIZE = 4096
+BRUTE_FORCE_SAMPLE_SIZE = 64 * 1024
+BRUTE_FORCE_SHORTLIST = 16
+BRUTE_FORCE_RESULTS = 5
+
+# Repeating key lengths are estimated on a sample of this size, and the key
+# bytes recovered from a larger one.
+KEY_LENGTH_SAMPLE_SIZE = 16 * 1024
+KEY_SAMPLE_SIZE = 64 * 1024
+DEFAULT_MAX_KEY_LENGTH = 64
+# Multiples of the real key length score as well as the key length itself, so
+# the shortest divisor of the best scoring length which scores at least this
+# fraction of the best score is chosen. A proper divisor of the real length
+# mixes the columns of different key bytes and scores well below it.
+KEY_LENGTH_TOLERANCE = 0.9
+
+# XOR_TABLES[key] maps every byte to itself XORed with key, for str.translate.
+XOR_TABLES = [compat.ByteString(i ^ key for i in compat.xrange(256))
+              for key in compat.xrange(256)]
+
+
+def _RepeatingKeyXor(incoming_data, key):
+  """XORs data with a key repeated over its whole length.
+
+  Bytes a key length apart share a key byte, so each of those strided slices
+  is XORed with a single translate call.
+
+  Args:
+    incoming_data: String of data to process.
+    key: Sequence of key byte values.
+
+  Returns:
+    String after XOR has been completed.
+  """
+  output_data = bytearray(len(incoming_data))
+  for offset, key_byte in enumerate(key):
+    output_data[offset::len(key)] = incoming_data[offset::len(key)].translate(
+        XOR_TABLES[key_byte])
+  return bytes(output_data)
+
+
+def _IncrementalKey(key):
+  """Returns the 256 byte key stream of an incremental XOR."""
+  return [(key + offset) % 256 for offset in compat.xrange(256)]
+
+
+def _IncrementalXor(incoming_data, key):
+  """XORs each byte with a key which increments after every byte."""
+  return _RepeatingKeyXor(incoming_data, _IncrementalKey(key))
+
+
+def _Histogram(data):
+  """Returns a list of (byte value, count) tuples for bytes in data."""
+  histogram = [(i, data.count(compat.BYTE_CHARS[i]))
+               for i in compat.xrange(256)]
+  return [(i, count) for i, count in histogram if count]
+
+
+def _Coincidence(data):
+  """Returns the chance that two bytes picked from data are the same."""
+  if len(data) < 2:
+    return 0.0
+  counts = collections.Counter(bytearray(data)).values()
+  return (sum(count * (count - 1) for count in counts) /
+          float(len(data) * (len(data) - 1)))
+
+
+def _BruteForce(incoming_data, quick_scores, decode):
+  """Ranks single byte keys and decodes the data with the best ones.
+
+  Args:
+    incoming_data: String of data to process.
+    quick_scores: List of cheap scores, indexed by key.
+    decode: Callable taking data and a key, returning the decoded data.
+
+  Returns:
+    String listing the best keys, their scores and decoded data.
+  """
+  shortlist = heapq.nlargest(BRUTE_FORCE_SHORTLIST, compat.xrange(256),
+                             key=quick_scores.__getitem__)
+  sample = incoming_data[:BRUTE_FORCE_SAMPLE_SIZE]
+  ranked = heapq.nlargest(
+      BRUTE_FORCE_RESULTS,
+      ((scoring.Score(decode(sample, key)), key) for key in shortlist))
+  return b'\n\n'.join(b'Key %02x (score %.3f):\n%s' %
+                       (key, score, decode(incoming_data, key))
+                       for score, key in ranked)
 
 
 class Xor(object):
 
   def __init__(self):
-    self.name = 'Xor'
-    self.description = ('Expecting an two letter hex value to XOR, for example:'
-                        ' BA or FE.')
-    self.options = ['XOR byte Ex: BA or FE']
+    self.streaming = streaming.STATELESS
+
+  def Compile(self, options):
+    """Parses the XOR key once.
+
+    Args:
+      options:  String representation in hexadecimal of a byte.
+
+    Returns:
+      Callable taking the string of data to process.
+    """
+    table = self.ByteTable(options)
+    return lambda incoming_data: incoming_data.translate(table)
+
+  def ByteTable(self, options):
+    """Returns the translation table of the XOR, for fusing with other stages.
+
+    Args:
+      options:  String representation in hexadecimal of a byte.
+    """
+    return XOR_TABLES[ord(binascii.unhexlify(options[0]))]
 
   def Process(self, incoming_data, options):
     """Simple XOR.
@@ -38,17 +151,29 @@ class Xor(object):
     Returns:
       String after XOR has been completed.
     """
-    key = ord(binascii.unhexlify(options[0]))
-    return ''.join(chr(ord(i) ^ key) for i in incoming_data)
+    return self.Compile(options)(incoming_data)
 
 
 class IncrementalXor(object):
 
   def __init__(self):
-    self.name = 'Incremental Xor'
-    self.description = ('Does a incremental XOR with provided key. For '
-                        'example: BE or FF')
-    self.options = ['XOR byte Ex: BA or FE']
+    self.streaming = streaming.STATEFUL
+
+  def Compile(self, options):
+    """Parses the starting XOR key once.
+
+    Args:
+      options: One byte XOR key.
+
+    Returns:
+      Callable taking the string of data to process.
+    """
+    start_key = ord(binascii.unhexlify(options[0]))
+    return lambda incoming_data: _IncrementalXor(incoming_data, start_key)
+
+  def Incremental(self, options):
+    return _RepeatingKeyXorStream(
+        _IncrementalKey(ord(binascii.unhexlify(options[0]))))
 
   def Process(self, incoming_data, options):
     """Incremental XOR.
@@ -60,9 +185,173 @@ class IncrementalXor(object):
     Returns:
       String after XOR has been completed.
     """
-    output_data = ''
-    key = ord(binascii.unhexlify(options[0]))
-    for i in incoming_data:
-      output_data += chr(ord(i) ^ key)
-      key = (key + 1) % 256
+    return self.Compile(options)(incoming_data)
+
+
+class _RepeatingKeyXorStream(object):
+  """Repeating key XOR over a stream, carrying the key position between chunks.
+  """
+
+  def __init__(self, key):
+    self._key = list(key)
+
+  def Process(self, chunk):
+    output_data = _RepeatingKeyXor(chunk, self._key)
+    offset = len(chunk) % len(self._key)
+    self._key = self._key[offset:] + self._key[:offset]
     return output_data
+
+  def Flush(self):
+    return b''
+
+
+class BruteForceXor(object):
+
+  def __init__(self):
+    self.streaming = streaming.WHOLE_INPUT
+
+  def Process(self, incoming_data, unused_options):
+    """Single byte XOR key search.
+
+    Args:
+      incoming_data: String of data to process.
+      unused_options: Not used.
+
+    Returns:
+      String listing the best keys, their scores and decoded data.
+    """
+    histogram = _Histogram(incoming_data[:BRUTE_FORCE_SAMPLE_SIZE])
+    quick_scores = [scoring.HistogramScore(histogram, key)
+                    for key in compat.xrange(256)]
+    return _BruteForce(incoming_data, quick_scores,
+                       lambda data, key: data.translate(XOR_TABLES[key]))
+
+
+class BruteForceIncrementalXor(object):
+
+  def __init__(self):
+    self.streaming = streaming.WHOLE_INPUT
+
+  def Process(self, incoming_data, unused_options):
+    """Incremental XOR starting key search.
+
+    Args:
+      incoming_data: String of data to process.
+      unused_options: Not used.
+
+    Returns:
+      String listing the best keys, their scores and decoded data.
+    """
+    sample = incoming_data[:BRUTE_FORCE_QUICK_SAMPLE_SIZE]
+    quick_scores = [scoring.QuickScore(_IncrementalXor(sample, key))
+                    for key in compat.xrange(256)]
+    return _BruteForce(incoming_data, quick_scores, _IncrementalXor)
+
+
+class RepeatingKeyXor(object):
+
+  def __init__(self):
+    self.streaming = streaming.STATEFUL
+
+  def _ParseKey(self, options):
+    key = bytearray(binascii.unhexlify(options[0]))
+    if not key:
+      raise ValueError('An XOR key is required.')
+    return key
+
+  def Compile(self, options):
+    """Parses the XOR key once.
+
+    Args:
+      options: String representation in hexadecimal of the key.
+
+    Returns:
+      Callable taking the string of data to process.
+    """
+    key = self._ParseKey(options)
+    return lambda incoming_data: _RepeatingKeyXor(incoming_data, key)
+
+  def Incremental(self, options):
+    return _RepeatingKeyXorStream(self._ParseKey(options))
+
+  def Process(self, incoming_data, options):
+    """Repeating key XOR.
+
+    Args:
+      incoming_data: String of data to process.
+      options: String representation in hexadecimal of the key.
+
+    Returns:
+      String after XOR has been completed.
+    """
+    return self.Compile(options)(incoming_data)
+
+
+class SolveRepeatingKeyXor(object):
+
+  def __init__(self):
+    self.streaming = streaming.WHOLE_INPUT
+
+  def KeyLength(self, sample, max_key_length):
+    """Estimates the key length of repeating key XORed data.
+
+    Splitting the data into as many columns as the key is long gives columns
+    each XORed with a single key byte, which keep the uneven byte frequencies
+    of the plain text. Each candidate length is scored by the index of
+    coincidence of its columns, which is much lower for a wrong length, whose
+    columns mix several key bytes. Unlike the Hamming distance between the
+    data and itself shifted, this does not favour short lengths for keys of
+    similar ASCII characters.
+
+    Args:
+      sample: String of data to examine.
+      max_key_length: Longest key length to consider.
+
+    Returns:
+      The estimated key length.
+    """
+    scores = {}
+    for length in compat.xrange(1, min(max_key_length, len(sample) // 2) + 1):
+      scores[length] = sum(
+          _Coincidence(sample[offset::length])
+          for offset in compat.xrange(length)) / length
+    if not scores:
+      return 1
+    best = max(scores, key=scores.get)
+    return min(length for length in scores
+               if best % length == 0 and
+               scores[length] >= scores[best] * KEY_LENGTH_TOLERANCE)
+
+  def Key(self, sample, key_length):
+    """Recovers each key byte by frequency analysis of its column.
+
+    Args:
+      sample: String of data to examine.
+      key_length: Length of the key.
+
+    Returns:
+      Bytearray key.
+    """
+    key = bytearray()
+    for offset in compat.xrange(key_length):
+      histogram = _Histogram(sample[offset::key_length])
+      key.append(max(compat.xrange(256),
+                     key=lambda k: scoring.HistogramScore(histogram, k)))
+    return key
+
+  def Process(self, incoming_data, options):
+    """Repeating key XOR key search.
+
+    Args:
+      incoming_data: String of data to process.
+      options: Optional maximum key length.
+
+    Returns:
+      String with the key in hexadecimal followed by the decoded data.
+    """
+    max_key_length = int(options[0]) if options and options[0] else (
+        DEFAULT_MAX_KEY_LENGTH)
+    key = self.Key(incoming_data[:KEY_SAMPLE_SIZE], self.KeyLength(
+        incoming_data[:KEY_LENGTH_SAMPLE_SIZE], max_key_length))
+    return b'Key %s:\n%s' % (binascii.hexlify(key),
+                             _RepeatingKeyXor(incoming_data, key))
@@ -0,0 +1,127 @@
+"""Tests for the Xor plugins.
+
+Run the plugin tests from the backend directory with:
+  python -m unittest discover -p '*_test.py'
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import binascii
+import random
+import unittest
+
+from plugins import compat
+from plugins import xor
+
+PLAIN_TEXT = (
+    b'The analyst opened the capture late in the evening and began to read '
+    b'through the requests one at a time. Most of them were ordinary: a few '
+    b'images, a style sheet, the usual scripts that every page on the site '
+    b'loaded. Near the end, however, there was a long post to an address '
+    b'nobody on the team recognised, and its body looked like noise. She '
+    b'copied it into the decoder, tried base 64 first and then hex, and when '
+    b'neither gave anything readable she guessed that it had been scrambled '
+    b'with a short password. Malware authors rarely bother with real '
+    b'encryption when a repeating key will hide their strings from a casual '
+    b'search, and the password is usually a word they could remember without '
+    b'writing it down. Within a minute the tool had found the length of the '
+    b'key, recovered each of its bytes from the frequencies of the letters '
+    b'they covered, and printed the configuration of the implant in plain '
+    b'text, including the list of servers it would contact next.\n')
+
+
+def _LoopXor(incoming_data, key):
+  """The original per-character XOR, kept to check the translate tables."""
+  return b''.join(compat.BYTE_CHARS[i ^ key] for i in bytearray(incoming_data))
+
+
+def _LoopIncrementalXor(incoming_data, key):
+  """The original per-character incremental XOR."""
+  output_data = []
+  for i in bytearray(incoming_data):
+    output_data.append(compat.BYTE_CHARS[i ^ key])
+    key = (key + 1) % 256
+  return b''.join(output_data)
+
+
+def _RandomInputs(seed):
+  """Yields random byte strings of assorted lengths, with random hex keys."""
+  rng = random.Random(seed)
+  for size in (0, 1, 255, 256, 257, 1000, 4096):
+    key = rng.randrange(256)
+    yield (compat.ByteString(rng.randrange(256) for _ in compat.xrange(size)),
+           key, ['%02x' % key])
+
+
+class XorTest(unittest.TestCase):
+
+  def testMatchesLoop(self):
+    plugin = xor.Xor()
+    for data, key, options in _RandomInputs(3):
+      self.assertEqual(_LoopXor(data, key), plugin.Process(data, options))
+
+
+class IncrementalXorTest(unittest.TestCase):
+
+  def testMatchesLoop(self):
+    plugin = xor.IncrementalXor()
+    for data, key, options in _RandomInputs(3):
+      self.assertEqual(_LoopIncrementalXor(data, key),
+                       plugin.Process(data, options))
+
+  def testStreamMatchesLoop(self):
+    plugin = xor.IncrementalXor()
+    rng = random.Random(5)
+    for data, key, options in _RandomInputs(5):
+      stream = plugin.Incremental(options)
+      chunks = []
+      start = 0
+      while start < len(data):
+        end = start + rng.randrange(1, 600)
+        chunks.append(stream.Process(data[start:end]))
+        start = end
+      chunks.append(stream.Flush())
+      self.assertEqual(_LoopIncrementalXor(data, key), b''.join(chunks))
+
+
+class SolveRepeatingKeyXorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.solver = xor.SolveRepeatingKeyXor()
+
+  def assertSolves(self, key):
+    encrypted = xor._RepeatingKeyXor(PLAIN_TEXT, bytearray(key))
+    key_line, decoded = self.solver.Process(encrypted, []).split(b':\n', 1)
+    self.assertEqual(b'Key ' + binascii.hexlify(key), key_line)
+    self.assertEqual(PLAIN_TEXT, decoded)
+
+  def testAsciiKeys(self):
+    # Keys of similar ASCII characters used to be taken for a short divisor.
+    for key in (b'secretkey', b'infected', b'malware', b'abc', b'hunter2'):
+      self.assertSolves(key)
+
+  def testHighEntropyKeys(self):
+    for key in (b'\x13\x37\xbe\xef', b'XORkey', b'\xfe'):
+      self.assertSolves(key)
+
+  def testKeyLengthIsShortestPeriod(self):
+    encrypted = xor._RepeatingKeyXor(PLAIN_TEXT, bytearray(b'abab'))
+    self.assertEqual(2, self.solver.KeyLength(encrypted, 64))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,94 @@
+"""Caches the results of running data through a plugin chain.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import collections
+import hashlib
+import threading
+
+import plugin_handler
+
+
+def Key(data, plugins):
+  """Returns a cache key for data run through a plugin chain.
+
+  Args:
+    data: Text to be processed.
+    plugins: List of dicts with plugins to process: [{'name': 'Base 64 Encode'}]
+
+  Returns:
+    Tuple of the SHA-256 digest of data and the canonical plugin chain.
+  """
+  return hashlib.sha256(data).digest(), plugin_handler.ChainKey(plugins)
+
+
+class ResultCache(object):
+  """Least recently used cache bounded by entry count and total size."""
+
+  def __init__(self, max_entries, max_bytes, max_item_bytes=None):
+    """Initializer.
+
+    Args:
+      max_entries: Maximum number of results to keep.
+      max_bytes: Maximum combined length of the results to keep.
+      max_item_bytes: Results longer than this are not cached. Defaults to
+        max_bytes.
+    """
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.max_item_bytes = max_item_bytes or max_bytes
+    self.hits = 0
+    self.misses = 0
+    self._size = 0
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def Get(self, key):
+    """Returns the cached result for key, or None."""
+    with self._lock:
+      result = self._entries.pop(key, None)
+      if result is None:
+        self.misses += 1
+        return None
+      self._entries[key] = result
+      self.hits += 1
+      return result
+
+  def Put(self, key, result):
+    """Caches result, evicting the least recently used results to fit it."""
+    if len(result) > self.max_item_bytes:
+      return
+    with self._lock:
+      previous = self._entries.pop(key, None)
+      if previous is not None:
+        self._size -= len(previous)
+      self._entries[key] = result
+      self._size += len(result)
+      while (len(self._entries) > self.max_entries or
+             self._size > self.max_bytes):
+        _, evicted = self._entries.popitem(last=False)
+        self._size -= len(evicted)
+
+  def Stats(self):
+    """Returns a dict of hit, miss, entry and size counters."""
+    with self._lock:
+      return {
+          'hits': self.hits,
+          'misses': self.misses,
+          'entries': len(self._entries),
+          'bytes': self._size}
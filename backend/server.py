@@ -0,0 +1,489 @@
+#!/usr/bin/python
+
+"""Standalone Babbage server, for running the backend without App Engine.
+
+Serves the same /convert, /batchconvert, /magic, /listplugins, /cachestats and
+/metrics API as main.py over HTTP/1.1 with keep-alive, including binary
+/convert requests. /convertstream responses are sent with chunked transfer
+encoding as the plugins produce output, which App Engine can not do.
+
+Connections are handled by a fixed pool of threads. When every thread is busy
+and the queue of waiting connections is full, new connections are answered
+with 503 at once rather than left to pile up. Plugin chains on inputs larger
+than the inline limit, and every /magic search, run in a pool of worker
+processes so that they use every core. Each such request may use at most a
+given number of CPU seconds in its worker. A worker which does not answer
+in time, stuck in a single long C call, can not be interrupted, so its pool
+is replaced by a fresh one. Smaller inputs run on the connection's thread,
+which can not be stopped, so they have no CPU limit; -i 0 sends every input
+to a worker. A batch is run a chunk of jobs at a time, each chunk with its
+own limit, and the jobs of a chunk which runs out of time fail on their own
+rather than failing the batch. Streams run on the connection's
+thread, stopping between chunks once they exceed the wall clock limit of a
+worker, are cancelled, or their client goes away.
+
+server.py [-a <address>] [-p <port>] [-t <threads>] [-w <workers>]
+          [-q <queue size>] [-c <cpu seconds>] [-i <inline bytes>]
+ -a: Address to listen on, default all interfaces.
+ -p: Port to listen on, default 8080.
+ -t: Threads handling connections, default 32.
+ -w: Worker processes running plugin chains, default one per core. With 0,
+     every request runs on its connection's thread.
+ -q: Connections which may wait for a free thread, default 64.
+ -c: CPU seconds a request may use in a worker process, default 10.
+ -i: Inputs up to this many bytes run on the connection's thread, without a
+     CPU limit, default 65536.
+
+Examples:
+  ./server.py -p 8000
+  - Serves the API on port 8000 with a worker process per core.
+
+  ./server.py -w 0 -t 8
+  - Serves the API from 8 threads without worker processes.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import argparse
+import json
+import logging
+import multiprocessing
+import signal
+import socket
+import threading
+import time
+
+try:
+  from http import server as http_server
+  import queue
+  from urllib import parse as urlparse
+except ImportError:
+  # Python 2
+  import BaseHTTPServer as http_server
+  import Queue as queue
+  import urlparse
+
+import convert
+import magic
+import plugin_handler
+from plugins import compat
+
+DEFAULT_PORT = 8080
+DEFAULT_THREADS = 32
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_CPU_SECONDS = 10.0
+DEFAULT_INLINE_MAX_BYTES = 64 * 1024
+# Idle keep-alive connections are closed after this many seconds, freeing
+# their thread.
+KEEP_ALIVE_SECONDS = 5
+# A worker which does not answer within this multiple of the CPU limit, for
+# example because it is stuck in a single long C call, is given up on.
+WALL_CLOCK_FACTOR = 3
+# Jobs of a /batchconvert request run in one call, sharing its CPU limit.
+BATCH_CHUNK_JOBS = 32
+# Largest request body accepted.
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+HEADERS = ('Origin,Accept,X-Requested-With,Content-Type,' +
+           convert.PLUGINS_HEADER)
+REJECTION = (b'HTTP/1.1 503 Service Unavailable\r\n'
+             b'Content-Length: 0\r\n'
+             b'Retry-After: 1\r\n'
+             b'Connection: close\r\n\r\n')
+
+
+class CpuTimeout(BaseException):
+  """Raised in a worker process when a request runs out of CPU time.
+
+  Not an Exception, so that the error handling of plugins, pipelines and the
+  magic search lets it through.
+  """
+
+
+def _OnCpuTimeout(unused_signum, unused_frame):
+  raise CpuTimeout()
+
+
+def _InitWorker():
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  signal.signal(signal.SIGPROF, _OnCpuTimeout)
+
+
+def _RunLimited(cpu_seconds, function_name, args):
+  """Runs a function of the convert module with a CPU time limit.
+
+  Runs in a worker process.
+
+  Args:
+    cpu_seconds: CPU seconds the call may use.
+    function_name: Name of the function in the convert module.
+    args: Tuple of arguments for the function.
+
+  Returns:
+    The result of the function.
+
+  Raises:
+    plugin_handler.Error: The function failed or ran out of CPU time.
+  """
+  signal.setitimer(signal.ITIMER_PROF, cpu_seconds)
+  try:
+    return getattr(convert, function_name)(*args)
+  except CpuTimeout:
+    raise plugin_handler.Error(
+        'CPU time limit of %g seconds exceeded.' % cpu_seconds)
+  finally:
+    signal.setitimer(signal.ITIMER_PROF, 0)
+
+
+class Executor(object):
+  """Runs conversions on the calling thread or in worker processes."""
+
+  def __init__(self, workers, cpu_seconds, inline_max_bytes):
+    """Initializer.
+
+    Args:
+      workers: Number of worker processes, or 0 to run everything inline.
+      cpu_seconds: CPU seconds a call may use in a worker process.
+      inline_max_bytes: Inputs up to this size run on the calling thread.
+    """
+    self._workers = workers
+    self._pool = multiprocessing.Pool(workers, _InitWorker) if workers else None
+    self._retired = []
+    self._lock = threading.Lock()
+    self.cpu_seconds = cpu_seconds
+    self._inline_max_bytes = inline_max_bytes
+
+  def Run(self, size, function_name, *args):
+    """Runs a function of the convert module.
+
+    Calls on the calling thread are not limited, as a thread can not be
+    stopped.
+
+    Args:
+      size: Size of the input in bytes, or None to always use a worker.
+      function_name: Name of the function in the convert module.
+      *args: Arguments for the function.
+
+    Returns:
+      The result of the function.
+
+    Raises:
+      plugin_handler.Error: The function failed or ran out of time.
+    """
+    pool = self._pool
+    if pool is None or (size is not None and size <= self._inline_max_bytes):
+      return getattr(convert, function_name)(*args)
+    result = pool.apply_async(
+        _RunLimited, (self.cpu_seconds, function_name, args))
+    try:
+      return result.get(self.cpu_seconds * WALL_CLOCK_FACTOR)
+    except multiprocessing.TimeoutError:
+      self._Recycle(pool)
+      raise plugin_handler.Error('Timed out.')
+
+  def _Recycle(self, pool):
+    """Replaces a pool with a worker stuck past its wall clock limit.
+
+    The old pool is terminated once every call already sent to it has
+    answered or timed out itself.
+    """
+    with self._lock:
+      if self._pool is not pool:
+        return
+      logging.warning('A worker timed out, replacing the worker pool.')
+      self._pool = multiprocessing.Pool(self._workers, _InitWorker)
+      self._retired.append(pool)
+    timer = threading.Timer(self.cpu_seconds * WALL_CLOCK_FACTOR,
+                            self._Terminate, (pool,))
+    timer.daemon = True
+    timer.start()
+
+  def _Terminate(self, pool):
+    with self._lock:
+      if pool not in self._retired:
+        return
+      self._retired.remove(pool)
+    pool.terminate()
+    pool.join()
+
+  def ExecutePipeline(self, plugins, data, allocations=False):
+    return self.Run(len(data), 'ExecutePipeline', plugins, data, allocations)
+
+  def ExecuteStages(self, plugins, data, allocations=False):
+    return self.Run(len(data), 'ExecuteStages', plugins, data, allocations)
+
+  def ExecuteBatch(self, jobs, max_bytes):
+    """Runs the jobs BATCH_CHUNK_JOBS at a time, each chunk with its own limit.
+
+    The jobs of a chunk which fails as a whole, by running out of time, each
+    get its failure.
+    """
+    results = []
+    for start in compat.xrange(0, len(jobs), BATCH_CHUNK_JOBS):
+      if max_bytes <= 0:
+        break
+      chunk = jobs[start:start + BATCH_CHUNK_JOBS]
+      try:
+        ran = self.Run(sum(len(job['data']) for job in chunk),
+                       'ExecuteBatch', chunk, max_bytes)
+      except plugin_handler.Error as e:
+        ran = [{'failure': str(e), 'stages': []} for _ in chunk]
+      max_bytes -= sum(len(result.get('success', b'')) for result in ran)
+      results.extend(ran)
+      if len(ran) < len(chunk):
+        break
+    return results
+
+  def Close(self):
+    with self._lock:
+      pools = [self._pool] + self._retired if self._pool is not None else []
+      self._retired = []
+    for pool in pools:
+      pool.terminate()
+      pool.join()
+
+
+class PooledHTTPServer(http_server.HTTPServer):
+  """HTTP server handling connections on a fixed pool of threads."""
+
+  def __init__(self, address, handler_class, executor, threads, queue_size):
+    """Initializer.
+
+    Args:
+      address: Tuple of the address and port to listen on.
+      handler_class: BaseHTTPRequestHandler subclass handling requests.
+      executor: Executor running the conversions.
+      threads: Number of threads handling connections.
+      queue_size: Connections which may wait for a free thread.
+    """
+    http_server.HTTPServer.__init__(self, address, handler_class)
+    self.executor = executor
+    self._connections = queue.Queue(queue_size)
+    for _ in compat.xrange(threads):
+      thread = threading.Thread(target=self._Serve)
+      thread.daemon = True
+      thread.start()
+
+  def _Serve(self):
+    while True:
+      request, client_address = self._connections.get()
+      try:
+        self.finish_request(request, client_address)
+      except socket.error:
+        pass
+      except Exception:
+        self.handle_error(request, client_address)
+      finally:
+        self.shutdown_request(request)
+
+  def process_request(self, request, client_address):
+    """Queues a connection, or rejects it if the queue is full."""
+    try:
+      self._connections.put_nowait((request, client_address))
+    except queue.Full:
+      try:
+        request.sendall(REJECTION)
+      except socket.error:
+        pass
+      self.shutdown_request(request)
+
+
+class Handler(http_server.BaseHTTPRequestHandler):
+  """Serves the Babbage API."""
+
+  protocol_version = 'HTTP/1.1'
+  server_version = 'Babbage'
+  timeout = KEEP_ALIVE_SECONDS
+
+  def _Respond(self, status, body, methods='GET',
+               content_type='application/json; charset=utf-8'):
+    if isinstance(body, compat.text_type):
+      body = body.encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('Access-Control-Allow-Origin', '*')
+    self.send_header('Access-Control-Allow-Methods', methods + ',OPTIONS')
+    self.send_header('Access-Control-Allow-Headers', HEADERS)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_OPTIONS(self):
+    self._Respond(200, '', 'GET,POST')
+
+  def do_GET(self):
+    path = urlparse.urlparse(self.path).path
+    if path == '/listplugins':
+      body = plugin_handler.ListPlugins()
+    elif path == '/cachestats':
+      body = convert.RESULTS.Stats()
+    elif path == '/metrics':
+      body = {'stages': convert.STAGES.Snapshot(),
+              'cache': convert.RESULTS.Stats(),
+              'sessions': convert.SESSIONS.Stats()}
+    else:
+      self._Respond(404, '')
+      return
+    self._Respond(200, ")]}',\n" + json.dumps(body))
+
+  def do_POST(self):
+    length = int(self.headers.get('Content-Length') or 0)
+    if length > MAX_BODY_SIZE:
+      self.close_connection = 1
+      self._Respond(413, '', 'POST')
+      return
+    body = self.rfile.read(length)
+    path = urlparse.urlparse(self.path).path
+    content_type = self.headers.get('Content-Type', '').split(';')[0].strip()
+    if path == '/convert' and content_type == convert.BINARY_CONTENT_TYPE:
+      self._PostBinary(body)
+      return
+    try:
+      request = json.loads(body.decode('utf-8'))
+    except ValueError:
+      self._Respond(400, '', 'POST')
+      return
+    if path == '/convertstream' and request.get('input') is not None:
+      self._PostStream(request)
+      return
+    try:
+      body = self._Dispatch(path, request)
+    except Exception:
+      logging.exception('Request to %s failed.', self.path)
+      self._Respond(500, '', 'POST')
+      return
+    if body is None:
+      self._Respond(404, '', 'POST')
+      return
+    self._Respond(200, body, 'POST')
+
+  def _PostBinary(self, body):
+    """Converts a raw body, with the plugins in a header, to a raw response."""
+    try:
+      status, content_type, body = convert.ProcessBinary(
+          body, self.headers.get(convert.PLUGINS_HEADER),
+          execute=self.server.executor.ExecutePipeline)
+    except Exception:
+      logging.exception('Request to %s failed.', self.path)
+      self._Respond(500, '', 'POST')
+      return
+    self._Respond(status, body, 'POST', content_type)
+
+  def _PostStream(self, request):
+    """Sends the lines of a /convertstream response as they are produced.
+
+    A new stream on the same 'channel' cancels this one.
+    """
+    self.send_response(200)
+    self.send_header('Content-Type', convert.STREAM_CONTENT_TYPE)
+    self.send_header('Transfer-Encoding', 'chunked')
+    self.send_header('Access-Control-Allow-Origin', '*')
+    self.send_header('Access-Control-Allow-Methods', 'POST,OPTIONS')
+    self.send_header('Access-Control-Allow-Headers', HEADERS)
+    self.end_headers()
+    channel = request.get('channel')
+    cancelled = convert.StartStream(channel)
+    deadline = time.time() + (
+        self.server.executor.cpu_seconds * WALL_CLOCK_FACTOR)
+    try:
+      for line in convert.StreamProcess(request['input'], request['plugins'],
+                                        cancelled, deadline):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+        self.wfile.flush()
+      self.wfile.write(b'0\r\n\r\n')
+    except socket.error:
+      # The client went away, which ends the stream like a cancellation.
+      self.close_connection = 1
+    finally:
+      convert.EndStream(channel, cancelled)
+
+  def _Dispatch(self, path, request):
+    """Returns the response body for a POST, or None for an unknown path."""
+    executor = self.server.executor
+    if path == '/convert':
+      if request.get('input') is None:
+        return ''
+      if request.get('session'):
+        return convert.SessionProcess(
+            request['input'], request['plugins'], request['session'],
+            version=request.get('version'), have=request.get('have'),
+            window=request.get('window'), trace=bool(request.get('trace')),
+            execute=executor.ExecuteStages)
+      return convert.Process(request['input'], request['plugins'],
+                             trace=bool(request.get('trace')),
+                             window=request.get('window'),
+                             execute=executor.ExecutePipeline)
+    if path == '/cancel':
+      return convert.CancelStream(request.get('channel'))
+    if path == '/batchconvert':
+      if request.get('jobs') is not None:
+        jobs = request['jobs']
+      elif request.get('inputs') is not None:
+        jobs = [{'input': input_text, 'plugins': request.get('plugins')}
+                for input_text in request['inputs']]
+      else:
+        return ''
+      return convert.BatchProcess(jobs, execute=executor.ExecuteBatch)
+    if path == '/magic':
+      if request.get('input') is None:
+        return ''
+      try:
+        return executor.Run(
+            None, 'MagicProcess', request['input'],
+            int(request.get('depth', magic.DEFAULT_MAX_DEPTH)),
+            int(request.get('beam', magic.DEFAULT_BEAM_WIDTH)),
+            int(request.get('top', magic.DEFAULT_TOP_K)))
+      except plugin_handler.Error as e:
+        return json.dumps({'failure': str(e)})
+    return None
+
+  def log_message(self, message_format, *args):
+    logging.info('%s %s', self.address_string(), message_format % args)
+
+
+def main(args):
+  logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+  # The worker processes are forked before any connection threads start.
+  executor = Executor(args.w, args.c, args.i)
+  server = PooledHTTPServer((args.a, args.p), Handler, executor, args.t, args.q)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    executor.Close()
+
+
+if __name__ == '__main__':
+  arg_parser = argparse.ArgumentParser()
+  arg_parser.add_argument('-a', default='', help='Address to listen on')
+  arg_parser.add_argument('-p', type=int, default=DEFAULT_PORT,
+                          help='Port to listen on')
+  arg_parser.add_argument('-t', type=int, default=DEFAULT_THREADS,
+                          help='Threads handling connections')
+  arg_parser.add_argument('-w', type=int, default=multiprocessing.cpu_count(),
+                          help='Worker processes running plugin chains')
+  arg_parser.add_argument('-q', type=int, default=DEFAULT_QUEUE_SIZE,
+                          help='Connections which may wait for a thread')
+  arg_parser.add_argument('-c', type=float, default=DEFAULT_CPU_SECONDS,
+                          help='CPU seconds a request may use in a worker')
+  arg_parser.add_argument('-i', type=int, default=DEFAULT_INLINE_MAX_BYTES,
+                          help='Largest input in bytes run without a worker')
+  arg_parser.add_argument('-v', '--verbose', action='store_true',
+                          help='Log every request')
+  main(arg_parser.parse_args())
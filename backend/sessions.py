@@ -0,0 +1,192 @@
+"""Keeps the output of each stage of a client's last conversion.
+
+A client editing one stage of a long chain would otherwise have every stage
+rerun. Each stage output is stored under a key chained from the input and
+the plugins up to that stage, so a conversion resumes after the longest
+unchanged prefix of the chain.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import collections
+import hashlib
+import json
+import threading
+
+import plugin_handler
+from plugins import compat
+
+
+def PrefixKeys(data, plugins):
+  """Returns a key for each prefix of a plugin chain run over data.
+
+  Args:
+    data: Text to be processed.
+    plugins: List of dicts with plugins to process: [{'name': 'Base 64 Encode'}]
+
+  Returns:
+    List of len(plugins) + 1 digests. The first identifies data alone and
+    each later one the data run through one more plugin.
+  """
+  keys = [hashlib.sha256(data).digest()]
+  for stage in plugin_handler.ChainKey(plugins):
+    keys.append(hashlib.sha256(
+        keys[-1] + json.dumps(stage).encode('utf-8')).digest())
+  return keys
+
+
+# Bytes compared at a time when looking for where two outputs differ.
+COMPARE_BLOCK_SIZE = 64 * 1024
+
+
+def CommonPrefixLength(first, second):
+  """Returns the length of the common prefix of two strings.
+
+  The length is shortened so as not to split a UTF-8 character.
+  """
+  length = min(len(first), len(second))
+  first_view, second_view = memoryview(first), memoryview(second)
+  low = 0
+  # Skip equal blocks without copying them, then bisect the first unequal one.
+  while (low + COMPARE_BLOCK_SIZE <= length and
+         first_view[low:low + COMPARE_BLOCK_SIZE] ==
+         second_view[low:low + COMPARE_BLOCK_SIZE]):
+    low += COMPARE_BLOCK_SIZE
+  high = min(low + COMPARE_BLOCK_SIZE, length)
+  while low < high:
+    middle = (low + high + 1) // 2
+    if first[low:middle] == second[low:middle]:
+      low = middle
+    else:
+      high = middle - 1
+  while (low and low < len(second) and
+         (bytearray(second[low:low + 1])[0] & 0xC0) == 0x80):
+    low -= 1
+  return low
+
+
+class Session(object):
+  """The stage outputs and final output of a client's last conversion."""
+
+  def __init__(self):
+    self.outputs = {}
+    self.key = None
+    self.output = None
+    self.version = 0
+    self.lock = threading.Lock()
+
+  @property
+  def size(self):
+    return (sum(len(output) for output in self.outputs.values()) +
+            len(self.output or ''))
+
+  def _Get(self, key):
+    if key == self.key:
+      return self.output
+    return self.outputs.get(key)
+
+  def Resume(self, keys):
+    """Finds where a chain can resume.
+
+    Args:
+      keys: PrefixKeys of the chain.
+
+    Returns:
+      Tuple of the number of stages whose output is stored and that output,
+      or (0, None) if no stage output is stored.
+    """
+    for stage in compat.xrange(len(keys) - 1, 0, -1):
+      output = self._Get(keys[stage])
+      if output is not None:
+        return stage, output
+    return 0, None
+
+  def Store(self, keys, start, outputs, output, max_bytes):
+    """Replaces the stored outputs with those of a new conversion.
+
+    Outputs of earlier stages are dropped first to stay within max_bytes, as
+    edits are most often made near the end of a chain.
+
+    Args:
+      keys: PrefixKeys of the chain.
+      start: Number of stages the conversion resumed after.
+      outputs: Outputs of the stages run, after the first start stages.
+      output: The final output.
+      max_bytes: Maximum combined length of the outputs to keep.
+    """
+    by_stage = [(stage, self._Get(keys[stage]))
+                for stage in compat.xrange(1, min(start + 1, len(keys) - 1))]
+    by_stage.extend(zip(compat.xrange(start + 1, len(keys)), outputs))
+    stored = {}
+    size = len(output)
+    for stage, stage_output in reversed(by_stage):
+      if stage_output is None or stage == len(keys) - 1:
+        continue
+      size += len(stage_output)
+      if size > max_bytes:
+        break
+      stored[keys[stage]] = stage_output
+    self.outputs = stored
+    self.key = keys[-1] if len(keys) > 1 else None
+    self.output = output
+    self.version += 1
+
+
+class SessionStore(object):
+  """Least recently used sessions, bounded by count and total size."""
+
+  def __init__(self, max_sessions, max_bytes, max_session_bytes):
+    """Initializer.
+
+    Args:
+      max_sessions: Maximum number of sessions to keep.
+      max_bytes: Maximum combined size of the sessions to keep.
+      max_session_bytes: Maximum combined length of one session's outputs.
+    """
+    self.max_sessions = max_sessions
+    self.max_bytes = max_bytes
+    self.max_session_bytes = max_session_bytes
+    self._sessions = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def Get(self, session_id):
+    """Returns the session with the id, starting a new one if there is none."""
+    with self._lock:
+      session = self._sessions.pop(session_id, None) or Session()
+      self._sessions[session_id] = session
+      self._Evict()
+      return session
+
+  def Evict(self):
+    """Drops the least recently used sessions until the rest fit."""
+    with self._lock:
+      self._Evict()
+
+  def _Evict(self):
+    size = sum(session.size for session in self._sessions.values())
+    while self._sessions and (len(self._sessions) > self.max_sessions or
+                              size > self.max_bytes):
+      _, evicted = self._sessions.popitem(last=False)
+      size -= evicted.size
+
+  def Stats(self):
+    """Returns a dict of session and size counters."""
+    with self._lock:
+      return {
+          'sessions': len(self._sessions),
+          'bytes': sum(session.size
+                       for session in self._sessions.values())}
@@ -0,0 +1,117 @@
+"""Values passed between the stages of a pipeline.
+
+Stages pass bytes from one to the next. Plugins which work on text instead
+set their 'text' attribute, and are given the data decoded with the encoding
+declared for it, UTF-8 unless the caller says otherwise. Text is kept as it
+is between consecutive text stages and only encoded again before a stage
+which wants bytes, so a chain decodes and encodes at most once per change of
+kind. Streams are decoded and encoded with incremental codecs, so characters
+split across chunks are carried over rather than the stream being buffered.
+
+Copyright 2014 Google Inc. All rights reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__author__ = 'tomfitzgerald@google.com (Tom Fitzgerald)'
+
+import codecs
+
+from plugins import compat
+
+DEFAULT_ENCODING = 'utf-8'
+# Undecodable bytes become U+FFFD rather than failing a text stage.
+DECODE_ERRORS = 'replace'
+
+
+class Value(object):
+  """Bytes, or text, with the encoding converting between the two.
+
+  Each form is made from the other only when asked for, and then kept.
+  """
+
+  __slots__ = ('_bytes', '_text', 'encoding')
+
+  def __init__(self, data, encoding=None):
+    """Initializer.
+
+    Args:
+      data: Bytes or text.
+      encoding: Name of the encoding the data is declared to be in, or None
+        for DEFAULT_ENCODING.
+    """
+    if isinstance(data, compat.text_type):
+      self._bytes, self._text = None, data
+    else:
+      self._bytes, self._text = data, None
+    self.encoding = encoding or DEFAULT_ENCODING
+
+  @property
+  def is_text(self):
+    return self._bytes is None
+
+  def Bytes(self):
+    if self._bytes is None:
+      self._bytes = self._text.encode(self.encoding)
+    return self._bytes
+
+  def Text(self):
+    if self._text is None:
+      self._text = self._bytes.decode(self.encoding, DECODE_ERRORS)
+    return self._text
+
+  def Get(self, text):
+    """Returns the text if text is true, otherwise the bytes."""
+    return self.Text() if text else self.Bytes()
+
+  def __len__(self):
+    return len(self._text if self._bytes is None else self._bytes)
+
+
+def Decoded(chunks, encoding=None):
+  """Decodes an iterable of chunks, passing on chunks which are already text.
+
+  Args:
+    chunks: Iterable of bytes or text.
+    encoding: Name of the encoding, or None for DEFAULT_ENCODING.
+
+  Yields:
+    Text.
+  """
+  decoder = codecs.getincrementaldecoder(encoding or DEFAULT_ENCODING)(
+      DECODE_ERRORS)
+  for chunk in chunks:
+    if isinstance(chunk, compat.text_type):
+      yield chunk
+    else:
+      yield decoder.decode(chunk)
+  yield decoder.decode(b'', True)
+
+
+def Encoded(chunks, encoding=None):
+  """Encodes an iterable of chunks, passing on chunks which are already bytes.
+
+  Args:
+    chunks: Iterable of bytes or text.
+    encoding: Name of the encoding, or None for DEFAULT_ENCODING.
+
+  Yields:
+    Bytes.
+  """
+  encoder = codecs.getincrementalencoder(encoding or DEFAULT_ENCODING)()
+  for chunk in chunks:
+    if isinstance(chunk, compat.text_type):
+      yield encoder.encode(chunk)
+    else:
+      yield chunk
+  yield encoder.encode(u'', True)
@@ -8,11 +8,31 @@ provided list of plugins and print the result.
 
 To display the list of plugins, run babbage without any arguments.
 
-babbage [-f <File>] [-l] <plugin> [<option> ...] [<plugin> ...]
- -f: Specifies an input file to process
+babbage [-f <File>] [-o <File>] [-l [-j <N> [-u]]] <plugin> [<option> ...]
+        [<plugin> ...]
+babbage [-f <File>] [-o <File>] [-j <N>] -m
+babbage [-f <File>] [-o <File>] [-t csv|jsonl] -c <field> [-c <field> ...]
+        [-j <N> [-u]] <plugin> [<option> ...] [<plugin> ...]
+ -f: Specifies an input file to process. Regular files are memory mapped and
+     copied to the plugins a chunk at a time, so only the chunks in use, not
+     the whole file, are held in memory.
+ -o: Write the output to a file instead of standard output. The output is
+     written as it is produced, without adding a trailing newline.
  -l: Switch from full file processing to line by line processing. This will have
      a dramatic effect on the output of some plugins, for example base_64_encode
      will return an encoding per line as opposed to a single encoding.
+ -j: In line by line or record mode, process batches of lines or records on N
+     worker processes. With -m, run the search on N worker processes.
+ -u: With -j, print results as soon as they are ready instead of in input
+     order.
+ -c: Switch to record mode, running only this field of each record through the
+     plugins and writing the records back out. Fields are CSV columns, named by
+     the header row or numbered from 1, or JSON object keys. May be given more
+     than once. Fields which fail to decode are left as they are.
+ -t: The format of the records for -c: csv (the default) or jsonl, one JSON
+     object per line.
+ -m: Search for the plugin chains which best decode the input and print them
+     instead of running a given list of plugins.
 
 Examples:
   ./babbage.py -f in.txt replace 0 3 hex2ascii
@@ -30,15 +50,84 @@ Examples:
   ./babbage.py -f replace.txt -l replace A Z
   - This will process each line from a file named replace.txt changing all A's
     to Z's.
+
+  ./babbage.py -f b64.txt -l -j 8 base_64_d hex2ascii
+  - This will decode each line from b64.txt on 8 worker processes, printing the
+    results in the same order as the input lines.
+
+  ./babbage.py -f disk.img -o disk.txt xor 20
+  - This will xor each byte of disk.img with 0x20, writing the result to
+    disk.txt.
+
+  ./babbage.py -f export.csv -o decoded.csv -c payload -j 8 base_64_d
+  - This will base 64 decode the payload column of every row of export.csv on
+    8 worker processes, writing the rows with the decoded column to
+    decoded.csv.
+
+  ./babbage.py -f events.jsonl -t jsonl -c query url_decode
+  - This will url decode the query field of each JSON object in events.jsonl.
+
+  ./babbage.py -f unknown.txt -m
+  - This will print the plugin chains which turn unknown.txt into the most
+    readable text, along with their output.
 """
 
+from __future__ import print_function
+
 import argparse
+import collections
+import csv
+import io
+import itertools
+import json
+import mmap
+import multiprocessing
+import os
+import stat
 import sys
 
+import magic
 import plugin_handler
+from plugins import compat
+from plugins import streaming
+
+CHUNK_SIZE = 1024 * 1024
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+# Lines sent to a worker process at a time in parallel line by line mode.
+BATCH_SIZE = 1000
+# Batches queued per worker process, bounding memory use on large inputs.
+BATCHES_PER_WORKER = 4
+# Seconds between checks for any finished batch when results are unordered.
+RESULT_POLL_INTERVAL = 0.01
+
+CSV_FORMAT = 'csv'
+JSONL_FORMAT = 'jsonl'
+RECORD_FORMATS = (CSV_FORMAT, JSONL_FORMAT)
+# Under Python 3, CSV fields are read and written as text with any bytes which
+# are not UTF-8 smuggled through as surrogates, so they come out unchanged.
+CSV_ERRORS = 'surrogateescape'
+# Encoded payloads are often larger than the csv module's default field limit.
+CSV_FIELD_SIZE_LIMIT = 2 ** 31 - 1
+
+# Plugin descriptions with and without the plugins declared through entry
+# points, each built on first use.
+_plugin_lists = {}
+
+
+def PluginList(discover=True):
+  """Returns the plugin descriptions.
 
+  Args:
+    discover: Whether to include plugins declared through entry points.
+      Looking those up is slow, so names are matched against the built in
+      plugins first.
 
-PLUGIN_LIST = plugin_handler.ListPlugins()
+  Returns:
+    A list of plugin description dictionaries.
+  """
+  if discover not in _plugin_lists:
+    _plugin_lists[discover] = plugin_handler.ListPlugins(discover)
+  return _plugin_lists[discover]
 
 
 def RetrievePlugin(name):
@@ -48,6 +137,9 @@ def RetrievePlugin(name):
   matching plugins. For example, 'base_64_d' would return ['base_64_decoder']
   whereas 'base_64' would return ['base_64_decoder', 'base_64_encoder'].
 
+  Built in plugins are matched first. Plugins declared through entry points
+  are only looked up if none matches.
+
   Args:
     name: Name of the plugin to find.
 
@@ -55,13 +147,12 @@ def RetrievePlugin(name):
     A list of plugins associated with the name or None.
   """
   name = name.lower().replace('_', ' ')
-  potentials = []
-  for plugin in PLUGIN_LIST:
-    if plugin['name'].lower().startswith(name):
-      potentials.append(plugin)
-  if not potentials:
-    return None
-  return potentials
+  for plugin_list in (PluginList(discover=False), PluginList()):
+    potentials = [plugin for plugin in plugin_list
+                  if plugin['name'].lower().startswith(name)]
+    if potentials:
+      return potentials
+  return None
 
 
 def GetPlugins(args):
@@ -90,15 +181,16 @@ def GetPlugins(args):
         options = []
       plugins = RetrievePlugin(s)
       if not plugins:
-        print >> sys.stderr, 'Plugin not found:', s
-        print >> sys.stderr, ''
+        print('Plugin not found:', s, file=sys.stderr)
+        print('', file=sys.stderr)
         DisplayPluginList()
         sys.exit(1)
       if len(plugins) > 1:
-        print >> sys.stderr, 'Ambigious plugin name found:', s
-        print >> sys.stderr, 'Possible matches: ' + ', '.join(
+        print('Ambigious plugin name found:', s, file=sys.stderr)
+        matches = ', '.join(
             plugin['name'].replace(' ', '_') for plugin in plugins)
-        print >> sys.stderr, ''
+        print('Possible matches: ' + matches, file=sys.stderr)
+        print('', file=sys.stderr)
         DisplayPluginList()
         sys.exit(1)
       plugin = plugins[0]
@@ -111,48 +203,443 @@ def GetPlugins(args):
 
 
 def DisplayPluginList():
-  print >> sys.stderr, 'The available plugins include:'
-  for plugin in PLUGIN_LIST:
+  print('The available plugins include:', file=sys.stderr)
+  for plugin in PluginList():
     plugin_name = plugin['name'].replace(' ', '_')
-    print >> sys.stderr, ' ' + plugin_name
-    print >> sys.stderr, '   - ' + plugin['description']
+    print(' ' + plugin_name, file=sys.stderr)
+    print('   - ' + plugin['description'], file=sys.stderr)
     if len(plugin['options']):
-      print >> sys.stderr, '   Arguments:'
+      print('   Arguments:', file=sys.stderr)
       for argument_tup in enumerate(plugin['options'], start=1):
-        print >> sys.stderr, '     %d: %s' % argument_tup
+        print('     %d: %s' % argument_tup, file=sys.stderr)
 
 
 def StripTerminalCodes(s, strip=True):
   """Remove terminal escape codes for safer display.
 
   Args:
-    s: The string to process
+    s: The bytes to process
     strip: Optional parameter to disable terminal code stripping
 
   Returns:
-    The string stripped of terminal codes.
+    The bytes stripped of terminal codes.
   """
   if strip:
-    return ''.join(s.split('\x1B'))
+    return b''.join(s.split(b'\x1B'))
   return s
 
 
+_worker_pipeline = None
+
+
+def _InitWorker(active_plugins):
+  global _worker_pipeline
+  _worker_pipeline = plugin_handler.CompilePipeline(active_plugins)
+
+
+def _ProcessBatch(lines):
+  return [_worker_pipeline.Process(line.rstrip()) for line in lines]
+
+
+_worker_decoder = None
+
+
+def _InitRecordWorker(active_plugins, record_format, fields, strip):
+  global _worker_decoder
+  _worker_decoder = RecordDecoder(active_plugins, record_format, fields, strip)
+
+
+def _DecodeRecordBatch(records):
+  return _worker_decoder.DecodeBatch(records)
+
+
+class RecordDecoder(object):
+  """Runs selected fields of CSV rows or JSON lines through a pipeline."""
+
+  def __init__(self, active_plugins, record_format, fields, strip=True):
+    """Initializer.
+
+    Args:
+      active_plugins: List of plugin description dictionaries.
+      record_format: CSV_FORMAT or JSONL_FORMAT.
+      fields: Indexes of the CSV columns, or keys of the JSON fields, to
+        decode.
+      strip: Whether to strip terminal codes from the decoded fields.
+    """
+    self._pipeline = plugin_handler.CompilePipeline(active_plugins)
+    self._fields = fields
+    self._strip = strip
+    if record_format == CSV_FORMAT:
+      self._decode = self._DecodeRow
+    else:
+      self._decode = self._DecodeJsonLine
+
+  def _Process(self, data):
+    """Returns data run through the pipeline, or None if that fails."""
+    try:
+      output = self._pipeline.Process(data)
+    except plugin_handler.Error:
+      return None
+    return StripTerminalCodes(output, strip=self._strip)
+
+  def _DecodeRow(self, row):
+    failures = 0
+    for index in self._fields:
+      if index >= len(row):
+        continue
+      value = row[index]
+      if isinstance(value, compat.text_type):
+        output = self._Process(value.encode('utf-8', CSV_ERRORS))
+        if output is not None:
+          output = output.decode('utf-8', CSV_ERRORS)
+      else:
+        output = self._Process(value)
+      if output is None:
+        failures += 1
+      else:
+        row[index] = output
+    return row, failures, 0
+
+  def _DecodeJsonLine(self, line):
+    if not line.strip():
+      return b'', 0, 0
+    try:
+      record = json.loads(line.decode('utf-8'),
+                          object_pairs_hook=collections.OrderedDict)
+    except ValueError:
+      return line.rstrip(b'\r\n'), 0, 1
+    if not isinstance(record, dict):
+      return line.rstrip(b'\r\n'), 0, 1
+    failures = 0
+    for key in self._fields:
+      value = record.get(key)
+      if not isinstance(value, compat.text_type):
+        continue
+      output = self._Process(value.encode('utf-8', 'replace'))
+      if output is None:
+        failures += 1
+      else:
+        # JSON holds text, so output which is not UTF-8 is replaced.
+        record[key] = output.decode('utf-8', 'replace')
+    return json.dumps(record, ensure_ascii=False).encode('utf-8'), failures, 0
+
+  def DecodeBatch(self, records):
+    """Decodes the fields of a batch of records.
+
+    Args:
+      records: List of CSV rows, or of lines of JSON.
+
+    Returns:
+      Tuple of the list of decoded records, CSV rows or lines of JSON without
+      their line ending, the number of fields which failed to decode and the
+      number of records, lines which are not a JSON object, which were copied
+      unchanged.
+    """
+    decoded = []
+    failures = 0
+    skipped = 0
+    for record in records:
+      record, failed, unparsed = self._decode(record)
+      decoded.append(record)
+      failures += failed
+      skipped += unparsed
+    return decoded, failures, skipped
+
+
+def MapFile(f):
+  """Memory maps a file read only.
+
+  Args:
+    f: The file to map.
+
+  Returns:
+    An mmap of the whole file, or None if it is not a non-empty regular file,
+    such as a pipe.
+  """
+  try:
+    info = os.fstat(f.fileno())
+    if not stat.S_ISREG(info.st_mode) or not info.st_size:
+      return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  except (AttributeError, EnvironmentError, ValueError):
+    return None
+
+
+def ReadChunks(f, whole=False):
+  """Reads a file as chunks of at most CHUNK_SIZE bytes.
+
+  Regular files are sliced out of a memory map, so no chunk passes through
+  the file object's read buffer and only the pages in use are resident. Each
+  slice is a copy, as the plugins take bytes.
+
+  Args:
+    f: The file to read.
+    whole: Whether to yield the file as a single chunk, for chains which
+      buffer their whole input anyway. This avoids holding both the chunks and
+      their concatenation.
+
+  Yields:
+    Bytes of data.
+  """
+  mapping = MapFile(f)
+  if mapping is None:
+    if whole:
+      yield f.read()
+    else:
+      for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+        yield chunk
+    return
+  try:
+    if whole:
+      yield mapping[:]
+    else:
+      for offset in compat.xrange(0, len(mapping), CHUNK_SIZE):
+        yield mapping[offset:offset + CHUNK_SIZE]
+  finally:
+    mapping.close()
+
+
+def ReadBatches(f, batch_size):
+  """Splits a file, or any iterable of records, into lists of lines.
+
+  Args:
+    f: The file to read.
+    batch_size: Maximum number of lines in a batch.
+
+  Yields:
+    Lists of lines.
+  """
+  while True:
+    batch = list(itertools.islice(f, batch_size))
+    if not batch:
+      return
+    yield batch
+
+
+def ProcessInParallel(batches, jobs, process, initializer, initargs,
+                      ordered=True):
+  """Processes batches of lines or records on a pool of worker processes.
+
+  Each worker compiles its own pipeline once, in initializer. Only a few
+  batches per worker are in flight at any time, so the input is never read
+  into memory whole.
+
+  Args:
+    batches: Iterable of lists of lines or records.
+    jobs: Number of worker processes.
+    process: Function run on a worker for each batch.
+    initializer: Function run on each worker when it starts.
+    initargs: Tuple of arguments for initializer.
+    ordered: Whether results are yielded in input order. If False, batches are
+      yielded as soon as they are finished.
+
+  Yields:
+    The result of process for each batch.
+  """
+  pool = multiprocessing.Pool(jobs, initializer, initargs)
+  pending = collections.deque()
+
+  def NextResult():
+    if ordered:
+      return pending.popleft().get()
+    # Wait briefly on the oldest batch between scans, so that whichever batch
+    # finishes first is returned rather than the oldest.
+    while True:
+      for result in pending:
+        if result.ready():
+          pending.remove(result)
+          return result.get()
+      pending[0].wait(RESULT_POLL_INTERVAL)
+
+  try:
+    for batch in batches:
+      pending.append(pool.apply_async(process, (batch,)))
+      if len(pending) >= jobs * BATCHES_PER_WORKER:
+        yield NextResult()
+    while pending:
+      yield NextResult()
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+
+
+def ColumnIndexes(header, columns):
+  """Finds CSV columns by name, or by number from 1.
+
+  If a column is not found, this will print an error and exit(1) the script.
+
+  Args:
+    header: The header row.
+    columns: List of column names or numbers.
+
+  Returns:
+    List of column indexes.
+  """
+  indexes = []
+  for column in columns:
+    if column in header:
+      indexes.append(header.index(column))
+    elif column.isdigit() and int(column) > 0:
+      indexes.append(int(column) - 1)
+    else:
+      print('Column not found:', column, file=sys.stderr)
+      print('The columns are: ' + ', '.join(header), file=sys.stderr)
+      sys.exit(1)
+  return indexes
+
+
+def DecodeRecords(f, out, active_plugins, record_format, fields, jobs=1,
+                  ordered=True, strip=True):
+  """Decodes fields of each record of a file and writes the records out.
+
+  Records are read, decoded and written in batches of BATCH_SIZE, each batch
+  written with a single call, and the batches are decoded on a pool of jobs
+  worker processes if jobs is more than 1. CSV rows are parsed and written
+  again by the csv module in this process, so fields may hold quoted line
+  breaks; JSON lines are parsed by the workers.
+
+  Args:
+    f: The binary file to read.
+    out: Binary file to write the records to.
+    active_plugins: List of plugin description dictionaries.
+    record_format: CSV_FORMAT, whose first row is the header, or JSONL_FORMAT.
+    fields: List of CSV column names or numbers, or of JSON keys.
+    jobs: Number of worker processes.
+    ordered: Whether records are written in input order.
+    strip: Whether to strip terminal codes from the decoded fields.
+
+  Returns:
+    Tuple of the number of fields which failed to decode and were left
+    unchanged, and the number of records which could not be parsed and were
+    copied unchanged.
+  """
+  if record_format == CSV_FORMAT and compat.PY3:
+    f = io.TextIOWrapper(f, encoding='utf-8', errors=CSV_ERRORS, newline='')
+    out = io.TextIOWrapper(out, encoding='utf-8', errors=CSV_ERRORS,
+                           newline='')
+  try:
+    if record_format == CSV_FORMAT:
+      csv.field_size_limit(CSV_FIELD_SIZE_LIMIT)
+      records = csv.reader(f)
+      writer = csv.writer(out, lineterminator='\n')
+      header = next(records, None)
+      if header is None:
+        return 0, 0
+      writer.writerow(header)
+      fields = ColumnIndexes(header, fields)
+      write = writer.writerows
+    else:
+      records = f
+      write = lambda lines: out.write(b''.join(line + b'\n' for line in lines))
+    batches = ReadBatches(records, BATCH_SIZE)
+    initargs = (active_plugins, record_format, fields, strip)
+    if jobs > 1:
+      results = ProcessInParallel(batches, jobs, _DecodeRecordBatch,
+                                  _InitRecordWorker, initargs, ordered=ordered)
+    else:
+      decoder = RecordDecoder(*initargs)
+      results = (decoder.DecodeBatch(batch) for batch in batches)
+    failures = 0
+    skipped = 0
+    for decoded, failed, unparsed in results:
+      write(decoded)
+      failures += failed
+      skipped += unparsed
+    return failures, skipped
+  finally:
+    if isinstance(out, io.TextIOWrapper):
+      # Leave the underlying files open for the caller.
+      out.flush()
+      out.detach()
+      f.detach()
+
+
+def DisplayMagic(data, jobs, out, strip=True):
+  """Prints the plugin chains which best decode data.
+
+  Args:
+    data: Bytes to decode.
+    jobs: Number of worker processes used by the search.
+    out: Binary file to print to.
+    strip: Optional parameter to disable terminal code stripping
+  """
+  pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+  try:
+    candidates = magic.Search(data, pool=pool)
+  finally:
+    if pool:
+      pool.terminate()
+  for candidate in candidates:
+    out.write(('%.3f %s\n' % (candidate.score, ' '.join(
+        name.replace(' ', '_') for name in candidate.chain))).encode('utf-8'))
+    out.write(b'   ' + StripTerminalCodes(candidate.output, strip=strip) +
+              b'\n')
+
+
 def main(args):
+  if args.o:
+    out = open(args.o, 'wb', OUTPUT_BUFFER_SIZE)
+  else:
+    # Plugins output bytes, which Python 3 writes through the buffer.
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+  try:
+    Run(args, out, args.ns)
+  finally:
+    if args.o:
+      out.close()
+
+
+def Run(args, out, strip):
+  """Processes the input as the arguments ask.
+
+  Args:
+    args: The parsed command line arguments.
+    out: Binary file to write the output to.
+    strip: Whether to strip terminal codes from the output.
+  """
+  if args.m:
+    DisplayMagic(b''.join(ReadChunks(args.f, whole=True)), args.j, out,
+                 strip=strip)
+    return
   active_plugins = list(GetPlugins(args.plugins))
   if not active_plugins:
-    print >> sys.stderr, 'No plugins specified.'
+    print('No plugins specified.', file=sys.stderr)
     DisplayPluginList()
     sys.exit(1)
-  if args.l:
+  pipeline = plugin_handler.CompilePipeline(active_plugins)
+  if args.c:
+    # Record mode
+    failures, skipped = DecodeRecords(args.f, out, active_plugins, args.t,
+                                      args.c, jobs=args.j, ordered=not args.u,
+                                      strip=strip)
+    if failures:
+      print('%d fields could not be decoded and were left unchanged.' %
+            failures, file=sys.stderr)
+    if skipped:
+      print('%d records were not JSON objects and were copied unchanged.' %
+            skipped, file=sys.stderr)
+  elif args.l and args.j > 1:
+    # Parallel line by line mode
+    for results in ProcessInParallel(ReadBatches(args.f, BATCH_SIZE), args.j,
+                                     _ProcessBatch, _InitWorker,
+                                     (active_plugins,), ordered=not args.u):
+      for result in results:
+        out.write(StripTerminalCodes(result, strip=strip) + b'\n')
+  elif args.l:
     # Line by line mode
     for line in args.f:
       line = line.rstrip()
-      result = plugin_handler.ProcessPlugins(line, active_plugins)
-      print StripTerminalCodes(result, strip=args.ns)
+      result = pipeline.Process(line)
+      out.write(StripTerminalCodes(result, strip=strip) + b'\n')
   else:
-    # Full file mode
-    result = plugin_handler.ProcessPlugins(args.f.read(), active_plugins)
-    print StripTerminalCodes(result, strip=args.ns)
+    # Full file mode, streamed through the plugins in chunks
+    whole = bool(pipeline.stages) and (
+        pipeline.stages[0].streaming == streaming.WHOLE_INPUT)
+    for result in pipeline.Stream(ReadChunks(args.f, whole=whole)):
+      out.write(StripTerminalCodes(result, strip=strip))
+    if not args.o:
+      out.write(b'\n')
 
 
 if __name__ == '__main__':
@@ -161,8 +648,20 @@ if __name__ == '__main__':
                           help='Preserve terminal codes in the output')
   arg_parser.add_argument('-l', action='store_true',
                           help='Process each line individually')
-  arg_parser.add_argument('-f', type=argparse.FileType('r'), default=sys.stdin,
+  arg_parser.add_argument('-j', type=int, default=1,
+                          help='Number of worker processes for -l, -c or -m')
+  arg_parser.add_argument('-u', action='store_true',
+                          help='With -j, print results in completion order')
+  arg_parser.add_argument('-c', action='append',
+                          help='Decode this field of each CSV or JSONL record')
+  arg_parser.add_argument('-t', choices=RECORD_FORMATS, default=CSV_FORMAT,
+                          help='Record format for -c')
+  arg_parser.add_argument('-m', action='store_true',
+                          help='Search for plugins which decode the input')
+  arg_parser.add_argument('-f', type=argparse.FileType('rb'),
+                          default=getattr(sys.stdin, 'buffer', sys.stdin),
                           help='Input file')
+  arg_parser.add_argument('-o', help='Output file')
   arg_parser.add_argument('plugins', nargs=argparse.REMAINDER,
                           help='The list of plugins and their arguments')
   main(arg_parser.parse_args())
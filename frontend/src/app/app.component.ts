@@ -2,6 +2,16 @@ import { Component, OnInit } from '@angular/core';
 import { HttpClient } from '@angular/common/http';
 import { environment } from '../environments/environment';
 
+// Bytes of UTF-8 output fetched from the backend at a time.
+const OUTPUT_PAGE_LENGTH = 64 * 1024;
+
+// Returns the start of text up to a length counted in UTF-8 bytes, the unit of
+// the backend's offsets.
+function keepBytes(text: string, length: number): string {
+  const bytes = new TextEncoder().encode(text);
+  return new TextDecoder().decode(bytes.slice(0, length));
+}
+
 export interface IPlugin {
   description: string;
   options: any[];
@@ -20,6 +30,13 @@ export class AppComponent implements OnInit {
   public plugins: IPlugin[] = [];
   public selectedPlugins: IPlugin[] = [];
   public model = { input: '', output: '' };
+  public nextOffset = 0;
+  public totalLength = 0;
+  // Lets the backend keep each stage's output, so a conversion after an edit
+  // only reruns the stages from the edited one on.
+  private session =
+    Math.random().toString(36).slice(2) + Date.now().toString(36);
+  private version: number = null;
   public backend: string = environment.production
     ? 'https://backend-dot-babbage-stable.appspot.com/'
     : 'http://localhost:8080';
@@ -49,16 +66,40 @@ export class AppComponent implements OnInit {
   }
 
   async convert() {
+    this.fetchOutput(0, true);
+  }
+
+  hasMoreOutput(): boolean {
+    return this.nextOffset < this.totalLength;
+  }
+
+  loadMoreOutput() {
+    this.fetchOutput(this.nextOffset, false);
+  }
+
+  /**
+   * Fetches a page of output. With delta set, the backend may instead return
+   * only the output from where it differs from the output already shown.
+   */
+  private fetchOutput(offset: number, delta: boolean) {
     const url = this.backend + '/convert';
     const values = {
       input: this.model.input,
       plugins: this.selectedPlugins,
+      window: { offset, length: OUTPUT_PAGE_LENGTH },
+      session: this.session,
+      version: delta ? this.version : null,
+      have: this.nextOffset,
     };
     this.http.post(url, values).subscribe((results: any) => {
-      if (results.error) {
+      if (results.error || results.failure !== undefined) {
         return;
       }
-      this.model.output = results.success as string;
+      const page = results.success as string;
+      this.model.output = keepBytes(this.model.output, results.offset) + page;
+      this.nextOffset = results.next_offset;
+      this.totalLength = results.total_length;
+      this.version = results.version;
     });
   }
 }